@@ -0,0 +1,5 @@
+"""
+Benchmark scripts for the watermark pipeline.
+
+Run from the repository root, e.g. ``python -m benchmarks.overlay_filter``.
+"""
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Aggregate throughput of concurrent encodes, with and without the CPU governor.
+
+For each concurrency level, that many copies of one fixture are watermarked
+at the same time with VideoProcessor's command line, once with FFmpeg's
+default thread count (every encode sizes itself to all visible cores) and
+once with the threads the CpuGovernor hands out. Reported are the wall time
+for the whole batch, the aggregate frames per second and the CPU time used.
+
+--cpus restricts the benchmark and its FFmpeg children to fewer cores,
+and --budget sets the governor's budget, e.g. to stand in for a container
+CPU quota that FFmpeg itself cannot see.
+
+Usage:
+    python -m benchmarks.cpu_budget [--jobs 1,2,4] [--size 720] [--seconds 10]
+        [--cpus N] [--budget N]
+"""
+
+import argparse
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+
+from benchmarks.encode_suite import FRAME_RATE, DEFAULT_FIXTURES_DIR, ensure_fixtures
+from config import WATERMARK_TEXT, SITE_TEXT, DEFAULT_ENCODER_PROFILE
+from cpu_governor import CpuGovernor, effective_cpus
+from encoder_profiles import PROFILES
+from ffmpeg_progress import run_with_progress
+from video_processor import VideoProcessor
+
+
+def run_batch(processor: VideoProcessor, governor, input_path: str, jobs: int,
+              work_dir: str) -> dict:
+    """Encode jobs copies of input_path at once; governor None means FFmpeg's default threads."""
+    info = processor.get_media_info(input_path)
+    profile = PROFILES[DEFAULT_ENCODER_PROFILE]
+    errors = []
+    threads_used = []
+
+    def encode(index):
+        output_path = os.path.join(work_dir, f'out_{index}.mp4')
+        try:
+            if governor is None:
+                threads_used.append(0)
+                cmd = processor.build_watermark_command(
+                    input_path, output_path, info, WATERMARK_TEXT, SITE_TEXT, 0, profile
+                )
+                run_with_progress(cmd, info.duration)
+            else:
+                with governor.lease() as threads:
+                    threads_used.append(threads)
+                    cmd = processor.build_watermark_command(
+                        input_path, output_path, info, WATERMARK_TEXT, SITE_TEXT, threads, profile
+                    )
+                    run_with_progress(cmd, info.duration)
+        except Exception as e:
+            errors.append(str(e))
+
+    cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    workers = [threading.Thread(target=encode, args=(index,)) for index in range(jobs)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+    cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    frames = jobs * info.duration * info.frame_rate
+    cpu = (cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime)
+    return {
+        'wall_s': round(wall, 2),
+        'aggregate_fps': round(frames / wall, 1),
+        'cpu_s': round(cpu, 2),
+        'threads': sorted(threads_used, reverse=True),
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', default='1,2,4',
+                        type=lambda value: [int(j) for j in value.split(',')])
+    parser.add_argument('--size', type=int, default=720, help="Fixture height")
+    parser.add_argument('--seconds', type=int, default=10, help="Fixture length")
+    parser.add_argument('--cpus', type=int, help="Pin the benchmark to this many cores")
+    parser.add_argument('--budget', type=float, help="Governor budget, detected if not given")
+    parser.add_argument('--fixtures-dir', default=DEFAULT_FIXTURES_DIR)
+    args = parser.parse_args()
+
+    if args.cpus:
+        os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:args.cpus])
+
+    name, input_path = next(
+        fixture for fixture in ensure_fixtures(args.fixtures_dir, [args.size], args.seconds)
+        if 'landscape_audio' in fixture[0]
+    )
+    processor = VideoProcessor()
+    report = {
+        'fixture': name,
+        'frame_rate': FRAME_RATE,
+        'effective_cpus': effective_cpus(),
+        'budget': args.budget,
+        'results': []
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for jobs in args.jobs:
+            governor = CpuGovernor(args.budget, slots=jobs)
+            report['budget'] = governor.total
+            report['results'].append({
+                'jobs': jobs,
+                'default_threads': run_batch(processor, None, input_path, jobs, work_dir),
+                'governor': run_batch(processor, governor, input_path, jobs, work_dir)
+            })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
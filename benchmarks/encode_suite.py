@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Reproducible end-to-end encode benchmark on synthetic fixtures.
+
+Fixtures are generated locally with lavfi (testsrc2 video, sine audio) for
+every combination of resolution, orientation and audio presence, and kept
+in a fixtures directory so later runs reuse identical inputs. Each fixture
+is watermarked by VideoProcessor.process_video and by telegram_bot.py's
+apply_watermarks, each in a fresh process, recording encode fps, wall time,
+CPU time and peak RSS (including FFmpeg children) and output size. Results
+are written as JSON and can be compared with an earlier run.
+
+Usage:
+    python -m benchmarks.encode_suite [--sizes 360,720,1080,2160] [--seconds 5]
+        [--targets video_processor,telegram_bot] [--output results.json]
+        [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from config import TEMP_DIR
+
+FRAME_RATE = 30
+SIZES = {360: (640, 360), 720: (1280, 720), 1080: (1920, 1080), 2160: (3840, 2160)}
+TARGETS = ('video_processor', 'telegram_bot')
+DEFAULT_FIXTURES_DIR = os.path.join(TEMP_DIR, 'bench_fixtures')
+
+
+def fixture_name(height: int, portrait: bool, audio: bool, seconds: int) -> str:
+    orientation = 'portrait' if portrait else 'landscape'
+    sound = 'audio' if audio else 'silent'
+    return f"{height}p_{orientation}_{sound}_{seconds}s.mp4"
+
+
+def make_fixture(path: str, height: int, portrait: bool, audio: bool, seconds: int):
+    """Generate one deterministic test clip with lavfi."""
+    width, height = SIZES[height]
+    if portrait:
+        width, height = height, width
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={FRAME_RATE}:duration={seconds}"
+    ]
+    if audio:
+        cmd += ['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+                '-c:a', 'aac', '-b:a', '128k']
+    cmd += [
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-g', str(FRAME_RATE * 2),
+        '-pix_fmt', 'yuv420p', '-threads', '1', '-fflags', '+bitexact',
+        '-movflags', '+faststart', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def ensure_fixtures(fixtures_dir: str, sizes, seconds: int) -> list:
+    """Create any missing fixtures and return (name, path) pairs."""
+    os.makedirs(fixtures_dir, exist_ok=True)
+    fixtures = []
+    for height in sizes:
+        for portrait in (False, True):
+            for audio in (True, False):
+                name = fixture_name(height, portrait, audio, seconds)
+                path = os.path.join(fixtures_dir, name)
+                if not os.path.exists(path):
+                    print(f"Generating {name}", file=sys.stderr)
+                    make_fixture(path, height, portrait, audio, seconds)
+                fixtures.append((name, path))
+    return fixtures
+
+
+def run_one(target: str, input_path: str) -> dict:
+    """Watermark one fixture in this process (invoked in a child by measure())."""
+    # Imported here so module import time is not part of the encode time
+    if target == 'video_processor':
+        from video_processor import VideoProcessor
+        from config import WATERMARK_TEXT, SITE_TEXT
+        processor = VideoProcessor()
+        start = time.perf_counter()
+        output_path = processor.process_video(input_path, WATERMARK_TEXT, SITE_TEXT)
+    else:
+        import telegram_bot
+        output_path = telegram_bot.spool.mkstemp('output_')
+        start = time.perf_counter()
+        if not telegram_bot.apply_watermarks(input_path, output_path):
+            os.unlink(output_path)
+            output_path = None
+    encode_s = time.perf_counter() - start
+
+    if not output_path:
+        return {'success': False}
+    size = os.path.getsize(output_path)
+    os.unlink(output_path)
+    return {'success': True, 'encode_s': round(encode_s, 3), 'output_bytes': size}
+
+
+def measure(target: str, input_path: str, frames: int) -> dict:
+    """
+    Run one target on one fixture in a fresh process.
+
+    Returns:
+        Dictionary with encode and process wall time, CPU time, peak RSS,
+        encode fps and output size
+    """
+    cmd = [sys.executable, '-m', 'benchmarks.encode_suite', '--run-one', target, input_path]
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    stdout = process.stdout.read()
+    # wait4 reports usage of the child and every FFmpeg process it waited for
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    try:
+        result = json.loads(stdout.decode().strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        result = {'success': False}
+    cpu = usage.ru_utime + usage.ru_stime
+    result.update({
+        'wall_s': round(wall, 3),
+        'cpu_s': round(cpu, 3),
+        'cpu_utilization': round(cpu / wall, 2) if wall else None,
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'encode_fps': round(frames / result['encode_s'], 2) if result.get('success') else None
+    })
+    return result
+
+
+def environment() -> dict:
+    """Describe the machine and tree a run was made on."""
+    def command_output(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    ffmpeg_version = command_output(['ffmpeg', '-version'])
+    return {
+        'commit': command_output(['git', 'rev-parse', '--short', 'HEAD']),
+        'dirty': bool(command_output(['git', 'status', '--porcelain', '--untracked-files=no'])),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version.splitlines()[0] if ffmpeg_version else None
+    }
+
+
+def compare(report: dict, baseline_path: str) -> list:
+    """Pair each case with the same case from an earlier report."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['target'], r['fixture']): r for r in baseline.get('results', [])}
+    rows = []
+    for result in report['results']:
+        old = previous.get((result['target'], result['fixture']))
+        if not old or not old.get('encode_fps') or not result.get('encode_fps'):
+            continue
+        rows.append({
+            'target': result['target'],
+            'fixture': result['fixture'],
+            'fps_ratio': round(result['encode_fps'] / old['encode_fps'], 3),
+            'cpu_ratio': round(result['cpu_s'] / old['cpu_s'], 3) if old['cpu_s'] else None,
+            'size_ratio': round(result['output_bytes'] / old['output_bytes'], 3)
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='360,720,1080,2160', help="Comma separated heights")
+    parser.add_argument('--seconds', type=int, default=5, help="Fixture length")
+    parser.add_argument('--targets', default=','.join(TARGETS))
+    parser.add_argument('--fixtures-dir', default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--compare', help="Earlier JSON report to compare against")
+    parser.add_argument('--run-one', nargs=2, metavar=('TARGET', 'INPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(*args.run_one)))
+        return
+
+    targets = [t for t in args.targets.split(',') if t]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    fixtures = ensure_fixtures(args.fixtures_dir, sizes, args.seconds)
+    frames = args.seconds * FRAME_RATE
+    report = {'environment': environment(), 'seconds': args.seconds, 'results': []}
+
+    for name, path in fixtures:
+        for target in targets:
+            print(f"{target}: {name}", file=sys.stderr)
+            result = measure(target, path, frames)
+            report['results'].append({'target': target, 'fixture': name, **result})
+
+    if args.compare:
+        report['comparison'] = {'baseline': args.compare, 'cases': compare(report, args.compare)}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
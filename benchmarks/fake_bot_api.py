@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API used by the benchmarks.
+
+Implements just enough of getUpdates (with long polling), sendMessage,
+sendVideo, getFile and file downloads to drive telegram_bot.py and its
+components without network access. It also counts TCP connections, so
+keep-alive reuse can be checked.
+
+With --local it behaves like telegram-bot-api --local: getFile returns the
+absolute path of the file in the shared files directory instead of a
+download path. --download-limit emulates the cloud API's refusal to hand
+out files above 20MB. File downloads honour Range requests; --rate throttles
+each connection and --drop-after cuts every file response short, to emulate
+a slow or flaky file server.
+
+Usage:
+    python -m benchmarks.fake_bot_api [--port 8081] [--files DIR] [--local]
+        [--download-limit BYTES] [--rate BYTES_PER_SECOND] [--drop-after BYTES]
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python telegram_bot.py
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeApiError(Exception):
+    """Raised by a fake method to answer with a Bad Request description."""
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    """Routes Bot API calls to the owning FakeBotApi server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_GET(self):
+        self._route(b'')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._route(self.rfile.read(length) if length else b'')
+
+    def _route(self, body: bytes):
+        path = urllib.parse.urlsplit(self.path).path
+        match = re.match(r'^/file/bot[^/]+/(.+)$', path)
+        if match:
+            self._send_file(match.group(1))
+            return
+
+        match = re.match(r'^/bot[^/]+/(\w+)$', path)
+        if not match:
+            self._send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+
+        method = match.group(1)
+        params = self._parse_params(body)
+        try:
+            result = self.server.handle_method(method, params, body)
+        except FakeApiError as e:
+            self._send_json(400, {'ok': False, 'error_code': 400,
+                                  'description': f'Bad Request: {e}'})
+            return
+        if result is None:
+            self._send_json(400, {'ok': False, 'error_code': 400,
+                                  'description': f'Bad Request: unsupported method {method}'})
+        else:
+            self._send_json(200, {'ok': True, 'result': result})
+
+    def _parse_params(self, body: bytes) -> dict:
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            params.update(urllib.parse.parse_qsl(body.decode()))
+        elif content_type.startswith('multipart/form-data'):
+            boundary = content_type.split('boundary=')[1].encode()
+            for part in body.split(b'--' + boundary):
+                header, _, value = part.partition(b'\r\n\r\n')
+                name = re.search(rb'name="([^"]+)"', header)
+                if name and b'filename=' not in header:
+                    params[name.group(1).decode()] = value[:-2].decode()
+        return params
+
+    def _send_file(self, file_path: str):
+        local_path = os.path.join(self.server.files_dir, file_path)
+        if not os.path.isfile(local_path):
+            self._send_json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+
+        size = os.path.getsize(local_path)
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header:
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+
+        with open(local_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            sent = 0
+            while remaining > 0:
+                if self.server.drop_after and sent >= self.server.drop_after:
+                    # Emulate a dropped connection partway through the body
+                    self.close_connection = True
+                    return
+                chunk = f.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                self.server.throttle(len(chunk))
+                try:
+                    self.wfile.write(chunk)
+                except ConnectionError:
+                    # The client stopped reading, e.g. after a size check failed
+                    self.close_connection = True
+                    return
+                remaining -= len(chunk)
+                sent += len(chunk)
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    """In-process fake Bot API server."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, files_dir: str = '.',
+                 bytes_per_second: int = 0, local_mode: bool = False, download_limit: int = 0,
+                 drop_after: int = 0):
+        super().__init__((host, port), FakeBotApiHandler)
+        self.files_dir = files_dir
+        self.bytes_per_second = bytes_per_second
+        self.local_mode = local_mode
+        self.download_limit = download_limit
+        self.drop_after = drop_after
+        self.connections = 0
+        self.calls = []
+        self.sent = []
+        self._updates = []
+        self._next_update_id = 1
+        self._files = {}
+        self._cond = threading.Condition()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> 'FakeBotApi':
+        """Serve in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count_connection(self):
+        with self._cond:
+            self.connections += 1
+
+    def throttle(self, size: int):
+        """Sleep to emulate a limited download bandwidth."""
+        if self.bytes_per_second:
+            time.sleep(size / self.bytes_per_second)
+
+    def add_file(self, file_id: str, file_path: str):
+        """Make a file under files_dir available through getFile."""
+        self._files[file_id] = file_path
+
+    def push_update(self, message: dict) -> int:
+        """Queue a message update and wake any long-polling getUpdates."""
+        with self._cond:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append({'update_id': update_id, 'message': message})
+            self._cond.notify_all()
+        return update_id
+
+    def handle_method(self, method: str, params: dict, body: bytes):
+        with self._cond:
+            self.calls.append((time.monotonic(), method))
+
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getFile':
+            file_path = self._files.get(params.get('file_id'))
+            if file_path is None:
+                return None
+            local_path = os.path.abspath(os.path.join(self.files_dir, file_path))
+            size = os.path.getsize(local_path)
+            if self.local_mode:
+                # A local server has no size cap and answers with a path on its disk
+                file_path = local_path
+            elif self.download_limit and size > self.download_limit:
+                raise FakeApiError('file is too big')
+            return {'file_id': params['file_id'], 'file_path': file_path, 'file_size': size}
+        if method in ('sendMessage', 'sendVideo', 'editMessageText'):
+            with self._cond:
+                self.sent.append((time.monotonic(), method, params, len(body)))
+                message_id = len(self.sent)
+            result = {'message_id': message_id, 'chat': {'id': params.get('chat_id')}}
+            if method == 'sendVideo':
+                result['video'] = {'file_id': params.get('video') or f'uploaded_{message_id}'}
+            return result
+        if method in ('setWebhook', 'deleteWebhook'):
+            return True
+        return None
+
+    def _get_updates(self, params: dict):
+        offset = int(params.get('offset', 0) or 0)
+        timeout = float(params.get('timeout', 0) or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Confirming an offset forgets everything below it, as Telegram does
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(self._updates[:100])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--files', default='.', help="Directory served for file downloads")
+    parser.add_argument('--local', action='store_true',
+                        help="Answer getFile with absolute local paths, like telegram-bot-api --local")
+    parser.add_argument('--download-limit', type=int, default=0,
+                        help="Refuse getFile above this many bytes, like the cloud API")
+    parser.add_argument('--rate', type=int, default=0, help="Download bytes per second per connection")
+    parser.add_argument('--drop-after', type=int, default=0,
+                        help="Close each file download after this many bytes")
+    args = parser.parse_args()
+
+    server = FakeBotApi(port=args.port, files_dir=args.files, local_mode=args.local,
+                        download_limit=args.download_limit, bytes_per_second=args.rate,
+                        drop_after=args.drop_after)
+    print(f"Fake Bot API listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Compare the per-frame cost of two drawtext filters against one pre-rendered overlay.
+
+Frames come straight from lavfi's testsrc2 and go to the null muxer, so no
+decoding or encoding is measured; a pass with no watermark filter is used as
+the baseline and subtracted from both variants.
+
+Usage:
+    python -m benchmarks.overlay_filter [--seconds 10] [--sizes 1920x1080,3840x2160]
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import time
+
+from config import (
+    WATERMARK_TEXT,
+    SITE_TEXT,
+    FONT_FILE,
+    FONT_COLOR,
+    FONT_OUTLINE_COLOR,
+    FONT_OUTLINE_WIDTH
+)
+from video_processor import VideoProcessor
+
+FRAME_RATE = 30
+
+
+def drawtext_graph(font_size: int) -> str:
+    """Filter graph equivalent to the former pair of drawtext filters."""
+    common = (
+        f"fontsize={font_size}:fontcolor={FONT_COLOR}:borderw={FONT_OUTLINE_WIDTH}"
+        f":bordercolor={FONT_OUTLINE_COLOR}:fontfile={FONT_FILE}"
+    )
+    return (
+        f"[0:v]drawtext=text='{WATERMARK_TEXT}':{common}"
+        f":x=w-tw-{font_size // 2}:y=h-th-{font_size // 2},"
+        f"drawtext=text='{SITE_TEXT}':{common}:x=(w-tw)/2:y={font_size // 2}[v]"
+    )
+
+
+def run_pass(size: str, seconds: int, filter_graph: str = None, overlay_path: str = None) -> dict:
+    """
+    Push generated frames through a filter graph into the null muxer.
+
+    Returns:
+        Dictionary with wall time and FFmpeg's reported user CPU time
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostats', '-benchmark',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate={FRAME_RATE}:duration={seconds}"
+    ]
+    if overlay_path:
+        cmd += ['-i', overlay_path]
+    if filter_graph:
+        cmd += ['-filter_complex', filter_graph, '-map', '[v]']
+    cmd += ['-f', 'null', '-']
+
+    start = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if 'rror' in line or 'No such' in line]
+        raise RuntimeError(errors[0] if errors else f"ffmpeg exited with {result.returncode}")
+
+    match = re.search(r"bench: utime=([\d.]+)s", result.stderr)
+    return {'wall_s': wall, 'utime_s': float(match.group(1)) if match else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=10, help="Clip length per pass")
+    parser.add_argument('--sizes', default="1920x1080,3840x2160", help="Comma separated WxH list")
+    args = parser.parse_args()
+
+    processor = VideoProcessor()
+    frames = args.seconds * FRAME_RATE
+    report = []
+
+    for size in args.sizes.split(','):
+        width, height = (int(v) for v in size.split('x'))
+        font_size = processor.calculate_font_size(width, height)
+
+        render_start = time.perf_counter()
+        overlay_path = processor.watermark_renderer.render(
+            width, height, font_size, WATERMARK_TEXT, SITE_TEXT
+        )
+        render_s = time.perf_counter() - render_start
+
+        baseline = run_pass(size, args.seconds)
+        overlay = run_pass(size, args.seconds, '[0:v][1:v]overlay=0:0[v]', overlay_path)
+        try:
+            drawtext = run_pass(size, args.seconds, drawtext_graph(font_size))
+        except RuntimeError as e:
+            drawtext = {'error': str(e)}
+
+        entry = {'size': size, 'frames': frames, 'overlay_render_s': render_s,
+                 'baseline': baseline, 'overlay': overlay, 'drawtext': drawtext}
+        for name in ('overlay', 'drawtext'):
+            result = entry[name]
+            if result.get('utime_s') is not None and baseline['utime_s'] is not None:
+                result['filter_ms_per_frame'] = (
+                    (result['utime_s'] - baseline['utime_s']) / frames * 1000
+                )
+        report.append(entry)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Exercise UpdatePoller against the local fake Bot API.
+
+Reports the reply latency of quick messages sent while another chat's slow
+job is running, how many getUpdates calls an idle period costs, how many TCP
+connections were opened, and the committed offset after everything finished.
+
+Usage:
+    python -m benchmarks.polling_dispatch [--slow-seconds 3] [--chats 5]
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from benchmarks.fake_bot_api import FakeBotApi
+from bot_api import BotApiClient
+from update_poller import UpdatePoller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--slow-seconds', type=float, default=3.0)
+    parser.add_argument('--chats', type=int, default=5)
+    parser.add_argument('--idle-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    server = FakeBotApi().start()
+    api = BotApiClient('TEST', base_url=server.base_url)
+    pushed_at = {}
+    replied_at = {}
+
+    def handler(update):
+        message = update['message']
+        if message['text'] == 'slow':
+            time.sleep(args.slow_seconds)
+        api.call('sendMessage', {'chat_id': message['chat']['id'], 'text': 'done'})
+        replied_at[update['update_id']] = time.monotonic()
+
+    commits = []
+    poller = UpdatePoller(api, handler, poll_timeout=30, on_commit=commits.append)
+    threading.Thread(target=poller.run, daemon=True).start()
+    time.sleep(0.2)
+
+    # Idle cost: calls made while nothing happens
+    calls_before = len(server.calls)
+    time.sleep(args.idle_seconds)
+    idle_calls = len(server.calls) - calls_before
+
+    slow_id = server.push_update({'chat': {'id': 1}, 'text': 'slow'})
+    pushed_at[slow_id] = time.monotonic()
+    for chat_id in range(2, args.chats + 1):
+        update_id = server.push_update({'chat': {'id': chat_id}, 'text': 'quick'})
+        pushed_at[update_id] = time.monotonic()
+
+    deadline = time.monotonic() + args.slow_seconds + 10
+    while len(replied_at) < len(pushed_at) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    latencies = {
+        update_id: round(replied_at[update_id] - pushed_at[update_id], 3)
+        for update_id in sorted(replied_at)
+    }
+    poller.stop(wait=False)
+    api.close()
+
+    print(json.dumps({
+        'idle_seconds': args.idle_seconds,
+        'idle_get_updates_calls': idle_calls,
+        'reply_latency_s': latencies,
+        'slow_update_id': slow_id,
+        'tcp_connections': server.connections,
+        'total_calls': len(server.calls),
+        'committed_offsets': commits,
+        'final_committed_offset': poller.committed_offset
+    }, indent=2))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
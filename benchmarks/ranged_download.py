@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Compare the former single-stream downloads with parallel ranged downloads.
+
+A random file is served by the fake Bot API with a per-connection bandwidth
+limit, as Telegram's file servers apply. Each method downloads it once on a
+clean server and once on a server that cuts every response short after
+--drop-after bytes: the former curl and urllib paths have to start over
+(and never finish if the file is larger than that), the ranged downloader
+resumes each part where it stopped.
+
+Usage:
+    python -m benchmarks.ranged_download [--size-mb 32] [--rate-mb 8]
+        [--connections 1,2,4,8] [--drop-after-mb 3]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.fake_bot_api import FakeBotApi
+from ranged_download import RangedDownloader, RangedDownloadError
+
+MB = 1024 * 1024
+FORMER_ATTEMPTS = 3
+
+
+def download_curl(url: str, path: str, size: int):
+    """The former primary path: one curl stream, 300s timeout."""
+    result = subprocess.run(['curl', '-sfL', '-o', path, url], capture_output=True, timeout=300)
+    if result.returncode != 0 or os.path.getsize(path) != size:
+        raise RuntimeError(f"curl exit {result.returncode}, {os.path.getsize(path)} bytes")
+
+
+def download_urllib(url: str, path: str, size: int):
+    """The former fallback: 8KB reads, starting from zero on any failure."""
+    with urllib.request.urlopen(url, timeout=300) as response, open(path, 'wb') as f:
+        while True:
+            chunk = response.read(8192)
+            if not chunk:
+                break
+            f.write(chunk)
+    if os.path.getsize(path) != size:
+        raise RuntimeError(f"incomplete: {os.path.getsize(path)} of {size} bytes")
+
+
+def run_former(method, url: str, path: str, size: int) -> dict:
+    """Run a former method, retrying from scratch like a user resending the video."""
+    started = time.monotonic()
+    for attempt in range(1, FORMER_ATTEMPTS + 1):
+        try:
+            method(url, path, size)
+            return {'seconds': round(time.monotonic() - started, 2), 'attempts': attempt}
+        except Exception as e:
+            error = str(e)
+    return {'failed': error, 'seconds': round(time.monotonic() - started, 2),
+            'attempts': FORMER_ATTEMPTS}
+
+
+def run_ranged(connections: int, url: str, path: str, size: int, digest: str) -> dict:
+    try:
+        result = RangedDownloader(connections=connections).download(url, path, size)
+    except RangedDownloadError as e:
+        return {'failed': str(e)}
+    return {
+        'seconds': round(result.seconds, 2),
+        'mb_per_second': round(result.size / MB / result.seconds, 1),
+        'connections': result.connections,
+        'resumes': result.resumes,
+        'intact': file_digest(path) == digest
+    }
+
+
+def file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def bench(files_dir: str, name: str, size: int, digest: str, args, drop_after: int) -> dict:
+    server = FakeBotApi(files_dir=files_dir, bytes_per_second=int(args.rate_mb * MB),
+                        drop_after=drop_after).start()
+    url = f"{server.base_url}/file/botTEST/{name}"
+    output = os.path.join(files_dir, 'download.out')
+    results = {
+        'curl': run_former(download_curl, url, output, size),
+        'urllib_8k': run_former(download_urllib, url, output, size)
+    }
+    for connections in args.connections:
+        results[f'ranged_{connections}'] = run_ranged(connections, url, output, size, digest)
+    server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--rate-mb', type=float, default=8, help="Bandwidth per connection")
+    parser.add_argument('--connections', default='1,2,4,8',
+                        type=lambda value: [int(c) for c in value.split(',')])
+    parser.add_argument('--drop-after-mb', type=float, default=3,
+                        help="Bytes per response on the flaky server")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as files_dir:
+        name = 'input.bin'
+        size = args.size_mb * MB
+        with open(os.path.join(files_dir, name), 'wb') as f:
+            f.write(os.urandom(size))
+        digest = file_digest(os.path.join(files_dir, name))
+
+        print(json.dumps({
+            'size_mb': args.size_mb,
+            'rate_mb_per_connection': args.rate_mb,
+            'clean_server': bench(files_dir, name, size, digest, args, 0),
+            'flaky_server': bench(files_dir, name, size, digest, args,
+                                  int(args.drop_after_mb * MB))
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Measure peak RSS of a sendVideo-style multipart upload against file size.
+
+Each upload runs in a fresh child process against a local HTTP server that
+discards the body, comparing the former in-memory body construction with
+the streaming MultipartEncoder.
+
+Usage:
+    python -m benchmarks.upload_memory [--sizes-mb 16,64,150]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from multipart_upload import MultipartEncoder
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    """Reads and drops the request body."""
+
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{"ok": true}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def upload_buffered(url: str, path: str):
+    """The former send_video body construction."""
+    with open(path, 'rb') as video_file:
+        video_data = video_file.read()
+    boundary = str(uuid.uuid4())
+    body = b''
+    body += f'--{boundary}\r\n'.encode()
+    body += b'Content-Disposition: form-data; name="chat_id"\r\n\r\n'
+    body += b'1\r\n'
+    body += f'--{boundary}\r\n'.encode()
+    body += b'Content-Disposition: form-data; name="video"; filename="watermarked_video.mp4"\r\n'
+    body += b'Content-Type: video/mp4\r\n\r\n'
+    body += video_data
+    body += b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    req = urllib.request.Request(url, data=body, method='POST')
+    req.add_header('Content-Type', f'multipart/form-data; boundary={boundary}')
+    urllib.request.urlopen(req).read()
+
+
+def upload_streaming(url: str, path: str):
+    """The streaming send_video body construction."""
+    body = MultipartEncoder({'chat_id': 1}, [('video', path, 'watermarked_video.mp4', 'video/mp4')])
+    req = urllib.request.Request(url, data=iter(body), headers=body.headers(), method='POST')
+    urllib.request.urlopen(req).read()
+
+
+def run_child(mode: str, path: str, url: str):
+    """Upload once and print this process's peak RSS in KiB."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    {'buffered': upload_buffered, 'streaming': upload_streaming}[mode](url, path)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'baseline_kib': baseline, 'peak_kib': peak}))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(*sys.argv[2:5])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes-mb', default="16,64,150", help="Comma separated file sizes")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/sendVideo"
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in (int(v) for v in args.sizes_mb.split(',')):
+            path = os.path.join(tmp, f"video_{size_mb}.mp4")
+            with open(path, 'wb') as f:
+                for _ in range(size_mb):
+                    f.write(os.urandom(1024 * 1024))
+
+            entry = {'size_mb': size_mb}
+            for mode in ('buffered', 'streaming'):
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.upload_memory', '--child', mode, path, url],
+                    capture_output=True, text=True, check=True
+                )
+                entry[mode] = json.loads(output.stdout)
+            report.append(entry)
+            os.unlink(path)
+
+    server.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Compare webhook delivery with polling on update latency.
+
+The webhook case posts updates from several keep-alive client connections
+to the keep-alive server, measuring the time to the acknowledgement and to
+the update handler starting, while the handler itself is slow; refused
+deliveries are retried as Telegram would. Each update comes from its own
+chat, so per-chat ordering does not add to the latency. The polling
+cases push the same updates into the fake Bot API and measure the time until
+UpdatePoller (long polling) or a one-second getUpdates loop, as the bot used
+to run, hands them to the handler.
+
+Usage:
+    python -m benchmarks.webhook_latency [--updates 200] [--clients 8]
+        [--interval 0.02] [--handler-seconds 0.05]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+
+from benchmarks.fake_bot_api import FakeBotApi
+from bot_api import BotApiClient
+from keep_alive import KeepAliveServer
+from update_poller import UpdatePoller
+
+SECRET = 'benchmark-secret'
+WORKERS = 32
+RETRY_SECONDS = 0.1
+
+
+def summarize(latencies: list) -> dict:
+    """Percentiles of a list of seconds, in milliseconds."""
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {'count': len(ordered), 'p50_ms': percentile(0.5), 'p95_ms': percentile(0.95),
+            'max_ms': round(ordered[-1] * 1000, 2)}
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'chat': {'id': chat_id}, 'text': 'hi'}}
+
+
+def start_keep_alive(handler) -> int:
+    """Run the keep-alive server in a background loop and return its port."""
+    ready = threading.Event()
+    port = []
+
+    async def main():
+        server = await KeepAliveServer(handler, secret=SECRET).start('127.0.0.1', 0)
+        port.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        async with server:
+            await server.serve_forever()
+
+    threading.Thread(target=asyncio.run, args=(main(),), daemon=True).start()
+    ready.wait()
+    return port[0]
+
+
+def wait_for(done: dict, count: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while len(done) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def bench_webhook(args) -> dict:
+    sent_at, started_at = {}, {}
+    ack_latencies = []
+    statuses = {}
+
+    def handler(update):
+        started_at[update['update_id']] = time.monotonic()
+        time.sleep(args.handler_seconds)
+
+    dispatcher = UpdatePoller(None, handler, workers=WORKERS)
+    port = start_keep_alive(dispatcher.feed)
+
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        for update_id in range(index + 1, args.updates + 1, args.clients):
+            body = json.dumps(make_update(update_id, update_id)).encode()
+            sent_at[update_id] = time.monotonic()
+            while True:
+                started = time.monotonic()
+                connection.request('POST', '/webhook', body, {
+                    'Content-Type': 'application/json',
+                    'X-Telegram-Bot-Api-Secret-Token': SECRET
+                })
+                response = connection.getresponse()
+                response.read()
+                ack_latencies.append(time.monotonic() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status == 200:
+                    break
+                # Telegram retries deliveries that were not accepted
+                time.sleep(RETRY_SECONDS)
+            time.sleep(args.interval)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wait_for(started_at, args.updates, args.updates * args.handler_seconds + 10)
+
+    # A delivery with the wrong secret must be refused
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('POST', '/webhook', json.dumps(make_update(0, 0)),
+                       {'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+    forged_status = connection.getresponse().status
+    dispatcher.stop(wait=False)
+
+    return {
+        'ack_latency': summarize(ack_latencies),
+        'update_to_handler': summarize([started_at[i] - sent_at[i] for i in started_at]),
+        'statuses': statuses,
+        'wrong_secret_status': forged_status
+    }
+
+
+def bench_polling(args, long_poll: bool) -> dict:
+    server = FakeBotApi().start()
+    api = BotApiClient('TEST', base_url=server.base_url)
+    pushed_at, started_at = {}, {}
+
+    def handler(update):
+        started_at[update['update_id']] = time.monotonic()
+        time.sleep(args.handler_seconds)
+
+    stop = threading.Event()
+    if long_poll:
+        poller = UpdatePoller(api, handler, workers=WORKERS, poll_timeout=30)
+        threading.Thread(target=poller.run, daemon=True).start()
+    else:
+        poller = UpdatePoller(api, handler, workers=WORKERS)
+
+        def interval_loop():
+            # The bot's original loop: getUpdates without a timeout once per second
+            offset = 0
+            while not stop.is_set():
+                for update in api.call('getUpdates', {'offset': offset or None, 'timeout': 0}) or []:
+                    offset = update['update_id'] + 1
+                    while not poller.feed(update):
+                        time.sleep(0.01)
+                stop.wait(1)
+
+        threading.Thread(target=interval_loop, daemon=True).start()
+    time.sleep(0.2)
+
+    calls_before = len(server.calls)
+    per_client = args.updates // args.clients
+    for round_index in range(per_client):
+        for client_index in range(args.clients):
+            chat_id = round_index * args.clients + client_index
+            update_id = server.push_update({'chat': {'id': chat_id}, 'text': 'hi'})
+            pushed_at[update_id] = time.monotonic()
+        time.sleep(args.interval)
+    wait_for(started_at, len(pushed_at), len(pushed_at) * args.handler_seconds + 10)
+
+    stop.set()
+    poller.stop(wait=False)
+    api.close()
+    result = {
+        'update_to_handler': summarize([started_at[i] - pushed_at[i] for i in started_at]),
+        'get_updates_calls': len([c for c in server.calls[calls_before:] if c[1] == 'getUpdates'])
+    }
+    server.shutdown()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=8, help="Parallel connections")
+    parser.add_argument('--interval', type=float, default=0.02, help="Pause between sends")
+    parser.add_argument('--handler-seconds', type=float, default=0.05, help="Work per update")
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'updates': args.updates,
+        'clients': args.clients,
+        'handler_seconds': args.handler_seconds,
+        'webhook': bench_webhook(args),
+        'long_polling': bench_polling(args, long_poll=True),
+        'interval_polling': bench_polling(args, long_poll=False)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
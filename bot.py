@@ -3,11 +3,14 @@ Telegram bot implementation for video watermarking.
 """
 
 import os
-import tempfile
+import asyncio
 import logging
+from contextlib import nullcontext
 from typing import Optional
 
+from telegram import Message
 from telegram._update import Update
+from telegram.error import Forbidden, TelegramError
 from telegram.ext import (
     Application, 
     CommandHandler, 
@@ -21,18 +24,84 @@ from config import (
     WATERMARK_TEXT, 
     SITE_TEXT, 
     MAX_FILE_SIZE, 
-    MESSAGES
+    MAX_DOWNLOAD_SIZE,
+    LOCAL_BOT_API,
+    API_BASE_URL,
+    MESSAGES,
+    STREAMING_INGEST,
+    ADMISSION_MAX_DRAIN_SECONDS,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    JOB_MAX_RESUMES
 )
 from video_processor import VideoProcessor
+from job_executor import JobExecutor, QueueFullError, estimate_job_cost
+from encoder_profiles import select_profile
+from output_metadata import companion_paths
+from renditions import Rendition, existing_renditions
+from ffmpeg_progress import EncodeProgress, ProgressReporter
+from result_cache import ResultCache
+from single_flight import SingleFlight
+from streaming_ingest import IngestDownloadError
+from spool_manager import SpoolFullError
+from local_files import link_local_file, local_file_path
+from ranged_download import RangedDownloader
+from job_store import JobStore, JobRecord, DOWNLOADED, ENCODED
+from cancellation import (CancelRegistry, CancelToken, JobCancelledError, CANCEL_CHAT_GONE,
+                          CANCEL_DEADLINE)
+from keep_alive import serve, start_server_thread
+from metrics import (
+    JOBS,
+    JOBS_RUNNING,
+    JOBS_QUEUED,
+    QUEUE_DRAIN_SECONDS,
+    TRANSFER_BYTES,
+    track_stage
+)
+from throughput_model import format_eta
 
 logger = logging.getLogger(__name__)
 
+class DownloadError(Exception):
+    """Raised when a video could not be downloaded from Telegram."""
+
+class ProcessingError(Exception):
+    """Raised when watermarking a video failed."""
+
 class TelegramWatermarkBot:
     """Main bot class handling Telegram interactions."""
     
     def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(True)  # Let one chat's encode not block other chats
+            .post_init(self._on_startup)
+            .post_shutdown(self._on_shutdown)
+        )
+        if LOCAL_BOT_API:
+            # Files are then handed over as paths on the local server's disk
+            builder = (
+                builder
+                .base_url(f"{API_BASE_URL}/bot")
+                .base_file_url(f"{API_BASE_URL}/file/bot")
+                .local_mode(True)
+            )
+        self.application = builder.build()
         self.video_processor = VideoProcessor()
+        self.job_executor = JobExecutor()
+        # Encoder profiles fall back to faster presets while jobs are waiting
+        self.video_processor.queue_depth = lambda: self.job_executor.queued
+        self.result_cache = ResultCache()
+        self.single_flight = SingleFlight()
+        self.job_store = JobStore()
+        self.downloader = RangedDownloader()
+        self.cancel_registry = CancelRegistry()
+        self._resume_tasks = set()
+        JOBS_RUNNING.set_function(lambda: self.job_executor.running)
+        JOBS_QUEUED.set_function(lambda: self.job_executor.queued)
+        QUEUE_DRAIN_SECONDS.set_function(self.job_executor.drain_seconds)
         self._setup_handlers()
     
     def _setup_handlers(self):
@@ -40,6 +109,7 @@ class TelegramWatermarkBot:
         # Command handlers
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
+        self.application.add_handler(CommandHandler("cancel", self.cancel_command))
         
         # Message handlers
         self.application.add_handler(
@@ -68,17 +138,26 @@ class TelegramWatermarkBot:
         )
         await update.message.reply_text(help_text)
     
+    async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /cancel: stop every video of the chat that is still being processed."""
+        count = self.cancel_registry.cancel(update.message.chat_id)
+        if count:
+            await update.message.reply_text(MESSAGES['cancel_done'].format(count=count))
+        else:
+            await update.message.reply_text(MESSAGES['cancel_none'])
+    
     async def handle_video(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle video messages."""
         message = update.message
         video = message.video
         
         # Check file size
-        if video.file_size > MAX_FILE_SIZE:
-            await message.reply_text(MESSAGES['error_file_size'])
+        size_error = self._size_error(video.file_size)
+        if size_error:
+            await message.reply_text(size_error)
             return
         
-        await self._process_video_file(message, video.get_file)
+        await self._process_video_file(message, video)
     
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle document messages (videos sent as files)."""
@@ -91,108 +170,618 @@ class TelegramWatermarkBot:
             return
         
         # Check file size
-        if document.file_size > MAX_FILE_SIZE:
-            await message.reply_text(MESSAGES['error_file_size'])
+        size_error = self._size_error(document.file_size)
+        if size_error:
+            await message.reply_text(size_error)
             return
         
-        await self._process_video_file(message, document.get_file)
+        await self._process_video_file(message, document)
+    
+    def _size_error(self, file_size: Optional[int]) -> Optional[str]:
+        """
+        Check a video's size against what the bot can download.
+        
+        Args:
+            file_size: Size reported by Telegram
+            
+        Returns:
+            Error message to reply with, or None if the size is fine
+        """
+        if not file_size or file_size <= MAX_DOWNLOAD_SIZE:
+            return None
+        if file_size > MAX_FILE_SIZE:
+            return MESSAGES['error_file_size']
+        # Only the cloud Bot API caps downloads below MAX_FILE_SIZE
+        return MESSAGES['error_download_size']
     
     async def handle_other_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle non-video messages."""
         await update.message.reply_text(MESSAGES['error_not_video'])
     
-    async def _process_video_file(self, message, get_file_func):
+    async def _process_video_file(self, message, media, record: Optional[JobRecord] = None):
         """
         Process video file with watermarks.
         
+        Identical requests that arrive while a job is running share its
+        download and encode; each chat still gets its own status message.
+        Every job is journaled so it can be resumed after a restart.
+        
         Args:
             message: Telegram message object
-            get_file_func: Function to get file from Telegram
+            media: Telegram Video or Document to watermark
+            record: Journaled job when resuming one after a restart
         """
         processing_message = None
+        cache_key = ResultCache.make_key(
+            media.file_unique_id, WATERMARK_TEXT, SITE_TEXT,
+            self.video_processor.encoder_settings()
+        )
+        job_id = JobStore.make_job_id(message.chat_id, message.message_id)
+        
+        # /cancel, or the chat going away, cancels this task wherever it waits;
+        # the shared job is cancelled once no request waits for it any more
+        cancel = CancelToken()
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        with self.cancel_registry.track(message.chat_id, cancel), \
+                cancel.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel)):
+            try:
+                if record is None and not self.job_store.create(
+                    job_id, message.chat_id, message.to_dict(), cache_key
+                ):
+                    # A redelivered update; the job already ran or is resumed at startup
+                    logger.info(f"Job {job_id} is already journaled, skipping")
+                    return
+            
+                # Repeat requests are answered straight from the cache
+                if await self._send_cached_result(message, cache_key):
+                    JOBS.inc(outcome='cached')
+                    self.job_store.finish(job_id)
+                    return
+            
+                # Reject early rather than download a video we have no room to queue;
+                # resumed jobs were admitted before the restart
+                if record is None and not self.single_flight.in_flight(cache_key):
+                    if self.job_executor.is_full_for(message.chat_id):
+                        JOBS.inc(outcome='rejected')
+                        self.job_store.fail(job_id, 'queue full')
+                        await message.reply_text(self._queue_full_message(message.chat_id))
+                        return
+                
+                    # Do not start a download the spool has no room for
+                    if not self.video_processor.spool.has_room(media.file_size):
+                        JOBS.inc(outcome='rejected')
+                        self.job_store.fail(job_id, 'spool full')
+                        logger.warning("Spool full, rejecting video")
+                        await message.reply_text(MESSAGES['error_spool_full'])
+                        return
+                
+                    # Admission control: turn work away once the backlog is too long
+                    backlog = self.job_executor.drain_seconds()
+                    if backlog >= ADMISSION_MAX_DRAIN_SECONDS:
+                        JOBS.inc(outcome='rejected')
+                        self.job_store.fail(job_id, 'overloaded')
+                        logger.warning(f"Backlog of {backlog:.0f}s, rejecting video")
+                        await message.reply_text(
+                            MESSAGES['error_overloaded'].format(eta=format_eta(backlog))
+                        )
+                        return
+            
+                # Send processing message
+                if record is not None:
+                    processing_message = await message.reply_text(MESSAGES['resuming'])
+                else:
+                    processing_message = await message.reply_text(
+                        MESSAGES['processing_eta'].format(eta=format_eta(self._predict_seconds(media)))
+                    )
+            
+                try:
+                    async with self.single_flight.join(
+                        cache_key, self._download_and_encode, media, processing_message,
+                        message.chat_id, job_id, record, cleanup=self.video_processor.cleanup_file
+                    ) as output_path:
+                        # Send processed video back to user
+                        try:
+                            await processing_message.edit_text(MESSAGES['complete'])
+                        
+                            # Another waiter on the same job may already have uploaded it
+                            if self.result_cache.get_file_id(cache_key):
+                                if await self._send_cached_result(message, cache_key):
+                                    JOBS.inc(outcome='cached')
+                                    self.job_store.finish(job_id)
+                                    return
+                        
+                            # Renditions finish with the main output and go up alongside it
+                            with track_stage('upload'):
+                                sent_message, *_ = await asyncio.gather(
+                                    self._reply_with_video(message, output_path),
+                                    *(self._reply_with_rendition(message, rendition, path)
+                                      for rendition, path in existing_renditions(output_path))
+                                )
+                            TRANSFER_BYTES.observe(os.path.getsize(output_path), direction='upload')
+                        
+                            self._remember_result(cache_key, sent_message, output_path)
+                            self.job_store.finish(job_id)
+                            JOBS.inc(outcome='completed')
+                            logger.info(f"Successfully sent watermarked video to user {message.from_user.id}")
+                        
+                        except Exception as e:
+                            JOBS.inc(outcome='failed')
+                            self.job_store.fail(job_id, f"upload failed: {e}")
+                            logger.error(f"Error sending video: {e}")
+                            await message.reply_text(MESSAGES['error_general'])
+                        
+                except DownloadError as e:
+                    JOBS.inc(outcome='failed')
+                    self.job_store.fail(job_id, f"download failed: {e}")
+                    logger.error(f"Error downloading video: {e}")
+                    await processing_message.edit_text(MESSAGES['error_download'])
+                except QueueFullError:
+                    JOBS.inc(outcome='rejected')
+                    self.job_store.fail(job_id, 'queue full')
+                    logger.warning("Job queue full, rejecting video")
+                    await processing_message.edit_text(self._queue_full_message(message.chat_id))
+                except SpoolFullError as e:
+                    JOBS.inc(outcome='rejected')
+                    self.job_store.fail(job_id, 'spool full')
+                    logger.warning(f"Spool full, rejecting video: {e}")
+                    await processing_message.edit_text(MESSAGES['error_spool_full'])
+                except ProcessingError as e:
+                    JOBS.inc(outcome='failed')
+                    self.job_store.fail(job_id, f"processing failed: {e}")
+                    logger.error(f"Error processing video: {e}")
+                    await processing_message.edit_text(MESSAGES['error_processing'])
+                
+            except (asyncio.CancelledError, JobCancelledError) as e:
+                if isinstance(e, asyncio.CancelledError) and not cancel.cancelled:
+                    # Shutting down; the journal resumes the job on the next start
+                    raise
+                reason = e.reason if isinstance(e, JobCancelledError) else cancel.reason
+                JOBS.inc(outcome='cancelled')
+                self.job_store.fail(job_id, f"cancelled ({reason})")
+                logger.info(f"Video job {job_id} cancelled ({reason})")
+                if reason != CANCEL_CHAT_GONE:
+                    text = MESSAGES['cancelled_deadline' if reason == CANCEL_DEADLINE else 'cancelled']
+                    if processing_message:
+                        await processing_message.edit_text(text)
+                    else:
+                        await message.reply_text(text)
+            except Exception as e:
+                JOBS.inc(outcome='failed')
+                self.job_store.fail(job_id, str(e))
+                logger.error(f"Unexpected error in video processing: {e}")
+                if processing_message:
+                    await processing_message.edit_text(MESSAGES['error_general'])
+                else:
+                    await message.reply_text(MESSAGES['error_general'])
+    
+    async def _download_and_encode(self, media, processing_message, chat_id,
+                                   job_id: Optional[str] = None,
+                                   record: Optional[JobRecord] = None) -> str:
+        """
+        Download a video and watermark it; shared by coalesced requests.
+        
+        Each completed stage is journaled under job_id. A resumed job starts
+        after the last stage whose files are still on disk. Cancelling this
+        coroutine cancels the job's token, which stops the download or the
+        FFmpeg process in its worker thread at once.
+        
+        Args:
+            media: Telegram Video or Document to watermark
+            processing_message: Status message of the request that started the job
+            chat_id: Chat the job is scheduled for
+            job_id: Journal entry of the request that started the job
+            record: Journaled job when resuming one after a restart
+            
+        Returns:
+            Path to the watermarked video
+            
+        Raises:
+            DownloadError: If the video could not be downloaded
+            ProcessingError: If the encode failed
+            QueueFullError: If the job queue is full
+            SpoolFullError: If there is no spool space for the video
+            JobCancelledError: If the encode overran its deadline
+        """
+        cancel = CancelToken()
+        # Hold spool space for the input, output and any segments up front
+        reservation = self.video_processor.spool.reserve(media.file_size or 0)
         input_path = None
-        output_path = None
         
         try:
-            # Send processing message
-            processing_message = await message.reply_text(MESSAGES['processing'])
+            stage = record.resume_stage() if record else None
+            if stage == ENCODED:
+                # Only the upload is left; the input is removed below
+                logger.info(f"Reusing encoded output of job {job_id}")
+                if os.path.exists(record.input_path):
+                    input_path = reservation.adopt(record.input_path)
+                for path in companion_paths(record.output_path):
+                    if os.path.exists(path):
+                        reservation.adopt(path)
+                return reservation.adopt(record.output_path)
             
             # Download video file
+            stream_url = None
             try:
-                file = await get_file_func()
-                
-                # Create temporary input file
-                input_fd, input_path = tempfile.mkstemp(
-                    suffix='.mp4',
-                    dir=self.video_processor.temp_dir,
-                    prefix='input_'
-                )
-                os.close(input_fd)
-                
-                # Download file from Telegram
-                await file.download_to_drive(input_path)
-                logger.info(f"Downloaded video to: {input_path}")
+                if stage == DOWNLOADED:
+                    logger.info(f"Reusing downloaded input of job {job_id}")
+                    input_path = reservation.adopt(record.input_path)
+                else:
+                    with track_stage('get_file'):
+                        file = await media.get_file()
+                    
+                    # Create temporary input file
+                    input_path = reservation.mkstemp('input_')
+                    
+                    local_path = local_file_path(file.file_path)
+                    if local_path:
+                        # Local Bot API server: link the file instead of copying it
+                        await asyncio.to_thread(link_local_file, local_path, input_path)
+                        self.job_store.advance(job_id, DOWNLOADED, input_path=input_path)
+                    elif STREAMING_INGEST:
+                        # The worker downloads and encodes at the same time
+                        stream_url = file.file_path
+                    else:
+                        # Download file from Telegram over parallel, resumable Range requests
+                        with track_stage('download'):
+                            await asyncio.to_thread(
+                                self.downloader.download, file.file_path, input_path,
+                                media.file_size or 0, cancel
+                            )
+                        TRANSFER_BYTES.observe(os.path.getsize(input_path), direction='download')
+                        logger.info(f"Downloaded video to: {input_path}")
+                        self.job_store.advance(job_id, DOWNLOADED, input_path=input_path)
                 
             except Exception as e:
-                logger.error(f"Error downloading video: {e}")
-                await processing_message.edit_text(MESSAGES['error_download'])
-                return
+                raise DownloadError(str(e)) from e
             
-            # Process video with watermarks
+            if stream_url:
+                job = (self.video_processor.process_url, stream_url, input_path,
+                       WATERMARK_TEXT, SITE_TEXT)
+            else:
+                job = (self.video_processor.process_video, input_path, WATERMARK_TEXT, SITE_TEXT)
+            
+            cost = self._estimate_cost(media)
+            predicted = self._predict_seconds(media)
+            if not stream_url:
+                # The downloaded file gives a better estimate; the encode reuses its probe
+                try:
+                    info = await asyncio.to_thread(self.video_processor.get_media_info, input_path)
+                except Exception as e:
+                    raise ProcessingError(str(e)) from e
+                cost = estimate_job_cost(info.duration, info.width, info.height)
+                predicted = self._predict_seconds(media, info)
+                job += (info,)
+            
+            # Process video with watermarks in a worker thread
             try:
-                output_path = self.video_processor.process_video(
-                    input_path, WATERMARK_TEXT, SITE_TEXT
+                output_path = await self.job_executor.submit(
+                    *job,
+                    user_id=chat_id,
+                    cost=cost,
+                    predicted_seconds=predicted,
+                    cancel=cancel,
+                    on_progress=self._progress_callback(processing_message),
+                    on_queued=lambda position: processing_message.edit_text(
+                        MESSAGES['queued'].format(
+                            position=position,
+                            eta=format_eta(self.job_executor.start_estimate(position))
+                        )
+                    ),
+                    on_started=lambda: processing_message.edit_text(
+                        MESSAGES['processing_eta'].format(eta=format_eta(predicted))
+                    )
                 )
-                
-                if not output_path:
-                    await processing_message.edit_text(MESSAGES['error_processing'])
-                    return
-                
+            except (QueueFullError, JobCancelledError):
+                raise
+            except IngestDownloadError as e:
+                raise DownloadError(str(e)) from e
             except Exception as e:
-                logger.error(f"Error processing video: {e}")
-                await processing_message.edit_text(MESSAGES['error_processing'])
+                raise ProcessingError(str(e)) from e
+            
+            if not output_path:
+                raise ProcessingError("FFmpeg produced no output")
+            self.job_store.advance(job_id, ENCODED, output_path=output_path)
+            return output_path
+            
+        except asyncio.CancelledError:
+            # Every waiter gave up: stop the work still running in a thread
+            cancel.cancel()
+            raise
+        finally:
+            # The input is no longer needed once the encode has finished; the
+            # reservation is released with the output, or now if there is none
+            if input_path:
+                self.video_processor.cleanup_file(input_path)
+            if not reservation.paths:
+                reservation.release()
+    
+    def _progress_callback(self, processing_message):
+        """
+        Build an encode progress callback that edits the status message.
+        
+        The callback runs in the worker thread, so edits are scheduled on the
+        event loop; ProgressReporter keeps them within Telegram's edit limits.
+        
+        Args:
+            processing_message: Status message to edit
+            
+        Returns:
+            Callable taking an EncodeProgress
+        """
+        loop = asyncio.get_running_loop()
+        
+        async def edit(text):
+            try:
+                await processing_message.edit_text(text)
+            except Forbidden as e:
+                # The bot was blocked or removed; nobody is left to send the video to
+                logger.warning(f"Chat {processing_message.chat_id} is gone: {e}")
+                self.cancel_registry.cancel(processing_message.chat_id, CANCEL_CHAT_GONE)
+            except TelegramError as e:
+                logger.warning(f"Could not update progress message: {e}")
+        
+        reporter = ProgressReporter(
+            lambda text: asyncio.run_coroutine_threadsafe(edit(text), loop)
+        )
+        
+        def on_progress(progress: EncodeProgress):
+            if progress.finished or progress.remaining_seconds is None:
                 return
+            reporter.update(MESSAGES['progress'].format(
+                percent=progress.percent,
+                speed=progress.speed,
+                eta=format_eta(progress.remaining_seconds)
+            ))
+        
+        return on_progress
+    
+    def _estimate_cost(self, media) -> float:
+        """
+        Estimate a job's cost from Telegram's metadata before downloading.
+        
+        Args:
+            media: Telegram Video or Document
+            
+        Returns:
+            Estimated cost for the scheduler
+        """
+        return estimate_job_cost(
+            getattr(media, 'duration', 0) or 0,
+            getattr(media, 'width', 0) or 0,
+            getattr(media, 'height', 0) or 0,
+            media.file_size or 0
+        )
+    
+    def _predict_seconds(self, media, info=None) -> float:
+        """
+        Predict a job's encode time from the learned throughput model.
+        
+        Args:
+            media: Telegram Video or Document
+            info: Probe result of the downloaded file, if available
+            
+        Returns:
+            Predicted encode seconds
+        """
+        model = self.video_processor.throughput_model
+        load = self.job_executor.queued
+        if info is not None:
+            duration, width, height = info.duration, info.width, info.height
+        else:
+            duration = getattr(media, 'duration', 0) or 0
+            width = getattr(media, 'width', 0) or 0
+            height = getattr(media, 'height', 0) or 0
+        if duration and width and height:
+            # Predict for the profile the encode is likely to get
+            profile = select_profile(duration, width, height, load)
+            width, height = profile.output_size(width, height)
+            return model.predict_seconds(duration, width, height, profile.preset)
+        # Only the size is known: predict from the 1080p-equivalent cost
+        profile = select_profile(0, 0, 0, load, media.file_size or 0)
+        return model.predict_seconds(self._estimate_cost(media), preset=profile.preset)
+    
+    def _queue_full_message(self, chat_id) -> str:
+        """Rejection message explaining whose queue is full."""
+        if self.job_executor.queued_for(chat_id) >= self.job_executor.max_queued_per_user:
+            return MESSAGES['error_user_queue_full'].format(
+                count=self.job_executor.max_queued_per_user
+            )
+        return MESSAGES['error_queue_full']
+    
+    async def _send_cached_result(self, message, cache_key: str) -> bool:
+        """
+        Answer a request from the result cache if possible.
+        
+        Args:
+            message: Telegram message object
+            cache_key: Result cache key for the request
             
-            # Send processed video back to user
+        Returns:
+            True if a cached result was sent
+        """
+        file_id = self.result_cache.get_file_id(cache_key)
+        if file_id:
             try:
-                await processing_message.edit_text(MESSAGES['complete'])
-                
-                with open(output_path, 'rb') as video_file:
-                    await message.reply_video(
-                        video=video_file,
-                        supports_streaming=True,
-                        caption="✅ Watermarked video ready!"
-                    )
-                
-                logger.info(f"Successfully sent watermarked video to user {message.from_user.id}")
-                
+                await message.reply_video(
+                    video=file_id,
+                    supports_streaming=True,
+                    caption="✅ Watermarked video ready!"
+                )
+                logger.info(f"Sent cached file_id to user {message.from_user.id}")
+                return True
+            except TelegramError as e:
+                logger.warning(f"Cached file_id rejected, falling back: {e}")
+                self.result_cache.forget_file_id(cache_key)
+        
+        local_path = self.result_cache.get_local_path(cache_key)
+        if local_path:
+            try:
+                sent_message = await self._reply_with_video(message, local_path)
+                if sent_message.video:
+                    self.result_cache.put_file_id(cache_key, sent_message.video.file_id)
+                logger.info(f"Sent locally cached video to user {message.from_user.id}")
+                return True
             except Exception as e:
-                logger.error(f"Error sending video: {e}")
-                await message.reply_text(MESSAGES['error_general'])
-                
+                logger.warning(f"Error sending locally cached video: {e}")
+        
+        return False
+    
+    async def _reply_with_video(self, message, video_path: str,
+                                caption: str = "✅ Watermarked video ready!") -> Message:
+        """
+        Upload a video as a reply, with its dimensions, duration and thumbnail.
+        
+        Args:
+            message: Telegram message to reply to
+            video_path: Path to the watermarked video
+            caption: Caption of the reply
+            
+        Returns:
+            The sent message
+        """
+        metadata = self.video_processor.output_metadata
+        # Known from the encode; results from elsewhere are probed, off the event loop
+        attributes = await asyncio.to_thread(metadata.attributes, video_path)
+        thumbnail = metadata.thumbnail(video_path)
+        with open(video_path, 'rb') as video_file, \
+                (open(thumbnail, 'rb') if thumbnail else nullcontext()) as thumbnail_file:
+            return await message.reply_video(
+                video=video_file,
+                thumbnail=thumbnail_file,
+                supports_streaming=True,
+                caption=caption,
+                **attributes
+            )
+    
+    async def _reply_with_rendition(self, message, rendition: Rendition, video_path: str):
+        """
+        Upload an extra rendition as a reply.
+        
+        A failed rendition is logged and dropped; the main output is what
+        the job delivers.
+        
+        Args:
+            message: Telegram message to reply to
+            rendition: The rendition
+            video_path: Path to the rendition
+        """
+        try:
+            await self._reply_with_video(
+                message, video_path, caption=MESSAGES['rendition'].format(name=rendition.name)
+            )
+            TRANSFER_BYTES.observe(os.path.getsize(video_path), direction='upload')
+            logger.info(f"Sent {rendition.name} rendition to user {message.from_user.id}")
         except Exception as e:
-            logger.error(f"Unexpected error in video processing: {e}")
-            if processing_message:
-                await processing_message.edit_text(MESSAGES['error_general'])
-            else:
-                await message.reply_text(MESSAGES['error_general'])
+            logger.error(f"Error sending {rendition.name} rendition: {e}")
+    
+    def _remember_result(self, cache_key: str, sent_message, output_path: str):
+        """
+        Record an uploaded result in both cache tiers.
         
-        finally:
-            # Clean up temporary files
-            if input_path:
-                self.video_processor.cleanup_file(input_path)
-            if output_path:
-                self.video_processor.cleanup_file(output_path)
+        Args:
+            cache_key: Result cache key for the request
+            sent_message: Message returned by reply_video
+            output_path: Path to the encoded video
+        """
+        try:
+            if sent_message and sent_message.video:
+                self.result_cache.put_file_id(cache_key, sent_message.video.file_id)
+            self.result_cache.put_local_file(cache_key, output_path)
+        except Exception as e:
+            logger.error(f"Error caching result: {e}")
+    
+    async def _on_startup(self, application: Application):
+        """Resume jobs left unfinished by the previous run (polling mode)."""
+        await self._resume_jobs()
+    
+    async def _resume_jobs(self):
+        """
+        Restart every unfinished journaled job from its last completed stage.
+        
+        Each job's message is rebuilt from the journal, so it is answered in
+        the same chat as before. Jobs that went down with the bot too many
+        times are given up instead.
+        """
+        bot = self.application.bot
+        for record in self.job_store.claim_unfinished():
+            try:
+                message = Message.de_json(record.message, bot)
+                media = message.video or message.document
+                if media is None:
+                    self.job_store.fail(record.job_id, 'no video in message')
+                    continue
+                if record.attempts > JOB_MAX_RESUMES:
+                    # The job keeps going down with the bot; do not try it again
+                    logger.error(f"Giving up on job {record.job_id} after {record.attempts - 1} restarts")
+                    self.job_store.fail(record.job_id, 'too many restarts')
+                    for path in (record.input_path, record.output_path):
+                        if path:
+                            self.video_processor.cleanup_file(path)
+                    await bot.send_message(record.chat_id, MESSAGES['error_processing'])
+                    continue
+                
+                logger.info(f"Resuming job {record.job_id} from stage {record.resume_stage()}")
+                task = asyncio.create_task(self._process_video_file(message, media, record))
+                self._resume_tasks.add(task)
+                task.add_done_callback(self._resume_tasks.discard)
+            except Exception as e:
+                logger.error(f"Error resuming job {record.job_id}: {e}")
+                self.job_store.fail(record.job_id, str(e))
+    
+    async def _on_shutdown(self, application: Application):
+        """Release worker threads when the application stops."""
+        self.job_executor.shutdown(wait=False)
     
     def start(self):
         """Start the bot."""
         logger.info("Starting Telegram watermark bot...")
         
-        # Create temp directory
-        os.makedirs(self.video_processor.temp_dir, exist_ok=True)
+        # Reclaim files left behind by a crashed or killed run, except those
+        # of journaled jobs that are resumed once the application is up
+        self.job_store.prune()
+        self.video_processor.spool.sweep(keep=self.job_store.live_paths())
+        
+        if WEBHOOK_URL:
+            # Updates arrive on the keep-alive port; no polling
+            try:
+                asyncio.run(self._run_webhook())
+            except KeyboardInterrupt:
+                logger.info("Bot stopped by user")
+            return
+        
+        # Health page and /metrics for monitoring
+        start_server_thread()
         
-        # Start the bot with polling
+        # Start the bot with polling; updates that arrived while the bot was
+        # down are processed, already journaled ones are skipped
         self.application.run_polling(
-            drop_pending_updates=True
+            drop_pending_updates=False
         )
     
+    async def _run_webhook(self):
+        """Serve webhook deliveries, the health page and /metrics on one port."""
+        async with self.application:
+            await self.application.start()
+            await self.application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=['message'],
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=False
+            )
+            server = await serve(webhook_handler=self._accept_update)
+            logger.info(f"Webhook set to {WEBHOOK_URL}")
+            await self._resume_jobs()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                server.close()
+                await self.application.stop()
+                await self._on_shutdown(self.application)
+    
+    async def _accept_update(self, data: dict) -> bool:
+        """Queue a webhook update for the application's handlers."""
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        return True
+    
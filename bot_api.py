@@ -0,0 +1,147 @@
+"""
+Minimal Telegram Bot API client over pooled keep-alive connections.
+
+Every request reuses a persistent HTTP(S) connection from a small pool
+instead of opening a fresh TLS connection per call.
+"""
+
+import http.client
+import json
+import logging
+import queue
+import urllib.parse
+from typing import Optional
+
+from config import API_BASE_URL, API_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class BotApiError(Exception):
+    """Raised when the Bot API answers with ok=false or an HTTP error."""
+
+    def __init__(self, method: str, description: str, error_code: Optional[int] = None):
+        super().__init__(f"{method} failed: {description}")
+        self.method = method
+        self.description = description
+        self.error_code = error_code
+
+
+class BotApiClient:
+    """Bot API client sharing a pool of keep-alive connections between threads."""
+
+    def __init__(self, token: str, base_url: str = API_BASE_URL,
+                 pool_size: int = API_POOL_SIZE, timeout: int = 60):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._scheme = parsed.scheme
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._path_prefix = parsed.path.rstrip('/')
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def file_url(self, file_path: str) -> str:
+        """Download URL for a file_path returned by getFile."""
+        return f"{self.base_url}/file/bot{self.token}/{file_path}"
+
+    def call(self, method: str, params: Optional[dict] = None, timeout: Optional[int] = None):
+        """
+        Call a Bot API method with form-encoded parameters.
+
+        Args:
+            method: Bot API method name, e.g. 'sendMessage'
+            params: Method parameters; dicts and lists are JSON-encoded
+            timeout: Socket timeout for this call
+
+        Returns:
+            The 'result' field of the response
+
+        Raises:
+            BotApiError: If the API reports an error
+        """
+        fields = {
+            key: json.dumps(value) if isinstance(value, (dict, list)) else value
+            for key, value in (params or {}).items() if value is not None
+        }
+        body = urllib.parse.urlencode(fields).encode()
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        return self._request(method, body, headers, timeout, retry=True)
+
+    def upload(self, method: str, encoder, timeout: Optional[int] = 300):
+        """
+        Call a Bot API method with a streaming multipart body.
+
+        Args:
+            method: Bot API method name, e.g. 'sendVideo'
+            encoder: MultipartEncoder holding the fields and files
+            timeout: Socket timeout for this call
+
+        Returns:
+            The 'result' field of the response
+        """
+        # Not retried: the body iterator cannot be replayed safely
+        return self._request(method, iter(encoder), encoder.headers(), timeout, retry=False)
+
+    def close(self):
+        """Close all pooled connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _request(self, method: str, body, headers: dict, timeout: Optional[int], retry: bool):
+        path = f"{self._path_prefix}/bot{self.token}/{method}"
+        connection, reused = self._acquire(timeout)
+        try:
+            connection.request('POST', path, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+            connection.close()
+            # A pooled connection the server already closed; safe to resend once
+            if reused and retry:
+                logger.debug(f"Stale connection for {method}, reconnecting: {e}")
+                return self._request(method, body, headers, timeout, retry=False)
+            raise
+        except Exception:
+            connection.close()
+            raise
+
+        self._release(connection, response)
+
+        try:
+            data = json.loads(payload.decode())
+        except ValueError:
+            raise BotApiError(method, f"HTTP {response.status}: invalid JSON response", response.status)
+        if not data.get('ok'):
+            raise BotApiError(method, data.get('description', 'unknown error'), data.get('error_code'))
+        return data.get('result')
+
+    def _acquire(self, timeout: Optional[int]):
+        """Take a pooled connection or open a new one."""
+        try:
+            connection = self._pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            if self._scheme == 'https':
+                connection = http.client.HTTPSConnection(self._host, self._port)
+            else:
+                connection = http.client.HTTPConnection(self._host, self._port)
+            reused = False
+        connection.timeout = timeout or self.timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(connection.timeout)
+        return connection, reused
+
+    def _release(self, connection, response):
+        """Return a connection to the pool if it can be reused."""
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
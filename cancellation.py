@@ -0,0 +1,163 @@
+"""
+Cancellation of running jobs.
+
+A CancelToken is handed down to everything a job runs: FFmpeg processes,
+downloads and uploads register a callback that stops them at once (kill the
+process, shut the socket down) and check the token between chunks. A token
+is cancelled by the user's /cancel, by a deadline derived from the expected
+encode time, or when the chat can no longer be reached. The job then fails
+with JobCancelledError, and the usual cleanup paths remove its spool files
+and free its worker slot.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, List
+
+from config import JOB_DEADLINE_FACTOR, JOB_DEADLINE_MIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+CANCEL_USER = 'user'
+CANCEL_DEADLINE = 'deadline'
+CANCEL_CHAT_GONE = 'chat_gone'
+
+
+class JobCancelledError(Exception):
+    """Raised by a job whose CancelToken was cancelled."""
+
+    def __init__(self, reason: str = CANCEL_USER):
+        super().__init__(f"Job cancelled ({reason})")
+        self.reason = reason
+
+
+def encode_deadline(predicted_seconds: float) -> float:
+    """
+    Seconds an encode may run before it is cancelled.
+
+    Args:
+        predicted_seconds: Encode time predicted from the probed duration
+
+    Returns:
+        A generous multiple of the prediction, never below the minimum
+    """
+    return max(JOB_DEADLINE_MIN_SECONDS, predicted_seconds * JOB_DEADLINE_FACTOR)
+
+
+class CancelToken:
+    """Thread-safe cancellation signal for one job."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = CANCEL_USER) -> bool:
+        """
+        Cancel the job and stop whatever it is running.
+
+        Args:
+            reason: CANCEL_USER, CANCEL_DEADLINE or CANCEL_CHAT_GONE
+
+        Returns:
+            False if the token was already cancelled
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = list(self._callbacks.values()), {}
+
+        logger.info(f"Cancelling job ({reason})")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancel callback failed: {e}")
+        return True
+
+    def check(self):
+        """
+        Raises:
+            JobCancelledError: If the token was cancelled
+        """
+        if self._event.is_set():
+            raise JobCancelledError(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds; returns True early if cancelled."""
+        return self._event.wait(timeout)
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]):
+        """
+        Call callback if the token is cancelled while the block runs.
+
+        It is called at once if the token is already cancelled.
+        """
+        with self._lock:
+            callback_id = self._next_id
+            self._next_id += 1
+            if not self._event.is_set():
+                self._callbacks[callback_id] = callback
+                callback = None
+        if callback is not None:
+            callback()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._callbacks.pop(callback_id, None)
+
+    @contextmanager
+    def deadline(self, seconds: float, reason: str = CANCEL_DEADLINE):
+        """Cancel the token if the block is still running after seconds."""
+        timer = threading.Timer(seconds, self.cancel, args=(reason,))
+        timer.daemon = True
+        timer.start()
+        try:
+            yield self
+        finally:
+            timer.cancel()
+
+
+class CancelRegistry:
+    """Cancel tokens of running jobs by chat, for /cancel."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[Hashable, List[CancelToken]] = {}
+
+    @contextmanager
+    def track(self, chat_id: Hashable, token: CancelToken):
+        """Make token cancellable through its chat while the block runs."""
+        with self._lock:
+            self._tokens.setdefault(chat_id, []).append(token)
+        try:
+            yield token
+        finally:
+            with self._lock:
+                tokens = self._tokens.get(chat_id, [])
+                if token in tokens:
+                    tokens.remove(token)
+                if not tokens:
+                    self._tokens.pop(chat_id, None)
+
+    def cancel(self, chat_id: Hashable, reason: str = CANCEL_USER) -> int:
+        """
+        Cancel every running job of a chat.
+
+        Returns:
+            Number of jobs cancelled
+        """
+        with self._lock:
+            tokens = list(self._tokens.get(chat_id, []))
+        return sum(1 for token in tokens if token.cancel(reason))
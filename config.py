@@ -3,6 +3,7 @@ Configuration settings for the Telegram watermark bot.
 """
 
 import os
+import secrets
 
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8302304953:AAFyXq5n6a-CQehPiPjYgsQ_cLct1bxzv4U")
@@ -13,26 +14,161 @@ SITE_TEXT = "Supplywalah.blogspot.com"
 
 # File size limits (150MB in bytes)
 MAX_FILE_SIZE = 150 * 1024 * 1024
+CLOUD_DOWNLOAD_LIMIT = 20 * 1024 * 1024  # Largest file the cloud Bot API lets bots download
+
+# Local Bot API server (telegram-bot-api --local): getFile returns paths on a shared
+# filesystem, files are used in place and the cloud download limit does not apply
+LOCAL_BOT_API = os.getenv("LOCAL_BOT_API", "0") == "1"
+MAX_DOWNLOAD_SIZE = MAX_FILE_SIZE if LOCAL_BOT_API else min(MAX_FILE_SIZE, CLOUD_DOWNLOAD_LIMIT)
 
 # Temporary file settings
 TEMP_DIR = "/tmp/telegram_bot"
 
+# Spool: space reserved per job in TEMP_DIR, with an optional RAM-backed tier for small jobs
+SPOOL_QUOTA_BYTES = int(os.getenv("SPOOL_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))  # Disk tier budget
+SPOOL_RAM_DIR = os.getenv("SPOOL_RAM_DIR", "")  # e.g. /dev/shm/telegram_bot; empty disables the tier
+SPOOL_RAM_QUOTA_BYTES = int(os.getenv("SPOOL_RAM_QUOTA_BYTES", str(512 * 1024 * 1024)))
+SPOOL_RAM_MAX_FILE_BYTES = int(os.getenv("SPOOL_RAM_MAX_FILE_BYTES", str(20 * 1024 * 1024)))  # Larger inputs go to disk
+SPOOL_RESERVE_FACTOR = 3.0  # Input plus output plus segment copies, as a multiple of the input size
+SPOOL_MIN_FREE_BYTES = 256 * 1024 * 1024  # Always leave this much free on the spool filesystem
+
+# Job executor settings
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))  # Parallel FFmpeg encodes
+CPU_BUDGET = float(os.getenv("CPU_BUDGET", "0"))  # CPUs shared by encodes; 0 = cgroup quota / affinity mask
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "20"))  # Jobs allowed to wait for a slot
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "1"))  # Encodes one chat may run at once
+MAX_QUEUED_JOBS_PER_USER = int(os.getenv("MAX_QUEUED_JOBS_PER_USER", "5"))  # Jobs one chat may have waiting
+JOB_AGING_RATE = float(os.getenv("JOB_AGING_RATE", "2.0"))  # Cost forgiven per second a job waits
+JOB_DEFAULT_COST = 60.0  # Cost assumed when nothing is known about a video
+JOB_COST_BYTES_PER_SECOND = 750 * 1024  # File size per second of 1080p video, for size-only estimates
+ADMISSION_MAX_DRAIN_SECONDS = int(os.getenv("ADMISSION_MAX_DRAIN_SECONDS", "1800"))  # Reject new jobs beyond this backlog
+
+# Bot API settings (point TELEGRAM_API_URL at a self-hosted or fake server if needed)
+API_BASE_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+API_POOL_SIZE = 8  # Keep-alive connections kept open to the Bot API
+LONG_POLL_TIMEOUT = 50  # Seconds getUpdates waits server-side for new updates
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))  # Updates handled concurrently
+MAX_PENDING_UPDATES = 100  # Stop fetching while this many updates are unfinished
+
+# Webhook mode: Telegram pushes updates to the keep-alive server instead of being polled
+KEEP_ALIVE_PORT = int(os.getenv("PORT", "5000"))  # Health check, /metrics and the webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public HTTPS URL of WEBHOOK_PATH; empty keeps long polling
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)  # Checked on every delivery
+WEBHOOK_MAX_CONNECTIONS = 40  # Parallel deliveries Telegram may open
+WEBHOOK_MAX_BODY = 1024 * 1024  # Larger request bodies are refused
+
+# Result cache settings
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(TEMP_DIR, "cache"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # Local tier budget
+
+# Throughput model: encode speed learned from finished jobs, used for ETAs and admission
+THROUGHPUT_MODEL_PATH = os.getenv("THROUGHPUT_MODEL_PATH", os.path.join(CACHE_DIR, "throughput.json"))
+THROUGHPUT_EWMA_ALPHA = 0.3  # Weight of the newest observation
+THROUGHPUT_DEFAULT_SPEED = 1.0  # Seconds of 1080p video encoded per second before anything is learned
+
+# Job journal: job stages and the polling offset survive restarts, unfinished jobs are resumed
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOB_MAX_RESUMES = 3  # A job that keeps dying with the bot is given up after this many restarts
+JOB_RETENTION_SECONDS = 7 * 24 * 3600  # Finished jobs are remembered this long to ignore redeliveries
+
+# Cancellation: encodes running far past their predicted time are stopped
+JOB_DEADLINE_FACTOR = float(os.getenv("JOB_DEADLINE_FACTOR", "4"))  # Multiple of the predicted encode time
+JOB_DEADLINE_MIN_SECONDS = 120  # Short videos get at least this long
+
 # FFmpeg settings
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+VIDEO_CODEC = "libx264"
+AUDIO_CODEC = "aac"
+AUDIO_COPY_CODECS = ("aac",)  # Source audio in these codecs is stream-copied, not re-encoded
+PROBE_PACKET_SECONDS = 30  # Packets scanned from the start to measure the keyframe interval
+ENCODE_STALL_SECONDS = int(os.getenv("ENCODE_STALL_SECONDS", "60"))  # Kill encodes whose output stops advancing
+PROGRESS_UPDATE_INTERVAL = 5  # Seconds between status message edits, well within Telegram's limits
 FONT_SIZE_BASE = 24  # Base font size, will be adjusted based on video resolution
 FONT_COLOR = "white"
 FONT_OUTLINE_COLOR = "black"
 FONT_OUTLINE_WIDTH = 2
 
+# Encoder profiles, slowest first, then those only used for renditions. max_resolution caps
+# the shorter side and max_fps the frame rate (0 = keep the input's); tune is an x264 tune or None
+ENCODER_PROFILES = {
+    'archive': {'preset': 'slow', 'crf': 21, 'tune': None, 'max_resolution': 0, 'max_fps': 0},
+    'balanced': {'preset': 'medium', 'crf': 23, 'tune': None, 'max_resolution': 0, 'max_fps': 0},
+    'fast': {'preset': 'veryfast', 'crf': 24, 'tune': None, 'max_resolution': 1080, 'max_fps': 30},
+    'mobile': {'preset': 'veryfast', 'crf': 27, 'tune': None, 'max_resolution': 480, 'max_fps': 30},
+}
+DEFAULT_ENCODER_PROFILE = 'balanced'
+ENCODER_PROFILE = os.getenv("ENCODER_PROFILE", "")  # Use this profile for every job; empty = choose per job
+VIDEO_PRESET = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE]['preset']  # Preset assumed when none is given
+# Profile choice from the job's cost (seconds of 1080p-equivalent video) and the jobs waiting
+PROFILE_ARCHIVE_MAX_COST = float(os.getenv("PROFILE_ARCHIVE_MAX_COST", "30"))  # Small jobs get 'archive' when idle
+PROFILE_FAST_MIN_COST = float(os.getenv("PROFILE_FAST_MIN_COST", "600"))  # Large jobs always get 'fast'
+PROFILE_BALANCED_LOAD = int(os.getenv("PROFILE_BALANCED_LOAD", "1"))  # Waiting jobs that rule out 'archive'
+PROFILE_FAST_LOAD = int(os.getenv("PROFILE_FAST_LOAD", "3"))  # Waiting jobs that switch every job to 'fast'
+
+# Extra renditions, e.g. a 480p copy for mobile data, encoded by the same FFmpeg run as the
+# main output from the same decoded, watermarked frames. Name -> profile in ENCODER_PROFILES
+RENDITION_PROFILES = {'480p': 'mobile'}
+RENDITIONS = [name for name in os.getenv("RENDITIONS", "").split(',') if name]  # e.g. "480p"; empty = none
+
+# Output size budget: encodes are bitrate-capped so the result fits one Bot API upload
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024  # Largest file the cloud Bot API accepts from bots
+LOCAL_UPLOAD_LIMIT = 2000 * 1024 * 1024
+MAX_UPLOAD_SIZE = LOCAL_UPLOAD_LIMIT if LOCAL_BOT_API else CLOUD_UPLOAD_LIMIT
+SIZE_BUDGET_HEADROOM = 0.95  # Share of the limit planned for; the rest covers container overhead
+SIZE_BUDGET_VBV_SECONDS = 2.0  # VBV buffer, in seconds at the maximum bitrate
+SIZE_BUDGET_AUDIO_BIT_RATE = 192000  # Assumed for re-encoded audio or copies of unknown bitrate
+SIZE_BUDGET_TWO_PASS_RATIO = 1.3  # Encode in two passes if the source rate exceeds the cap this much
+SIZE_BUDGET_TWO_PASS_PEAK = 2.0  # Peak bitrate of two-pass encodes, as a multiple of the average
+
+# Output playback metadata: outputs are faststart MP4s sent with their dimensions,
+# duration and a thumbnail taken by the encode itself
+THUMBNAIL_MAX_SIDE = 320  # Telegram ignores thumbnails larger than this on either side
+THUMBNAIL_SECONDS = 1.0  # Position of the thumbnail frame, at most half way into the video
+THUMBNAIL_QUALITY = 4  # JPEG qscale, 2 (best) to 31
+
+# Segmented parallel encoding, used for long high-resolution videos
+SEGMENTED_MIN_DURATION = int(os.getenv("SEGMENTED_MIN_DURATION", "180"))  # Seconds
+SEGMENTED_MIN_DIMENSION = int(os.getenv("SEGMENTED_MIN_DIMENSION", "720"))  # Shorter side in pixels
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", str(os.cpu_count() or 1)))
+SEGMENT_MIN_SECONDS = 20  # Never split into segments shorter than this
+
+# Streaming ingest: pipe downloads into FFmpeg while they arrive
+STREAMING_INGEST = os.getenv("STREAMING_INGEST", "1") == "1"
+STREAM_CHUNK_SIZE = 256 * 1024
+STREAM_HEAD_LIMIT = 8 * 1024 * 1024  # Give up on streaming if moov is not found this early
+
+# Downloads: large files are fetched over parallel Range requests and resumed after errors
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+DOWNLOAD_PART_SIZE = 4 * 1024 * 1024  # Bytes per Range request
+DOWNLOAD_MAX_RETRIES = 5  # Per part, counting attempts that made no progress
+DOWNLOAD_RETRY_BACKOFF = 0.5  # Seconds before the first retry, doubled for each further one
+DOWNLOAD_SOCKET_TIMEOUT = 30
+
 # Messages
 MESSAGES = {
-    'start': "Welcome! Send me a video file (up to 150MB) and I'll add watermarks.",
+    'start': "Welcome! Send me a video file (up to 150MB) and I'll add watermarks. Send /cancel to stop it.",
     'processing': "🔄 Applying watermark to your video...",
+    'processing_eta': "🔄 Applying watermark to your video... about {eta} left.",
+    'progress': "🔄 Watermarking: {percent}% done ({speed:.1f}x), about {eta} left.",
+    'resuming': "♻️ The bot restarted, resuming your video...",
+    'queued': "⏳ Your video is queued (position {position}). Estimated start in {eta}.",
     'uploading': "⬆️ Uploading watermarked video...",
     'complete': "✅ Video processed and sent successfully!",
+    'rendition': "📱 {name} copy of your watermarked video",
     'error_file_size': "❌ Error: File size exceeds 150MB limit.",
+    'error_download_size': "❌ Error: Telegram only lets bots download videos up to 20MB. Please send a smaller video.",
     'error_not_video': "❌ Error: Please send a video file.",
     'error_processing': "❌ Error: Failed to process video. Please try again.",
     'error_download': "❌ Error: Failed to download video. Please try again.",
     'error_upload': "❌ Error: Failed to send video. Please try again.",
+    'error_queue_full': "❌ The bot is busy right now. Please try again in a few minutes.",
+    'error_overloaded': "❌ The bot is overloaded: the current backlog is about {eta}. Please try again later.",
+    'error_spool_full': "❌ The bot is out of working space right now. Please try again in a few minutes.",
+    'error_user_queue_full': "❌ You already have {count} videos waiting. Please send more once they are done.",
+    'cancel_done': "🛑 Cancelling {count} video(s)...",
+    'cancel_none': "There is nothing to cancel.",
+    'cancelled': "🛑 Cancelled.",
+    'cancelled_deadline': "⏱ Your video took far longer than expected and was stopped. Please try again later.",
     'error_general': "❌ An unexpected error occurred. Please try again later."
 }
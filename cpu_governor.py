@@ -0,0 +1,184 @@
+"""
+CPU budgeting between concurrent encodes.
+
+libx264 sizes its thread pool from the cores it can see, so every encode
+that runs at once assumes it has the whole machine; in a container with a
+CPU quota that can be several times the cores actually available. The
+governor reads the effective CPU budget (cgroup v2 cpu.max, cgroup v1 CFS
+quota and the affinity mask) and hands each encode an explicit thread
+count: an equal share of the budget per encode slot, i.e. per encode the
+bot runs at once. x264 cannot change its thread count mid-encode, so the
+share is fixed up front, and encodes starting together split the budget
+evenly instead of the first one taking all of it.
+"""
+
+import logging
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import CPU_BUDGET, MAX_CONCURRENT_JOBS, VIDEO_CODEC
+from metrics import ENCODE_THREADS
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def effective_cpus() -> float:
+    """
+    CPUs this process may use: the smaller of the affinity mask and the
+    cgroup CPU quota.
+
+    Returns:
+        Number of CPUs, possibly fractional under a quota
+    """
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        cpus = float(os.cpu_count() or 1)
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, quota)
+    return cpus
+
+
+def cgroup_cpu_quota() -> Optional[float]:
+    """
+    CPU quota of this process's cgroup and its ancestors, in CPUs.
+
+    Returns:
+        The tightest quota found, or None if there is none
+    """
+    quotas = []
+    for controllers, path in _own_cgroups():
+        if controllers == '':
+            # cgroup v2: "max 100000" or "<quota> <period>"
+            for directory in _cgroup_dirs(CGROUP_ROOT, path):
+                fields = _read(os.path.join(directory, 'cpu.max'))
+                if fields and len(fields.split()) == 2 and fields.split()[0] != 'max':
+                    quota, period = fields.split()
+                    quotas.append(int(quota) / int(period))
+        elif 'cpu' in controllers.split(','):
+            mount = os.path.join(CGROUP_ROOT, controllers)
+            if not os.path.isdir(mount):
+                mount = os.path.join(CGROUP_ROOT, 'cpu')
+            for directory in _cgroup_dirs(mount, path):
+                quota = _read(os.path.join(directory, 'cpu.cfs_quota_us'))
+                period = _read(os.path.join(directory, 'cpu.cfs_period_us'))
+                if quota and period and int(quota) > 0:
+                    quotas.append(int(quota) / int(period))
+    return min(quotas) if quotas else None
+
+
+def _own_cgroups() -> List[tuple]:
+    """(controllers, path) pairs from /proc/self/cgroup."""
+    entries = []
+    for line in (_read('/proc/self/cgroup') or '').splitlines():
+        parts = line.split(':', 2)
+        if len(parts) == 3:
+            entries.append((parts[1], parts[2]))
+    return entries
+
+
+def _cgroup_dirs(mount: str, path: str) -> List[str]:
+    """The cgroup's directory and its ancestors up to the mount point."""
+    # Inside a container the cgroup path is often not visible under the
+    # mount, which then holds the container's own cgroup
+    directories = [mount]
+    parts = [part for part in path.split('/') if part]
+    for depth in range(1, len(parts) + 1):
+        directory = os.path.join(mount, *parts[:depth])
+        if os.path.isdir(directory):
+            directories.append(directory)
+    return directories
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def thread_args(threads: int) -> Dict[str, object]:
+    """
+    FFmpeg output options pinning the encoder to a number of threads.
+
+    Args:
+        threads: Encoder threads; 0 leaves the choice to FFmpeg
+
+    Returns:
+        Dictionary of output keyword arguments
+    """
+    if threads <= 0:
+        return {}
+    args = {'threads': threads}
+    if VIDEO_CODEC == 'libx264':
+        # x264 would otherwise add lookahead threads on top of the frame threads
+        args['x264-params'] = f"threads={threads}:lookahead-threads={max(1, threads // 4)}"
+    return args
+
+
+class CpuGovernor:
+    """Splits the CPU budget between the encodes running at the same time."""
+
+    def __init__(self, budget: Optional[float] = None, slots: int = MAX_CONCURRENT_JOBS):
+        """
+        Args:
+            budget: CPUs to share; detected from the cgroup quota and the
+                affinity mask if not given or 0
+            slots: Number of encodes expected to run at once
+        """
+        budget = budget or CPU_BUDGET or effective_cpus()
+        # A fractional quota still runs one thread per started CPU
+        self.total = max(1, math.ceil(budget - 0.01))
+        self.slots = max(1, slots)
+        self._lock = threading.Lock()
+        self._leases: Dict[int, int] = {}
+        self._next_id = 0
+        logger.info(f"CPU budget for encodes: {self.total} threads")
+
+    @property
+    def leased(self) -> int:
+        """Threads handed to running encodes."""
+        with self._lock:
+            return sum(self._leases.values())
+
+    @property
+    def active(self) -> int:
+        """Number of running encodes."""
+        with self._lock:
+            return len(self._leases)
+
+    @contextmanager
+    def lease(self):
+        """
+        Reserve encoder threads for the duration of the block.
+
+        The encode gets the budget's share per slot, or less once more
+        encodes than slots are running, itself included. Every encode gets
+        at least one thread.
+
+        Yields:
+            Number of threads to encode with
+        """
+        with self._lock:
+            running = len(self._leases) + 1
+            threads = max(1, self.total // max(running, self.slots))
+            lease_id = self._next_id
+            self._next_id += 1
+            self._leases[lease_id] = threads
+            leased = sum(self._leases.values())
+        ENCODE_THREADS.set(leased)
+        logger.info(f"Encode gets {threads} of {self.total} threads ({running} running)")
+        try:
+            yield threads
+        finally:
+            with self._lock:
+                del self._leases[lease_id]
+                leased = sum(self._leases.values())
+            ENCODE_THREADS.set(leased)
@@ -0,0 +1,121 @@
+"""
+Named encoder profiles and their per-job selection.
+
+A profile bundles the x264 preset, tune and CRF with caps on the output
+resolution and frame rate. Small jobs on an idle bot get the slower,
+better-compressing 'archive' profile; under load, or for very large inputs,
+jobs drop to faster profiles so the queue keeps draining. The profiles are
+defined in config.ENCODER_PROFILES.
+"""
+
+import logging
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+from config import (
+    ENCODER_PROFILES,
+    DEFAULT_ENCODER_PROFILE,
+    ENCODER_PROFILE,
+    PROFILE_ARCHIVE_MAX_COST,
+    PROFILE_FAST_MIN_COST,
+    PROFILE_BALANCED_LOAD,
+    PROFILE_FAST_LOAD
+)
+from job_executor import estimate_job_cost
+from metrics import ENCODE_PROFILES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    """Encoder settings for one speed tier."""
+
+    name: str
+    preset: str
+    crf: int
+    tune: Optional[str] = None
+    max_resolution: int = 0
+    max_fps: float = 0
+
+    def output_size(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        Frame size after applying max_resolution to the shorter side.
+
+        Args:
+            width: Input width
+            height: Input height
+
+        Returns:
+            (width, height), both even, or the input size if within the cap
+        """
+        shorter = min(width, height)
+        if not self.max_resolution or shorter <= self.max_resolution:
+            return width, height
+        scale = self.max_resolution / shorter
+        # yuv420p needs even dimensions
+        return max(2, round(width * scale / 2) * 2), max(2, round(height * scale / 2) * 2)
+
+    def output_fps(self, frame_rate: float) -> Optional[float]:
+        """The frame rate to convert to, or None to keep the input's."""
+        if self.max_fps and frame_rate > self.max_fps:
+            return self.max_fps
+        return None
+
+    def encode_args(self) -> Dict[str, object]:
+        """FFmpeg output options for the x264 settings."""
+        args = {'preset': self.preset, 'crf': self.crf}
+        if self.tune:
+            args['tune'] = self.tune
+        return args
+
+
+PROFILES: Dict[str, EncoderProfile] = {
+    name: EncoderProfile(name=name, **settings) for name, settings in ENCODER_PROFILES.items()
+}
+
+
+def profile_settings() -> Dict[str, dict]:
+    """Every profile's settings, for keying cached results."""
+    return {name: asdict(profile) for name, profile in PROFILES.items()}
+
+
+def select_profile(duration: float, width: int, height: int, load: int,
+                   file_size: int = 0) -> EncoderProfile:
+    """
+    Choose the encoder profile for a job.
+
+    Args:
+        duration: Input duration in seconds
+        width: Input width
+        height: Input height
+        load: Jobs waiting for an encoder besides this one
+        file_size: File size in bytes, sizing the job when the dimensions
+            are unknown
+
+    Returns:
+        The ENCODER_PROFILE override if set, else 'fast' for large jobs or
+        heavy load, 'archive' for small jobs with nothing waiting, and
+        'balanced' otherwise
+    """
+    if ENCODER_PROFILE:
+        return PROFILES[ENCODER_PROFILE]
+    cost = estimate_job_cost(duration, width, height, file_size)
+    if load >= PROFILE_FAST_LOAD or cost >= PROFILE_FAST_MIN_COST:
+        name = 'fast'
+    elif load < PROFILE_BALANCED_LOAD and cost <= PROFILE_ARCHIVE_MAX_COST:
+        name = 'archive'
+    else:
+        name = DEFAULT_ENCODER_PROFILE
+    return PROFILES.get(name, PROFILES[DEFAULT_ENCODER_PROFILE])
+
+
+def record_profile(profile: EncoderProfile, width: int, height: int, load: int):
+    """Log and count the profile an encode runs with."""
+    out_width, out_height = profile.output_size(width, height)
+    logger.info(
+        f"Encoding {width}x{height} with profile '{profile.name}' "
+        f"(preset {profile.preset}, crf {profile.crf}, output {out_width}x{out_height}, "
+        f"{load} waiting)"
+    )
+    ENCODE_PROFILES.inc(profile=profile.name)
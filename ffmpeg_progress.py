@@ -0,0 +1,273 @@
+"""
+FFmpeg progress reporting and stall detection.
+
+Encodes are run with ``-progress`` so FFmpeg writes key=value blocks
+(frame, fps, speed, out_time, ...) while it works. The blocks are parsed
+into EncodeProgress snapshots for status messages, and the same stream
+feeds a watchdog that kills an encode whose output time stops advancing.
+A cancelled job's CancelToken kills the encode as well.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from cancellation import CancelToken
+from config import ENCODE_STALL_SECONDS, PROGRESS_UPDATE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class EncodeError(Exception):
+    """Raised when an FFmpeg encode fails."""
+
+    def __init__(self, message: str, stderr: str = ''):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+class EncodeStalledError(EncodeError):
+    """Raised when an encode made no progress for too long and was killed."""
+
+
+@dataclass
+class EncodeProgress:
+    """One progress snapshot reported by FFmpeg."""
+
+    frame: int = 0
+    fps: float = 0.0
+    speed: float = 0.0
+    out_time: float = 0.0
+    total_size: int = 0
+    duration: float = 0.0
+    finished: bool = False
+
+    @property
+    def percent(self) -> int:
+        """Completion percentage, 0 if the duration is unknown."""
+        if self.finished:
+            return 100
+        if self.duration <= 0:
+            return 0
+        return max(0, min(99, int(self.out_time / self.duration * 100)))
+
+    @property
+    def remaining_seconds(self) -> Optional[float]:
+        """Wall-clock seconds left at the current speed, if known."""
+        if self.duration <= 0 or self.speed <= 0:
+            return None
+        return max(0.0, self.duration - self.out_time) / self.speed
+
+
+class ProgressParser:
+    """Turns ``-progress`` output lines into EncodeProgress snapshots."""
+
+    def __init__(self, duration: float = 0.0):
+        self.duration = duration
+        self._fields = {}
+
+    def feed(self, line: str) -> Optional[EncodeProgress]:
+        """
+        Parse one line.
+
+        Returns:
+            An EncodeProgress when a block is complete, otherwise None
+        """
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self._fields[key] = value.strip()
+        if key != 'progress':
+            return None
+
+        fields, self._fields = self._fields, {}
+        return EncodeProgress(
+            frame=_int(fields.get('frame')),
+            fps=_float(fields.get('fps')),
+            speed=_float(fields.get('speed', '').rstrip('x')),
+            out_time=_out_time(fields),
+            total_size=_int(fields.get('total_size')),
+            duration=self.duration,
+            finished=value.strip() == 'end'
+        )
+
+
+class ProgressReporter:
+    """Forwards status texts at a bounded rate, skipping repeats."""
+
+    def __init__(self, send: Callable[[str], None], interval: float = PROGRESS_UPDATE_INTERVAL):
+        """
+        Args:
+            send: Called with the text to show, e.g. a message edit
+            interval: Minimum seconds between two sends
+        """
+        self.send = send
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_sent = 0.0
+        self._last_text = None
+
+    def update(self, text: str, force: bool = False):
+        """Send text unless the previous send was too recent or identical."""
+        with self._lock:
+            now = time.monotonic()
+            if text == self._last_text:
+                return
+            if not force and now - self._last_sent < self.interval:
+                return
+            self._last_sent = now
+            self._last_text = text
+        try:
+            self.send(text)
+        except Exception as e:
+            logger.warning(f"Progress update failed: {e}")
+
+
+def run_with_progress(cmd: List[str], duration: float = 0.0,
+                      on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+                      stall_timeout: float = ENCODE_STALL_SECONDS,
+                      cancel: Optional[CancelToken] = None):
+    """
+    Run an FFmpeg command, reporting progress and killing it if it stalls.
+
+    Args:
+        cmd: FFmpeg argument list, starting with the executable
+        duration: Expected output duration in seconds, for percentages
+        on_progress: Called with each EncodeProgress from a reader thread
+        stall_timeout: Seconds without output time advancing before the
+            encode is killed; 0 disables the watchdog
+        cancel: Kills the encode when cancelled
+
+    Raises:
+        JobCancelledError: If the encode was cancelled
+        EncodeStalledError: If the encode stalled and was killed
+        EncodeError: If FFmpeg exited with an error
+    """
+    cancel = cancel or CancelToken()
+    cancel.check()
+    cmd = cmd[:1] + ['-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    parser = ProgressParser(duration)
+    stderr_tail = []
+    last_advance = [time.monotonic(), -1.0]
+    done = threading.Event()
+    stalled = threading.Event()
+
+    def read_stderr():
+        for raw_line in process.stderr:
+            stderr_tail.append(raw_line.decode(errors='replace').rstrip())
+            del stderr_tail[:-20]
+
+    def watchdog():
+        while not done.wait(1):
+            if time.monotonic() - last_advance[0] > stall_timeout:
+                logger.error(f"Encode stalled for {stall_timeout}s, killing FFmpeg")
+                stalled.set()
+                process.kill()
+                return
+
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    stderr_reader.start()
+    if stall_timeout > 0:
+        threading.Thread(target=watchdog, daemon=True).start()
+
+    try:
+        with cancel.on_cancel(process.kill):
+            for raw_line in process.stdout:
+                progress = parser.feed(raw_line.decode(errors='replace'))
+                if progress is None:
+                    continue
+                # Speed 0 with a frozen output time is what a stall looks like
+                if progress.out_time > last_advance[1]:
+                    last_advance[:] = [time.monotonic(), progress.out_time]
+                if on_progress:
+                    try:
+                        on_progress(progress)
+                    except Exception as e:
+                        logger.warning(f"Progress callback failed: {e}")
+            returncode = process.wait()
+    finally:
+        done.set()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        stderr_reader.join(timeout=5)
+
+    stderr = '\n'.join(stderr_tail)
+    cancel.check()
+    if stalled.is_set():
+        raise EncodeStalledError(f"Encode stalled for {stall_timeout}s", stderr)
+    if returncode != 0:
+        raise EncodeError(f"FFmpeg exited with {returncode}: {stderr_tail[-1] if stderr_tail else ''}",
+                          stderr)
+
+
+def run_passes(cmds: List[List[str]], duration: float = 0.0,
+               on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+               stall_timeout: float = ENCODE_STALL_SECONDS,
+               cancel: Optional[CancelToken] = None):
+    """
+    Run the passes of a multi-pass encode, reporting them as one encode.
+
+    Each pass is counted as an equal share of the work, so percentages and
+    remaining time cover all passes.
+
+    Args:
+        cmds: FFmpeg argument lists, one per pass, run in order
+        duration: Duration of the video in seconds
+        on_progress: Called with the combined EncodeProgress
+        stall_timeout: Stall timeout for each pass, as for run_with_progress
+        cancel: Kills the running pass when cancelled
+
+    Raises:
+        JobCancelledError: If the encode was cancelled
+        EncodeStalledError: If a pass stalled and was killed
+        EncodeError: If a pass failed
+    """
+    count = len(cmds)
+    for index, cmd in enumerate(cmds):
+        def report(progress, index=index):
+            if on_progress:
+                on_progress(EncodeProgress(
+                    frame=progress.frame,
+                    fps=progress.fps,
+                    speed=progress.speed / count,
+                    out_time=(index * duration + progress.out_time) / count,
+                    total_size=progress.total_size,
+                    duration=duration,
+                    finished=progress.finished and index == count - 1
+                ))
+        run_with_progress(cmd, duration, report, stall_timeout, cancel)
+
+
+def _out_time(fields: dict) -> float:
+    """Output position in seconds from out_time_us, out_time_ms or out_time."""
+    for key in ('out_time_us', 'out_time_ms'):
+        value = fields.get(key)
+        if value and value != 'N/A':
+            # FFmpeg reports out_time_ms in microseconds as well
+            return max(0.0, _int(value) / 1_000_000)
+    value = fields.get('out_time', '')
+    try:
+        hours, minutes, seconds = value.split(':')
+        return max(0.0, int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+    except ValueError:
+        return 0.0
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,324 @@
+"""
+Bounded worker pool for running blocking FFmpeg jobs off the asyncio event loop.
+
+Waiting jobs are scheduled shortest-job-first on their estimated cost, with
+per-user fairness and aging: a user's running jobs make their waiting jobs
+look more expensive, and every second a job waits lowers its effective cost,
+so long videos cannot be starved by a stream of short ones.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from config import (
+    MAX_CONCURRENT_JOBS,
+    MAX_QUEUED_JOBS,
+    MAX_JOBS_PER_USER,
+    MAX_QUEUED_JOBS_PER_USER,
+    JOB_AGING_RATE,
+    JOB_DEFAULT_COST,
+    JOB_COST_BYTES_PER_SECOND
+)
+from metrics import QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_PIXELS = 1920 * 1080
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the wait queue is full."""
+
+
+class UserQueueFullError(QueueFullError):
+    """Raised when one user already has the maximum number of jobs waiting."""
+
+
+def estimate_job_cost(duration: float = 0, width: int = 0, height: int = 0,
+                      file_size: int = 0) -> float:
+    """
+    Estimate the encode work of a video in seconds of 1080p video.
+
+    Args:
+        duration: Video duration in seconds, if known
+        width: Video width, if known
+        height: Video height, if known
+        file_size: File size in bytes, used when the dimensions are unknown
+
+    Returns:
+        Estimated cost
+    """
+    if duration and width and height:
+        return duration * width * height / REFERENCE_PIXELS
+    if file_size:
+        return file_size / JOB_COST_BYTES_PER_SECOND
+    return JOB_DEFAULT_COST
+
+
+class _Waiter:
+    """A job waiting for a worker slot."""
+
+    __slots__ = ('future', 'user_id', 'cost', 'predicted', 'enqueued_at', 'sequence')
+
+    def __init__(self, future, user_id, cost: float, predicted: float, sequence: int):
+        self.future = future
+        self.user_id = user_id
+        self.cost = cost
+        self.predicted = predicted
+        self.enqueued_at = time.monotonic()
+        self.sequence = sequence
+
+
+class JobExecutor:
+    """
+    Runs synchronous jobs in worker threads with a fixed number of slots.
+
+    Jobs beyond the number of free slots wait in a bounded queue and are
+    started cheapest-first, subject to per-user concurrency caps. The FFmpeg
+    subprocess does the heavy lifting, so threads are enough to keep the
+    event loop free for polling, downloads and uploads.
+    """
+
+    def __init__(self, max_workers: int = MAX_CONCURRENT_JOBS,
+                 max_queue: int = MAX_QUEUED_JOBS,
+                 max_per_user: int = MAX_JOBS_PER_USER,
+                 max_queued_per_user: int = MAX_QUEUED_JOBS_PER_USER,
+                 aging_rate: float = JOB_AGING_RATE):
+        """
+        Args:
+            max_workers: Jobs running at once
+            max_queue: Jobs allowed to wait in total
+            max_per_user: Jobs one user may run at once
+            max_queued_per_user: Jobs one user may have waiting
+            aging_rate: Cost subtracted from a waiting job per second waited
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.max_per_user = max(1, max_per_user)
+        self.max_queued_per_user = max(0, max_queued_per_user)
+        self.aging_rate = aging_rate
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='ffmpeg-worker'
+        )
+        self._running = 0
+        self._running_by_user: Dict[Hashable, int] = {}
+        self._active: Dict[int, tuple] = {}  # sequence -> (started_at, predicted seconds)
+        self._waiting: List[_Waiter] = []
+        self._sequence = itertools.count()
+
+    @property
+    def running(self) -> int:
+        """Number of jobs currently holding a worker slot."""
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        """Number of jobs waiting for a worker slot."""
+        return len(self._waiting)
+
+    @property
+    def is_full(self) -> bool:
+        """True if a new job would be rejected."""
+        return self._running >= self.max_workers and self.queued >= self.max_queue
+
+    def drain_seconds(self) -> float:
+        """Predicted seconds until every running and waiting job has finished."""
+        return self.start_estimate(len(self._waiting) + 1)
+
+    def start_estimate(self, position: int) -> float:
+        """
+        Predicted seconds until the job at a queue position gets a slot.
+
+        Args:
+            position: 1-based position in the current schedule
+
+        Returns:
+            Remaining predicted work ahead of it, spread over the workers
+        """
+        now = time.monotonic()
+        remaining = sum(
+            max(0.0, predicted - (now - started))
+            for started, predicted in self._active.values()
+        )
+        ahead = self._order(self._waiting)[:max(0, position - 1)]
+        remaining += sum(waiter.predicted for waiter in ahead)
+        return remaining / self.max_workers
+
+    def queued_for(self, user_id: Hashable) -> int:
+        """Number of jobs a user has waiting."""
+        return sum(1 for waiter in self._waiting if waiter.user_id == user_id)
+
+    def is_full_for(self, user_id: Hashable) -> bool:
+        """True if a new job from user_id would be rejected."""
+        if self.is_full:
+            return True
+        return (
+            user_id is not None
+            and not self._can_start(user_id)
+            and self.queued_for(user_id) >= self.max_queued_per_user
+        )
+
+    async def submit(self, func: Callable[..., Any], *args,
+                     on_queued: Optional[Callable[[int], Awaitable[Any]]] = None,
+                     on_started: Optional[Callable[[], Awaitable[Any]]] = None,
+                     user_id: Hashable = None, cost: float = JOB_DEFAULT_COST,
+                     predicted_seconds: Optional[float] = None,
+                     **kwargs) -> Any:
+        """
+        Run func(*args, **kwargs) in a worker thread and await its result.
+
+        Args:
+            func: Blocking callable to run
+            on_queued: Coroutine callback receiving the 1-based queue position
+                if the job has to wait for a slot
+            on_started: Coroutine callback invoked once a queued job starts
+            user_id: Owner of the job, for fairness and per-user caps
+            cost: Estimated cost, see estimate_job_cost()
+            predicted_seconds: Expected run time, for queue drain estimates;
+                defaults to cost
+
+        Returns:
+            The return value of func
+
+        Raises:
+            QueueFullError: If all slots are busy and the queue is full
+            UserQueueFullError: If the user has too many jobs waiting
+        """
+        sequence = next(self._sequence)
+        predicted = cost if predicted_seconds is None else predicted_seconds
+        queued_at = time.monotonic()
+        waited = await self._acquire(user_id, cost, predicted, sequence, on_queued)
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+        loop = asyncio.get_running_loop()
+        try:
+            if waited:
+                await self._notify(on_started)
+            job = self._pool.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._release(user_id, sequence)
+            raise
+        # The slot is held until the worker thread is done, even if the caller
+        # stops waiting for it
+        job.add_done_callback(lambda _: self._release_from_thread(loop, user_id, sequence))
+        return await asyncio.wrap_future(job)
+
+    async def _acquire(self, user_id, cost, predicted, sequence, on_queued) -> bool:
+        """
+        Take a worker slot, waiting in the queue if necessary.
+
+        Returns:
+            True if the job had to wait for the slot
+        """
+        if self._running < self.max_workers and self._can_start(user_id):
+            self._start(user_id, sequence, predicted)
+            return False
+
+        if len(self._waiting) >= self.max_queue:
+            raise QueueFullError("Job queue is full")
+        if user_id is not None and self.queued_for(user_id) >= self.max_queued_per_user:
+            raise UserQueueFullError(f"User {user_id} has too many jobs waiting")
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), user_id,
+                         cost, predicted, sequence)
+        self._waiting.append(waiter)
+        position = self._position(waiter)
+        logger.info(f"Job queued at position {position} (cost {cost:.0f})")
+        await self._notify(on_queued, position)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed to us just before cancellation; pass it on
+                self._release(user_id, sequence)
+            else:
+                self._remove_waiter(waiter)
+            raise
+        return True
+
+    def _can_start(self, user_id) -> bool:
+        """Whether the user is below their concurrency cap."""
+        return user_id is None or self._running_by_user.get(user_id, 0) < self.max_per_user
+
+    def _start(self, user_id, sequence: int, predicted: float):
+        self._running += 1
+        self._active[sequence] = (time.monotonic(), predicted)
+        if user_id is not None:
+            self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+
+    def _score(self, waiter: _Waiter, now: float) -> float:
+        """Effective cost of a waiting job; the lowest runs next."""
+        running = self._running_by_user.get(waiter.user_id, 0) if waiter.user_id is not None else 0
+        return waiter.cost * (1 + running) - self.aging_rate * (now - waiter.enqueued_at)
+
+    def _order(self, waiters: List[_Waiter]) -> List[_Waiter]:
+        now = time.monotonic()
+        return sorted(waiters, key=lambda waiter: (self._score(waiter, now), waiter.sequence))
+
+    def _position(self, waiter: _Waiter) -> int:
+        """1-based rank of a waiter in the current schedule."""
+        return self._order(self._waiting).index(waiter) + 1
+
+    def _release(self, user_id, sequence: int):
+        """Free a slot and start as many waiting jobs as now fit."""
+        self._running -= 1
+        self._active.pop(sequence, None)
+        if user_id is not None:
+            remaining = self._running_by_user.get(user_id, 0) - 1
+            if remaining > 0:
+                self._running_by_user[user_id] = remaining
+            else:
+                self._running_by_user.pop(user_id, None)
+        self._dispatch()
+
+    def _release_from_thread(self, loop: asyncio.AbstractEventLoop, user_id, sequence: int):
+        """Free a slot on the event loop once a worker thread finished its job."""
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._release, user_id, sequence)
+
+    def _dispatch(self):
+        """Hand free slots to the best eligible waiters."""
+        while self._running < self.max_workers:
+            self._waiting = [waiter for waiter in self._waiting if not waiter.future.done()]
+            eligible = [waiter for waiter in self._waiting if self._can_start(waiter.user_id)]
+            if not eligible:
+                return
+            waiter = self._order(eligible)[0]
+            self._waiting.remove(waiter)
+            self._start(waiter.user_id, waiter.sequence, waiter.predicted)
+            waiter.future.set_result(None)
+
+    def _remove_waiter(self, waiter: _Waiter):
+        """Drop a cancelled waiter from the queue."""
+        try:
+            self._waiting.remove(waiter)
+        except ValueError:
+            pass
+
+    async def _notify(self, callback, *args):
+        """Invoke an optional status callback without failing the job."""
+        if callback is None:
+            return
+        try:
+            await callback(*args)
+        except Exception as e:
+            logger.warning(f"Job status callback failed: {e}")
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop accepting work and release the worker threads.
+
+        Args:
+            wait: Block until running jobs finish
+        """
+        for waiter in self._waiting:
+            if not waiter.future.done():
+                waiter.future.cancel()
+        self._waiting.clear()
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,247 @@
+"""
+Durable journal of video jobs and the polling offset.
+
+Every video request is recorded when it arrives and moved through its
+stages (received, downloaded, encoded, uploaded) as it runs, together with
+the files each stage produced. After a restart, unfinished jobs are resumed
+from their last completed stage: an encoded output is uploaded without
+encoding it again, a downloaded input is encoded without downloading it
+again. Redelivered updates of jobs already in the journal are recognised
+and not started twice.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from config import JOB_STORE_PATH, JOB_RETENTION_SECONDS
+from output_metadata import companion_paths
+
+logger = logging.getLogger(__name__)
+
+RECEIVED = 'received'
+DOWNLOADED = 'downloaded'
+ENCODED = 'encoded'
+UPLOADED = 'uploaded'
+FAILED = 'failed'
+UNFINISHED_STAGES = (RECEIVED, DOWNLOADED, ENCODED)
+
+
+@dataclass
+class JobRecord:
+    """One journaled job."""
+
+    job_id: str
+    chat_id: int
+    stage: str
+    message: dict
+    cache_key: str = ''
+    input_path: str = ''
+    output_path: str = ''
+    attempts: int = 0
+    error: str = ''
+
+    @property
+    def finished(self) -> bool:
+        return self.stage not in UNFINISHED_STAGES
+
+    def resume_stage(self) -> str:
+        """
+        Last completed stage whose files are still on disk.
+
+        An encoded job whose output is gone falls back to its input, and a
+        downloaded job whose input is gone starts over.
+        """
+        if self.stage == ENCODED and self.output_path and os.path.exists(self.output_path):
+            return ENCODED
+        if self.stage in (ENCODED, DOWNLOADED) and self.input_path and os.path.exists(self.input_path):
+            return DOWNLOADED
+        return RECEIVED
+
+
+class JobStore:
+    """SQLite-backed job journal, safe to use from several threads."""
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        """
+        Args:
+            path: SQLite database file
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " chat_id INTEGER NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " cache_key TEXT NOT NULL DEFAULT '',"
+            " input_path TEXT NOT NULL DEFAULT '',"
+            " output_path TEXT NOT NULL DEFAULT '',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT NOT NULL DEFAULT '',"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_job_id(chat_id, message_id) -> str:
+        """Job identity of a message, stable across redeliveries."""
+        return f"{chat_id}:{message_id}"
+
+    def create(self, job_id: str, chat_id: int, message: dict, cache_key: str = '') -> bool:
+        """
+        Record a newly received job.
+
+        Args:
+            job_id: See make_job_id()
+            chat_id: Chat the job answers
+            message: The Telegram message, as JSON-compatible dict, so the job
+                can be rebuilt after a restart
+            cache_key: Result cache key of the job
+
+        Returns:
+            False if the job was already in the journal
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, chat_id, stage, message, cache_key,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, chat_id, RECEIVED, json.dumps(message), cache_key, now, now)
+            )
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    def advance(self, job_id: str, stage: str, input_path: Optional[str] = None,
+                output_path: Optional[str] = None, error: Optional[str] = None):
+        """
+        Record that a job completed a stage.
+
+        Args:
+            job_id: Job to update
+            stage: New stage
+            input_path: Downloaded input, if this stage produced it
+            output_path: Encoded output, if this stage produced it
+            error: Failure description, for FAILED
+        """
+        fields = {'stage': stage, 'updated_at': time.time()}
+        if input_path is not None:
+            fields['input_path'] = input_path
+        if output_path is not None:
+            fields['output_path'] = output_path
+        if error is not None:
+            fields['error'] = error
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        try:
+            with self._lock:
+                self._conn.execute(
+                    f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                    (*fields.values(), job_id)
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error journaling job {job_id} as {stage}: {e}")
+
+    def finish(self, job_id: str):
+        """Mark a job as delivered."""
+        self.advance(job_id, UPLOADED)
+
+    def fail(self, job_id: str, error: str = ''):
+        """Mark a job as failed; it is not resumed."""
+        self.advance(job_id, FAILED, error=error)
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._record(row) if row else None
+
+    def claim_unfinished(self) -> List[JobRecord]:
+        """
+        Jobs to resume after a restart, oldest first.
+
+        Each call counts as a resume attempt for the returned jobs.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM jobs WHERE stage IN (?, ?, ?) ORDER BY created_at",
+                UNFINISHED_STAGES
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1 WHERE stage IN (?, ?, ?)",
+                UNFINISHED_STAGES
+            )
+            self._conn.commit()
+        records = [self._record(row) for row in rows]
+        for record in records:
+            record.attempts += 1
+        return records
+
+    def live_paths(self) -> List[str]:
+        """Files unfinished jobs still need, to be kept by the spool sweep."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT input_path, output_path FROM jobs WHERE stage IN (?, ?, ?)",
+                UNFINISHED_STAGES
+            ).fetchall()
+        paths = [path for row in rows for path in row if path]
+        # An encoded output is uploaded with its thumbnail and renditions
+        return paths + [path for _, output_path in rows if output_path
+                        for path in companion_paths(output_path)]
+
+    def prune(self, max_age: float = JOB_RETENTION_SECONDS) -> int:
+        """Forget finished jobs older than max_age seconds; returns how many."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE stage NOT IN (?, ?, ?) AND updated_at < ?",
+                (*UNFINISHED_STAGES, time.time() - max_age)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def get_offset(self) -> int:
+        """Committed polling offset, 0 if none was saved."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE key = 'update_offset'"
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def set_offset(self, offset: int):
+        """Save the committed polling offset."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO state (key, value) VALUES ('update_offset', ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(offset),)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    _COLUMNS = ("job_id, chat_id, stage, message, cache_key, input_path, output_path,"
+                " attempts, error")
+
+    @staticmethod
+    def _record(row) -> JobRecord:
+        job_id, chat_id, stage, message, cache_key, input_path, output_path, attempts, error = row
+        return JobRecord(
+            job_id=job_id, chat_id=chat_id, stage=stage, message=json.loads(message),
+            cache_key=cache_key, input_path=input_path, output_path=output_path,
+            attempts=attempts, error=error
+        )
@@ -1,23 +1,26 @@
 #!/usr/bin/env python3
 """
 Simple web server to keep the bot alive for UptimeRobot monitoring.
+
+Runs on asyncio so slow clients never hold up others. Besides the status
+page it serves /metrics, and in webhook mode it receives Telegram updates
+on WEBHOOK_PATH: each delivery is checked against the secret token, handed
+to the update handler and acknowledged straight away.
 """
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import asyncio
+import hmac
+import inspect
+import json
 import logging
 import threading
+from typing import Any, Callable, Optional
+
+from config import KEEP_ALIVE_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_BODY
+from metrics import REGISTRY, CONTENT_TYPE, WEBHOOK_REQUESTS
 
 logger = logging.getLogger(__name__)
 
-class KeepAliveHandler(BaseHTTPRequestHandler):
-    """Simple HTTP handler for health checks."""
-    
-    def do_GET(self):
-        """Handle GET requests."""
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        
-        message = """
+STATUS_PAGE = """
         <!DOCTYPE html>
         <html>
         <head>
@@ -30,21 +33,158 @@ class KeepAliveHandler(BaseHTTPRequestHandler):
         </body>
         </html>
         """
-        self.wfile.write(message.encode())
-    
-    def log_message(self, format, *args):
-        """Suppress HTTP server logs to keep console clean."""
-        pass
-
-def run_server(port=5000):
-    """Run the keep-alive web server."""
-    server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, KeepAliveHandler)
-    logger.info(f"Keep-alive server running on port {port}")
-    httpd.serve_forever()
-
-def start_server_thread():
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+# Receives each update dict; returns False (or a coroutine resolving to False)
+# when it cannot take the update now, so Telegram retries it later
+WebhookHandler = Callable[[dict], Any]
+
+
+class KeepAliveServer:
+    """HTTP/1.1 server for health checks, metrics and webhook deliveries."""
+
+    def __init__(self, webhook_handler: Optional[WebhookHandler] = None,
+                 secret: str = WEBHOOK_SECRET):
+        """
+        Args:
+            webhook_handler: Called with each webhook update; None disables
+                the webhook route
+            secret: Expected X-Telegram-Bot-Api-Secret-Token header
+        """
+        self.webhook_handler = webhook_handler
+        self.secret = secret
+
+    async def start(self, host: str = '0.0.0.0', port: int = KEEP_ALIVE_PORT) -> asyncio.AbstractServer:
+        """Start listening on the running event loop."""
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Keep-alive server running on port {port}")
+        return server
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests on one connection until the client closes it."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+
+                request_line, *header_lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                    headers = {}
+                    for line in header_lines:
+                        name, _, value = line.partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+
+                if length > WEBHOOK_MAX_BODY:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, content_type, payload = await self._route(
+                    method, target.split('?')[0], headers, body
+                )
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                await self._respond(writer, status, content_type,
+                                    b'' if method == 'HEAD' else payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Error serving HTTP request: {e}")
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes):
+        """Return (status, content type, body) for a request."""
+        if path == WEBHOOK_PATH and self.webhook_handler is not None:
+            if method != 'POST':
+                return 405, 'text/plain', b''
+            status = await self._webhook(headers, body)
+            WEBHOOK_REQUESTS.inc(status=str(status))
+            return status, 'text/plain', b''
+
+        if method not in ('GET', 'HEAD'):
+            return 405, 'text/plain', b''
+        if path == '/metrics':
+            # Serve job metrics in the Prometheus text format
+            return 200, CONTENT_TYPE, REGISTRY.render().encode()
+        return 200, 'text/html', STATUS_PAGE.encode()
+
+    async def _webhook(self, headers: dict, body: bytes) -> int:
+        """Validate a delivery and hand its update over; returns the status."""
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            logger.warning("Rejected webhook delivery with a wrong secret token")
+            return 403
+
+        try:
+            update = json.loads(body)
+            update['update_id']
+        except (ValueError, TypeError, KeyError):
+            return 400
+
+        try:
+            accepted = self.webhook_handler(update)
+            if inspect.isawaitable(accepted):
+                accepted = await accepted
+        except Exception as e:
+            logger.error(f"Error accepting webhook update {update['update_id']}: {e}")
+            return 503
+        # Telegram redelivers anything not answered with 200
+        return 503 if accepted is False else 200
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int,
+                       content_type: str = 'text/plain', body: bytes = b'',
+                       keep_alive: bool = True):
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+
+async def serve(port: int = KEEP_ALIVE_PORT,
+                webhook_handler: Optional[WebhookHandler] = None) -> asyncio.AbstractServer:
+    """
+    Start the keep-alive server on the running event loop.
+
+    Args:
+        port: Port to listen on
+        webhook_handler: Receives webhook updates; None serves no webhook
+
+    Returns:
+        The listening server
+    """
+    return await KeepAliveServer(webhook_handler).start(port=port)
+
+
+def run_server(port=KEEP_ALIVE_PORT, webhook_handler: Optional[WebhookHandler] = None):
+    """Run the keep-alive web server until the process exits."""
+    async def main():
+        server = await serve(port, webhook_handler)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_server_thread(webhook_handler: Optional[WebhookHandler] = None):
     """Start the web server in a background thread."""
-    server_thread = threading.Thread(target=run_server, daemon=True)
+    server_thread = threading.Thread(
+        target=run_server, kwargs={'webhook_handler': webhook_handler}, daemon=True
+    )
     server_thread.start()
     logger.info("Keep-alive server started in background")
@@ -0,0 +1,70 @@
+"""
+Zero-copy ingest from a local Telegram Bot API server.
+
+A telegram-bot-api server started with --local answers getFile with the
+absolute path of the file on its own disk. When that path is visible to the
+bot (a shared volume), the file is linked into the spool instead of being
+downloaded: a hard link when both are on the same filesystem, otherwise a
+symbolic link so FFmpeg reads the server's copy in place.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+
+def local_file_path(file_path: Optional[str]) -> Optional[str]:
+    """
+    Return the local path of a getFile result, if the file is readable here.
+
+    Args:
+        file_path: file_path from getFile; relative for the cloud Bot API,
+            absolute (or a file:// URL) for a local server
+
+    Returns:
+        Absolute path to read the file from, or None to download it
+    """
+    if not file_path:
+        return None
+    if file_path.startswith('file://'):
+        file_path = file_path[len('file://'):]
+    if not os.path.isabs(file_path):
+        return None
+    if os.path.isfile(file_path) and os.access(file_path, os.R_OK):
+        return file_path
+    logger.warning(f"Local Bot API path {file_path} is not readable here, downloading instead")
+    return None
+
+
+def link_local_file(source_path: str, input_path: str) -> str:
+    """
+    Make a local server's file available at a spool path without copying it.
+
+    Args:
+        source_path: File on the local Bot API server's disk
+        input_path: Spool path to replace with a link to it
+
+    Returns:
+        'hardlink' or 'symlink', whichever was used
+
+    Raises:
+        OSError: If neither kind of link could be created
+    """
+    tmp_path = f"{input_path}.link"
+    with track_stage('local_ingest'):
+        try:
+            os.link(source_path, tmp_path)
+            kind = 'hardlink'
+        except OSError as e:
+            # Different filesystem, or hard links to foreign files are not allowed
+            logger.info(f"Hard link failed ({e}), reading {source_path} in place")
+            os.symlink(os.path.abspath(source_path), tmp_path)
+            kind = 'symlink'
+        os.replace(tmp_path, input_path)
+
+    logger.info(f"Linked {source_path} into the spool ({kind}, {os.path.getsize(input_path)} bytes)")
+    return kind
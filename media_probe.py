@@ -0,0 +1,180 @@
+"""
+Single-call media probing.
+
+One ffprobe run per job collects everything the encode plan needs: container,
+codecs, bitrates, pixel format, rotation, audio presence and the keyframe
+interval. The result is passed around instead of probing the same file again
+for sizing, scheduling and command building.
+"""
+
+import json
+import logging
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+
+from config import AUDIO_COPY_CODECS, PROBE_PACKET_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeError(Exception):
+    """Raised when a file cannot be probed or has no video stream."""
+
+
+@dataclass
+class MediaInfo:
+    """Probe result for one input file."""
+
+    container: str = ''
+    duration: float = 0.0
+    size: int = 0
+    bit_rate: int = 0
+    coded_width: int = 0
+    coded_height: int = 0
+    rotation: int = 0
+    video_codec: str = ''
+    pix_fmt: str = ''
+    video_bit_rate: int = 0
+    frame_rate: float = 0.0
+    keyframe_interval: Optional[float] = None
+    has_audio: bool = False
+    audio_codec: str = ''
+    audio_bit_rate: int = 0
+    channels: int = 0
+    sample_rate: int = 0
+
+    @property
+    def width(self) -> int:
+        """Displayed width, after applying the rotation FFmpeg auto-rotates by."""
+        return self.coded_height if self._quarter_turn else self.coded_width
+
+    @property
+    def height(self) -> int:
+        """Displayed height, after applying the rotation FFmpeg auto-rotates by."""
+        return self.coded_width if self._quarter_turn else self.coded_height
+
+    @property
+    def audio_copyable(self) -> bool:
+        """Whether the audio stream can be muxed into the MP4 output unchanged."""
+        return self.has_audio and self.audio_codec in AUDIO_COPY_CODECS
+
+    @property
+    def _quarter_turn(self) -> bool:
+        return abs(self.rotation) % 180 == 90
+
+
+def probe(path: str, timeout: int = 30) -> MediaInfo:
+    """
+    Probe a media file with a single ffprobe call.
+
+    Args:
+        path: Path to the media file, may be a partial download
+        timeout: Seconds to wait for ffprobe
+
+    Returns:
+        MediaInfo for the file
+
+    Raises:
+        ProbeError: If ffprobe fails or the file has no video stream
+    """
+    cmd = [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-show_format', '-show_streams',
+        '-show_entries', 'packet=stream_index,pts_time,flags',
+        '-read_intervals', f'%+{PROBE_PACKET_SECONDS}',
+        path
+    ]
+    try:
+        output = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=timeout)
+        data = json.loads(output.stdout)
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        raise ProbeError(f"ffprobe failed for {path}: {e}") from e
+    return parse_probe(data)
+
+
+def parse_probe(data: dict) -> MediaInfo:
+    """
+    Build MediaInfo from ffprobe JSON output.
+
+    Args:
+        data: Parsed ffprobe output with format, streams and optionally packets
+
+    Returns:
+        MediaInfo for the file
+
+    Raises:
+        ProbeError: If there is no video stream
+    """
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    if video is None:
+        raise ProbeError("No video stream found")
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    fmt = data.get('format', {})
+
+    info = MediaInfo(
+        container=fmt.get('format_name', ''),
+        duration=_float(video.get('duration')) or _float(fmt.get('duration')),
+        size=_int(fmt.get('size')),
+        bit_rate=_int(fmt.get('bit_rate')),
+        coded_width=_int(video.get('width')),
+        coded_height=_int(video.get('height')),
+        rotation=_rotation(video),
+        video_codec=video.get('codec_name', ''),
+        pix_fmt=video.get('pix_fmt', ''),
+        video_bit_rate=_int(video.get('bit_rate')),
+        frame_rate=_rate(video.get('avg_frame_rate')) or _rate(video.get('r_frame_rate')),
+        keyframe_interval=_keyframe_interval(data.get('packets', []), video.get('index'))
+    )
+    if audio is not None:
+        info.has_audio = True
+        info.audio_codec = audio.get('codec_name', '')
+        info.audio_bit_rate = _int(audio.get('bit_rate'))
+        info.channels = _int(audio.get('channels'))
+        info.sample_rate = _int(audio.get('sample_rate'))
+    return info
+
+
+def _rotation(stream: dict) -> int:
+    """Rotation in degrees from the display matrix or the legacy rotate tag."""
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(_float(side_data['rotation']))
+    return _int(stream.get('tags', {}).get('rotate'))
+
+
+def _keyframe_interval(packets: list, stream_index) -> Optional[float]:
+    """Average seconds between keyframes in the scanned packets."""
+    times = sorted(
+        _float(packet.get('pts_time')) for packet in packets
+        if packet.get('stream_index') == stream_index
+        and 'K' in packet.get('flags', '') and packet.get('pts_time') is not None
+    )
+    if len(times) < 2:
+        return None
+    return (times[-1] - times[0]) / (len(times) - 1)
+
+
+def _rate(value: Optional[str]) -> float:
+    """Parse an ffprobe rational such as '30000/1001'."""
+    try:
+        num, _, den = (value or '').partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
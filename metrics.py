@@ -0,0 +1,270 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+A small, dependency-free subset of the Prometheus client: counters, gauges
+and histograms with labels, collected in a registry that keep_alive.py
+serves on /metrics. The job pipeline records per-stage durations, failures,
+transfer sizes, queue wait and encode speed through the helpers below.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTE_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 20, 50, 100, 150, 500))
+FPS_BUCKETS = (5, 10, 25, 50, 100, 200, 400)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class for a metric family with optional labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        """Exposition lines including HELP and TYPE."""
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}"
+        ] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Add amount to the counter for the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or is read from a callback."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """Read the (unlabelled) value from function at scrape time."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        """Record one observation for the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series['counts']) if series else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted(
+                ((key, {'counts': list(series['counts']), 'sum': series['sum']})
+                 for key, series in self._series.items()),
+                key=lambda item: item[0]
+            )
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'watermark_stage_duration_seconds', 'Time spent in each job stage.', ['stage']
+))
+STAGE_FAILURES = REGISTRY.register(Counter(
+    'watermark_stage_failures_total', 'Job stages that failed.', ['stage']
+))
+TRANSFER_BYTES = REGISTRY.register(Histogram(
+    'watermark_transfer_bytes', 'Size of each video download or upload.', ['direction'],
+    buckets=BYTE_BUCKETS
+))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'watermark_queue_wait_seconds', 'Time jobs waited for a worker slot.'
+))
+ENCODE_FPS = REGISTRY.register(Histogram(
+    'watermark_encode_fps', 'Frames encoded per second of wall time.', buckets=FPS_BUCKETS
+))
+JOBS = REGISTRY.register(Counter(
+    'watermark_jobs_total', 'Video requests by outcome.', ['outcome']
+))
+JOBS_RUNNING = REGISTRY.register(Gauge(
+    'watermark_jobs_running', 'Jobs holding a worker slot.'
+))
+JOBS_QUEUED = REGISTRY.register(Gauge(
+    'watermark_jobs_queued', 'Jobs waiting for a worker slot.'
+))
+QUEUE_DRAIN_SECONDS = REGISTRY.register(Gauge(
+    'watermark_queue_drain_seconds', 'Predicted seconds until all admitted jobs finish.'
+))
+
+WEBHOOK_REQUESTS = REGISTRY.register(Counter(
+    'watermark_webhook_requests_total', 'Webhook deliveries by response status.', ['status']
+))
+DOWNLOAD_RESUMES = REGISTRY.register(Counter(
+    'watermark_download_resumes_total', 'Downloads continued after a dropped connection or server error.'
+))
+SPOOL_RESERVED_BYTES = REGISTRY.register(Gauge(
+    'watermark_spool_reserved_bytes', 'Spool space reserved by running jobs.', ['tier']
+))
+ENCODE_THREADS = REGISTRY.register(Gauge(
+    'watermark_encode_threads', 'Encoder threads handed to running encodes.'
+))
+ENCODE_PROFILES = REGISTRY.register(Counter(
+    'watermark_encode_profile_total', 'Encodes started by encoder profile.', ['profile']
+))
+
+
+def record_stage(stage: str, seconds: float, success: bool = True):
+    """
+    Record the duration and outcome of one job stage.
+
+    Args:
+        stage: Stage name, e.g. 'download' or 'encode'
+        seconds: Wall time the stage took
+        success: False to count the stage as failed
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if not success:
+        STAGE_FAILURES.inc(stage=stage)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Time the enclosed block as a stage; exceptions count as failures."""
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        record_stage(stage, time.monotonic() - start, success=False)
+        raise
+    record_stage(stage, time.monotonic() - start)
+
+
+def record_encode(seconds: float, frames: float):
+    """Record encode speed for a finished encode."""
+    if seconds > 0 and frames > 0:
+        ENCODE_FPS.observe(frames / seconds)
@@ -0,0 +1,127 @@
+"""
+Playback metadata for watermarked outputs.
+
+Outputs are written with the moov atom in front (faststart), so Telegram
+clients can start playing before the whole file is downloaded, and are
+sent with their dimensions, duration and a JPEG thumbnail so the server
+does not have to work them out. The thumbnail is a second output of the
+encode's own filter graph, so the input is decoded only once; the
+dimensions and duration come from the input's probe and the encoder
+profile.
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+from config import THUMBNAIL_MAX_SIDE, THUMBNAIL_SECONDS, THUMBNAIL_QUALITY
+from media_probe import probe
+from renditions import configured_renditions, rendition_path
+
+logger = logging.getLogger(__name__)
+
+# Output options that move the moov atom in front of the media data
+FASTSTART_ARGS = {'movflags': '+faststart'}
+# Output options for the single-frame thumbnail
+THUMBNAIL_ARGS = {'frames:v': 1, 'q:v': THUMBNAIL_QUALITY}
+
+
+def thumbnail_path(video_path: str) -> str:
+    """The thumbnail written next to an output video."""
+    return f"{os.path.splitext(video_path)[0]}.jpg"
+
+
+def companion_paths(video_path: str) -> List[str]:
+    """Files the encode writes next to an output video: its thumbnail and renditions."""
+    return [thumbnail_path(video_path)] + [
+        rendition_path(video_path, rendition.name) for rendition in configured_renditions()
+    ]
+
+
+def thumbnail_position(duration: float) -> float:
+    """Seconds into the video of the thumbnail frame, past any fade-in."""
+    return min(THUMBNAIL_SECONDS, duration / 2) if duration > 0 else 0.0
+
+
+def thumbnail_filter(duration: float) -> str:
+    """
+    Filter chain turning the watermarked video into the thumbnail frame.
+
+    Args:
+        duration: Video duration in seconds
+
+    Returns:
+        filter_complex chain, selecting the frame and fitting it into
+        THUMBNAIL_MAX_SIDE
+    """
+    return (
+        f"select='gte(t,{thumbnail_position(duration):.3f})',"
+        f"scale={THUMBNAIL_MAX_SIDE}:{THUMBNAIL_MAX_SIDE}:force_original_aspect_ratio=decrease"
+    )
+
+
+class OutputMetadata:
+    """Dimensions and duration of encoded outputs, kept until they are cleaned up."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._attributes: Dict[str, dict] = {}
+
+    def remember(self, video_path: str, width: int, height: int, duration: float):
+        """
+        Record the attributes of a finished encode.
+
+        Args:
+            video_path: Path to the encoded video
+            width: Output width
+            height: Output height
+            duration: Duration in seconds
+        """
+        with self._lock:
+            self._attributes[video_path] = {
+                'width': width, 'height': height, 'duration': max(1, round(duration))
+            }
+
+    def attributes(self, video_path: str) -> dict:
+        """
+        Width, height and duration to send a video with.
+
+        Outputs not encoded by this process, e.g. kept from before a
+        restart or from the result cache, are probed instead.
+
+        Args:
+            video_path: Path to the video
+
+        Returns:
+            Dictionary of sendVideo parameters, empty if nothing is known
+        """
+        with self._lock:
+            known = self._attributes.get(video_path)
+        if known:
+            return dict(known)
+        try:
+            info = probe(video_path)
+            return {'width': info.width, 'height': info.height,
+                    'duration': max(1, round(info.duration))}
+        except Exception as e:
+            logger.warning(f"Error probing output {video_path}: {e}")
+            return {}
+
+    def thumbnail(self, video_path: str) -> Optional[str]:
+        """The video's thumbnail, if the encode wrote one."""
+        path = thumbnail_path(video_path)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            return path
+        return None
+
+    def forget(self, video_path: str):
+        """Drop a video's attributes and delete its thumbnail."""
+        with self._lock:
+            self._attributes.pop(video_path, None)
+        path = thumbnail_path(video_path)
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+        except OSError as e:
+            logger.error(f"Error cleaning up thumbnail {path}: {e}")
@@ -0,0 +1,449 @@
+"""
+Parallel, resumable downloads with HTTP Range requests.
+
+A large file is split into parts that several keep-alive connections fetch
+at the same time, each writing at its own offset into a file preallocated
+to the full size. A connection that drops mid-part is reopened and the part
+continues from the last byte written instead of from the start. Servers
+that ignore Range get a single sequential download. The finished file is
+checked against the size Telegram reported. Cancelling the job's
+CancelToken shuts every connection down and stops the download at once.
+"""
+
+import http.client
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import urllib.parse
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Set, Tuple
+
+from cancellation import CancelToken, JobCancelledError
+from config import (
+    DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_PART_SIZE,
+    DOWNLOAD_MAX_RETRIES,
+    DOWNLOAD_RETRY_BACKOFF,
+    DOWNLOAD_SOCKET_TIMEOUT,
+    STREAM_CHUNK_SIZE
+)
+from metrics import DOWNLOAD_RESUMES
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class RangedDownloadError(Exception):
+    """Raised when a download fails for good or does not have the expected size."""
+
+
+class _TransientError(Exception):
+    """A failure worth retrying: dropped connection, timeout or 5xx answer."""
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of one download."""
+
+    size: int
+    seconds: float
+    connections: int
+    resumes: int
+    ranged: bool
+
+
+class RangedDownloader:
+    """Downloads files over parallel Range requests into a preallocated file."""
+
+    def __init__(self, connections: int = DOWNLOAD_CONNECTIONS, part_size: int = DOWNLOAD_PART_SIZE,
+                 max_retries: int = DOWNLOAD_MAX_RETRIES, timeout: float = DOWNLOAD_SOCKET_TIMEOUT):
+        """
+        Args:
+            connections: Most connections used for one file
+            part_size: Bytes fetched per Range request
+            max_retries: Retries per part after transient errors that made
+                no progress
+            timeout: Socket timeout in seconds
+        """
+        self.connections = max(1, connections)
+        self.part_size = max(STREAM_CHUNK_SIZE, part_size)
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    def download(self, url: str, path: str, expected_size: int = 0,
+                 cancel: Optional[CancelToken] = None) -> DownloadResult:
+        """
+        Download url into path.
+
+        Args:
+            url: HTTP(S) URL of the file
+            path: Destination; created or overwritten
+            expected_size: Size reported by Telegram, 0 if unknown
+            cancel: Token that aborts the download
+
+        Returns:
+            Statistics of the download
+
+        Raises:
+            RangedDownloadError: If the file could not be downloaded completely
+            JobCancelledError: If the job was cancelled
+        """
+        started = time.monotonic()
+        target = _Target(url, self.timeout)
+        state = _State(cancel or CancelToken())
+        state.cancel.check()
+
+        connection = state.track(target.connect())
+        try:
+            with state.cancel.on_cancel(state.abort):
+                return self._download(target, connection, path, expected_size, state, started)
+        finally:
+            connection.close()
+            state.untrack(connection)
+
+    def _download(self, target: '_Target', connection: http.client.HTTPConnection, path: str,
+                  expected_size: int, state: '_State', started: float) -> DownloadResult:
+        """Download over the probe connection and, if Range works, parallel workers."""
+        try:
+            response, total = self._open_first_part(target, connection, state, expected_size)
+            if total is None:
+                # No Range support: one sequential stream, restarted from zero on errors
+                size = self._download_sequential(target, connection, response, path, state)
+                if expected_size and size != expected_size:
+                    raise RangedDownloadError(f"Downloaded {size} bytes, expected {expected_size}")
+                return DownloadResult(size, time.monotonic() - started, 1, state.resumes, False)
+
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                _preallocate(fd, total)
+                parts = deque(
+                    (start, min(start + self.part_size, total) - 1)
+                    for start in range(self.part_size, total, self.part_size)
+                )
+                workers = min(self.connections, len(parts) + 1)
+                threads = [
+                    threading.Thread(target=self._worker, args=(target, None, fd, parts, state),
+                                     name=f'download-{index}', daemon=True)
+                    for index in range(1, workers)
+                ]
+                for thread in threads:
+                    thread.start()
+
+                # This thread finishes the first part on the probe connection,
+                # then helps with the rest
+                try:
+                    first_end = min(self.part_size, total) - 1
+                    state.mark(0)
+                    try:
+                        offset = _read_into(response, fd, 0, first_end, state)
+                    except (OSError, http.client.HTTPException) as e:
+                        offset = state.progress_before_error
+                        logger.info(f"Download connection dropped at byte {offset}: {e}")
+                    if offset <= first_end:
+                        state.note_resume()
+                        connection.close()
+                        self._fetch_part(target, connection, fd, offset, first_end, state)
+                except RangedDownloadError as e:
+                    state.fail(e)
+                except JobCancelledError:
+                    # The workers see the token too; wait for them before closing the file
+                    pass
+                self._worker(target, connection, fd, parts, state)
+                for thread in threads:
+                    thread.join()
+            finally:
+                os.close(fd)
+        except (OSError, http.client.HTTPException):
+            state.cancel.check()
+            raise
+
+        state.cancel.check()
+        if state.error:
+            raise state.error
+        if state.received != total:
+            raise RangedDownloadError(f"Downloaded {state.received} of {total} bytes")
+        seconds = time.monotonic() - started
+        logger.info(f"Downloaded {total} bytes over {workers} connections in {seconds:.2f}s "
+                    f"({state.resumes} resumes)")
+        return DownloadResult(total, seconds, workers, state.resumes, True)
+
+    def _open_first_part(self, target: '_Target', connection: http.client.HTTPConnection,
+                         state: '_State', expected_size: int):
+        """
+        Request the first part; the answer tells whether Range is supported.
+
+        Returns:
+            (response, total size), total being None if the server sent the
+            whole file instead of a range
+        """
+        attempt = 0
+        while True:
+            try:
+                response = target.get(connection, f'bytes=0-{self.part_size - 1}')
+                break
+            except _TransientError as e:
+                state.cancel.check()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise RangedDownloadError(f"Download failed: {e}") from e
+                connection.close()
+                state.cancel.wait(DOWNLOAD_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+        if response.status == 200:
+            total = None
+            length = response.getheader('Content-Length')
+            size = int(length) if length else 0
+        else:
+            size = total = _content_range(response)[2]
+        if expected_size and size and size != expected_size:
+            response.close()
+            raise RangedDownloadError(f"Server reports {size} bytes, expected {expected_size}")
+        return response, total
+
+    def _worker(self, target: '_Target', connection: Optional[http.client.HTTPConnection],
+                fd: int, parts: deque, state: '_State'):
+        """Fetch parts from the shared queue until it is empty or a part fails."""
+        own_connection = connection is None
+        if own_connection:
+            connection = state.track(target.connect())
+        try:
+            while not state.error:
+                try:
+                    start, end = parts.popleft()
+                except IndexError:
+                    return
+                self._fetch_part(target, connection, fd, start, end, state)
+        except RangedDownloadError as e:
+            state.fail(e)
+        except JobCancelledError:
+            pass
+        except Exception as e:
+            state.fail(RangedDownloadError(f"Download failed: {e}"))
+        finally:
+            if own_connection:
+                connection.close()
+                state.untrack(connection)
+
+    def _fetch_part(self, target: '_Target', connection: http.client.HTTPConnection,
+                    fd: int, start: int, end: int, state: '_State') -> int:
+        """
+        Fetch bytes start..end, resuming after transient errors.
+
+        Returns:
+            end + 1
+
+        Raises:
+            RangedDownloadError: If the part still fails after max_retries
+                attempts without progress
+            JobCancelledError: If the download was cancelled
+        """
+        offset = start
+        attempts = 0
+        while offset <= end:
+            state.cancel.check()
+            if state.error:
+                raise state.error
+            state.mark(offset)
+            attempt_start = offset
+            try:
+                response = target.get(connection, f'bytes={offset}-{end}')
+                if response.status != 206 or _content_range(response)[0] != offset:
+                    response.close()
+                    raise RangedDownloadError(f"Server ignored the range of bytes {offset}-{end}")
+                offset = _read_into(response, fd, offset, end, state)
+                if offset <= end:
+                    raise _TransientError(f"connection closed at byte {offset}")
+            except (_TransientError, OSError, http.client.HTTPException) as e:
+                state.cancel.check()
+                offset = state.progress_before_error
+                logger.info(f"Resuming download at byte {offset} after: {e}")
+                state.note_resume()
+                connection.close()
+                if offset > attempt_start:
+                    # The connection dropped after making progress: continue at once
+                    attempts = 0
+                    continue
+                attempts += 1
+                if attempts > self.max_retries:
+                    raise RangedDownloadError(
+                        f"Bytes {offset}-{end} failed after {self.max_retries} retries: {e}"
+                    ) from e
+                state.cancel.wait(DOWNLOAD_RETRY_BACKOFF * 2 ** (attempts - 1))
+        return offset
+
+    def _download_sequential(self, target: '_Target', connection: http.client.HTTPConnection,
+                             response: Optional[http.client.HTTPResponse], path: str,
+                             state: '_State') -> int:
+        """Stream a whole-file response to path, starting over on errors."""
+        attempts = 0
+        while True:
+            try:
+                if response is None:
+                    response = target.get(connection, None)
+                length = response.getheader('Content-Length')
+                expected = int(length) if length else None
+                received = 0
+                with open(path, 'wb') as f:
+                    while True:
+                        state.cancel.check()
+                        chunk = response.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        received += len(chunk)
+                state.cancel.check()
+                if expected is not None and received != expected:
+                    raise _TransientError(f"connection closed after {received} of {expected} bytes")
+                state.received = received
+                return received
+            except (_TransientError, OSError, http.client.HTTPException) as e:
+                state.cancel.check()
+                attempts += 1
+                if attempts > self.max_retries:
+                    raise RangedDownloadError(f"Download failed: {e}") from e
+                logger.info(f"Server does not support ranges, restarting download after: {e}")
+                state.note_resume()
+                connection.close()
+                response = None
+                state.cancel.wait(DOWNLOAD_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+
+class _Target:
+    """Connection factory and request helper for one URL."""
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise RangedDownloadError(f"Unsupported URL scheme {parsed.scheme!r}")
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        self.timeout = timeout
+
+    def connect(self) -> http.client.HTTPConnection:
+        connection_class = (http.client.HTTPSConnection if self.scheme == 'https'
+                            else http.client.HTTPConnection)
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def get(self, connection: http.client.HTTPConnection,
+            byte_range: Optional[str]) -> http.client.HTTPResponse:
+        """
+        Send a GET, optionally for a byte range.
+
+        Raises:
+            _TransientError: On 429 and 5xx answers
+            RangedDownloadError: On other error answers
+        """
+        headers = {'Range': byte_range} if byte_range else {}
+        try:
+            connection.request('GET', self.path, headers=headers)
+            response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise _TransientError(str(e)) from e
+        if response.status in (200, 206):
+            return response
+        response.read()
+        if response.status == 429 or response.status >= 500:
+            raise _TransientError(f"HTTP {response.status}")
+        # The URL contains the bot token, so it is not part of the message
+        raise RangedDownloadError(f"Download refused with HTTP {response.status}")
+
+
+class _State:
+    """Progress and failure shared by the threads of one download."""
+
+    def __init__(self, cancel: CancelToken):
+        self.cancel = cancel
+        self.received = 0
+        self.resumes = 0
+        self.error: Optional[RangedDownloadError] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: Set[http.client.HTTPConnection] = set()
+
+    def track(self, connection: http.client.HTTPConnection) -> http.client.HTTPConnection:
+        """Register a connection for abort()."""
+        with self._lock:
+            self._connections.add(connection)
+        return connection
+
+    def untrack(self, connection: http.client.HTTPConnection):
+        with self._lock:
+            self._connections.discard(connection)
+
+    def abort(self):
+        """Shut down every open connection, failing any read blocked on it."""
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            sock = connection.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    @property
+    def progress_before_error(self) -> int:
+        """Offset reached by this thread's last read before it failed."""
+        return getattr(self._local, 'offset', 0)
+
+    def mark(self, offset: int):
+        """Remember where this thread's next read starts."""
+        self._local.offset = offset
+
+    def add(self, offset: int, size: int):
+        self._local.offset = offset + size
+        with self._lock:
+            self.received += size
+
+    def note_resume(self):
+        DOWNLOAD_RESUMES.inc()
+        with self._lock:
+            self.resumes += 1
+
+    def fail(self, error: RangedDownloadError):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+
+def _read_into(response: http.client.HTTPResponse, fd: int, offset: int, end: int,
+               state: _State) -> int:
+    """Write a response body at offset; returns the next offset to fetch."""
+    while offset <= end:
+        state.cancel.check()
+        chunk = response.read(min(STREAM_CHUNK_SIZE, end - offset + 1))
+        if not chunk:
+            break
+        os.pwrite(fd, chunk, offset)
+        state.add(offset, len(chunk))
+        offset += len(chunk)
+    return offset
+
+
+def _content_range(response: http.client.HTTPResponse) -> Tuple[int, int, int]:
+    """(first byte, last byte, total size) of a 206 response."""
+    match = CONTENT_RANGE_PATTERN.match(response.getheader('Content-Range') or '')
+    if not match or match.group(3) == '*':
+        response.close()
+        raise RangedDownloadError("Range response without a usable Content-Range")
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+
+def _preallocate(fd: int, size: int):
+    """Reserve the file's full size up front, so parts can be written in any order."""
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # Not supported on every platform or filesystem
+        os.ftruncate(fd, size)
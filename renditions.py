@@ -0,0 +1,96 @@
+"""
+Extra renditions encoded alongside the main output.
+
+A rendition, e.g. a 480p copy for mobile data, is a further output of the
+main encode's FFmpeg run: the input is decoded and watermarked once, the
+frames are split, and every output scales them and encodes with its own
+encoder profile. Each rendition is a complete faststart MP4 next to the
+main output and is uploaded on its own.
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from config import RENDITIONS, RENDITION_PROFILES
+from encoder_profiles import EncoderProfile, PROFILES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """One extra output: its name and the profile it is encoded with."""
+
+    name: str
+    profile: EncoderProfile
+
+
+def configured_renditions() -> List[Rendition]:
+    """
+    The renditions enabled by config.RENDITIONS.
+
+    Returns:
+        Renditions in configuration order; unknown names are skipped
+    """
+    renditions = []
+    for name in RENDITIONS:
+        profile = PROFILES.get(RENDITION_PROFILES.get(name, ''))
+        if profile is None:
+            logger.warning(f"Ignoring rendition '{name}' without a known encoder profile")
+            continue
+        renditions.append(Rendition(name, profile))
+    return renditions
+
+
+def renditions_for(width: int, height: int) -> List[Rendition]:
+    """
+    The renditions worth encoding for a main output size.
+
+    Args:
+        width: Main output width
+        height: Main output height
+
+    Returns:
+        Renditions that come out smaller than the main output
+    """
+    return [
+        rendition for rendition in configured_renditions()
+        if rendition.profile.output_size(width, height) != (width, height)
+    ]
+
+
+def rendition_path(video_path: str, name: str) -> str:
+    """The path of a rendition written next to the main output."""
+    base, ext = os.path.splitext(video_path)
+    return f"{base}_{name}{ext}"
+
+
+def existing_renditions(video_path: str) -> List[Tuple[Rendition, str]]:
+    """(rendition, path) for each rendition written next to a main output."""
+    return [
+        (rendition, path) for rendition in configured_renditions()
+        for path in [rendition_path(video_path, rendition.name)]
+        if os.path.exists(path) and os.path.getsize(path) > 0
+    ]
+
+
+def remove_renditions(video_path: str) -> List[str]:
+    """
+    Delete the renditions written next to a main output.
+
+    Returns:
+        The paths that were removed
+    """
+    removed = []
+    for rendition in configured_renditions():
+        path = rendition_path(video_path, rendition.name)
+        if not os.path.exists(path):
+            continue
+        try:
+            os.unlink(path)
+            removed.append(path)
+        except OSError as e:
+            logger.error(f"Error cleaning up rendition {path}: {e}")
+    return removed
@@ -0,0 +1,191 @@
+"""
+Cache of watermarked results.
+
+Entries are keyed on the source video identity (Telegram ``file_unique_id``)
+plus every setting that affects the output. Each entry can hold the Telegram
+``file_id`` of an already uploaded result, so repeats are a single
+``sendVideo`` by reference, and a local copy of the encoded file used when
+that ``file_id`` no longer works.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import CACHE_DIR, CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Persistent file_id index with a size-bounded LRU tier on local disk."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.cache_dir, 'index.sqlite3'),
+            check_same_thread=False
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " file_id TEXT,"
+            " local_path TEXT,"
+            " size INTEGER NOT NULL DEFAULT 0,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(source_id: str, watermark_text: str, site_text: str,
+                 settings: Optional[dict] = None) -> str:
+        """
+        Build the cache key for a source video and watermark settings.
+
+        Args:
+            source_id: Telegram file_unique_id of the source video
+            watermark_text: Bottom right watermark text
+            site_text: Top center watermark text
+            settings: Font and encoder settings that affect the output
+
+        Returns:
+            Hex digest identifying the watermarked result
+        """
+        payload = json.dumps(
+            [source_id, watermark_text, site_text, settings or {}],
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_file_id(self, key: str) -> Optional[str]:
+        """Return the Telegram file_id of an uploaded result, if known."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[0]:
+                self._touch(key)
+                return row[0]
+        return None
+
+    def put_file_id(self, key: str, file_id: str):
+        """Remember the Telegram file_id of an uploaded result."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO entries (key, file_id, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET file_id = excluded.file_id,"
+                " last_used = excluded.last_used",
+                (key, file_id, time.time())
+            )
+            self._conn.commit()
+
+    def forget_file_id(self, key: str):
+        """Drop a file_id that Telegram no longer accepts."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET file_id = NULL WHERE key = ?", (key,)
+            )
+            self._conn.commit()
+        logger.info(f"Dropped stale file_id for cache entry {key[:12]}")
+
+    def get_local_path(self, key: str) -> Optional[str]:
+        """Return the path of a locally cached result, if still on disk."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT local_path FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if not row or not row[0]:
+                return None
+            if not os.path.exists(row[0]):
+                self._conn.execute(
+                    "UPDATE entries SET local_path = NULL, size = 0 WHERE key = ?", (key,)
+                )
+                self._conn.commit()
+                return None
+            self._touch(key)
+            return row[0]
+
+    def put_local_file(self, key: str, file_path: str) -> Optional[str]:
+        """
+        Store a copy of an encoded result in the local tier.
+
+        The file is hard-linked when possible so the caller can still delete
+        its own temporary path.
+
+        Args:
+            key: Cache key
+            file_path: Path to the encoded video
+
+        Returns:
+            Path of the cached copy, or None if it could not be stored
+        """
+        try:
+            size = os.path.getsize(file_path)
+            if size > self.max_bytes:
+                return None
+
+            cached_path = os.path.join(self.cache_dir, f"{key}.mp4")
+            if not os.path.exists(cached_path):
+                try:
+                    os.link(file_path, cached_path)
+                except OSError:
+                    shutil.copyfile(file_path, cached_path)
+
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO entries (key, local_path, size, last_used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET local_path = excluded.local_path,"
+                    " size = excluded.size, last_used = excluded.last_used",
+                    (key, cached_path, size, time.time())
+                )
+                self._conn.commit()
+                self._evict()
+            return cached_path
+        except Exception as e:
+            logger.error(f"Error caching result {key[:12]}: {e}")
+            return None
+
+    def _touch(self, key: str):
+        """Mark an entry as recently used. Caller holds the lock."""
+        self._conn.execute(
+            "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used local files over the size budget. Caller holds the lock."""
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries WHERE local_path IS NOT NULL"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, local_path, size FROM entries "
+            "WHERE local_path IS NOT NULL ORDER BY last_used ASC"
+        ).fetchall()
+        for key, local_path, size in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                if os.path.exists(local_path):
+                    os.unlink(local_path)
+            except OSError as e:
+                logger.error(f"Error evicting cached file {local_path}: {e}")
+                continue
+            self._conn.execute(
+                "UPDATE entries SET local_path = NULL, size = 0 WHERE key = ?", (key,)
+            )
+            total -= size
+            logger.info(f"Evicted cached result {key[:12]} ({size} bytes)")
+        self._conn.commit()
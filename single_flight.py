@@ -0,0 +1,185 @@
+"""
+Single-flight coalescing of identical in-flight watermark jobs.
+
+When several chats send the same video at once, only the first request runs
+the download and encode; the others join it and share the result. The shared
+output is cleaned up once the last waiter has finished with it. A waiter
+that cancels stops waiting at once; the job itself is only cancelled when
+every waiter has given up on it.
+"""
+
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Any, Callable, Optional
+
+from cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """State of one in-flight job shared by its waiters."""
+
+    def __init__(self, cleanup: Optional[Callable[[Any], None]]):
+        self.cleanup = cleanup
+        self.waiters = 0
+        self.interested = 0
+        self.pinned = False
+        self.cancel = CancelToken()
+        self.task = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def release(self):
+        """Run the cleanup callback on a successful result."""
+        if self.cleanup is None or self.result is None:
+            return
+        try:
+            self.cleanup(self.result)
+        except Exception as e:
+            logger.error(f"Error cleaning up shared job result: {e}")
+
+
+class SingleFlight:
+    """Coalesces concurrent coroutine jobs with the same key (asyncio)."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def in_flight(self, key: str) -> bool:
+        """True if a job with this key is currently running."""
+        return key in self._flights
+
+    @asynccontextmanager
+    async def join(self, key: str, func: Callable[..., Any], *args,
+                   cleanup: Optional[Callable[[Any], None]] = None):
+        """
+        Run func(*args) once per key and share its result with every caller.
+
+        Each caller gets the result, or the exception, independently. Errors
+        are re-raised in every waiter so each can report its own failure.
+
+        Args:
+            key: Identity of the job (source video plus settings)
+            func: Coroutine function doing the work
+            cleanup: Called with the result once the last waiter exits
+
+        Yields:
+            The result of func
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(cleanup)
+            flight.task = asyncio.ensure_future(func(*args))
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            self._flights[key] = flight
+        else:
+            logger.info(f"Joining in-flight job {key[:12]} ({flight.waiters} waiting)")
+
+        flight.waiters += 1
+        try:
+            # Shield so one waiter giving up does not cancel the others' job
+            flight.result = await asyncio.shield(flight.task)
+            yield flight.result
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0:
+                if flight.task.done():
+                    flight.release()
+                else:
+                    flight.task.cancel()
+
+    def _finish(self, key: str, flight: _Flight):
+        """Stop routing new callers to a completed flight."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+class ThreadSingleFlight:
+    """Coalesces concurrent blocking jobs with the same key (threads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    @contextmanager
+    def join(self, key: str, func: Callable[..., Any], *args,
+             cleanup: Optional[Callable[[Any], None]] = None,
+             cancel: Optional[CancelToken] = None):
+        """
+        Run func(*args) once per key and share its result with every caller.
+
+        The first caller runs func in its own thread; later callers block
+        until it finishes.
+
+        Args:
+            key: Identity of the job (source video plus settings)
+            func: Blocking callable doing the work
+            cleanup: Called with the result once the last waiter exits
+            cancel: This caller's token. If given, func is called with a
+                cancel keyword holding the job's own token, which is
+                cancelled once every caller with a token has cancelled
+
+        Yields:
+            The result of func
+
+        Raises:
+            JobCancelledError: If this caller's token was cancelled
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(cleanup)
+                self._flights[key] = flight
+            else:
+                logger.info(f"Joining in-flight job {key[:12]} ({flight.waiters} waiting)")
+            flight.waiters += 1
+            if cancel is None:
+                # A caller that cannot cancel keeps the job wanted for good
+                flight.pinned = True
+            else:
+                flight.interested += 1
+
+        def withdraw():
+            with self._lock:
+                flight.interested -= 1
+                abandoned = flight.interested == 0 and not flight.pinned
+            if abandoned:
+                flight.cancel.cancel(cancel.reason)
+
+        try:
+            with cancel.on_cancel(withdraw) if cancel else nullcontext():
+                if leader:
+                    try:
+                        if cancel is None:
+                            flight.result = func(*args)
+                        else:
+                            flight.result = func(*args, cancel=flight.cancel)
+                    except Exception as e:
+                        flight.error = e
+                    finally:
+                        with self._lock:
+                            del self._flights[key]
+                        flight.done.set()
+                elif cancel is None:
+                    flight.done.wait()
+                else:
+                    # Stop waiting as soon as this caller cancels
+                    while not flight.done.wait(0.2) and not cancel.cancelled:
+                        pass
+
+            if cancel is not None:
+                cancel.check()
+            if flight.error is not None:
+                raise flight.error
+            yield flight.result
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                last = flight.waiters == 0
+            if last:
+                flight.release()
@@ -0,0 +1,160 @@
+"""
+Output size budgeting for encodes.
+
+A CRF encode has no size bound: a 150MB input can come back larger than
+the Bot API accepts in one upload, and the whole encode is then wasted at
+the sendVideo call. From the probed duration the budget derives the video
+bitrate that fits MAX_UPLOAD_SIZE once audio and container overhead are
+taken off, and caps the encode with the VBV (maxrate/bufsize). CRF stays in
+charge below the cap, so videos that fit easily are not padded up to the
+limit. Only when the source clearly needs more than the cap does the
+encode switch to a two-pass average bitrate, which spreads the bits over
+the whole video instead of clipping every complex scene.
+"""
+
+import glob
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    MAX_UPLOAD_SIZE,
+    SIZE_BUDGET_HEADROOM,
+    SIZE_BUDGET_VBV_SECONDS,
+    SIZE_BUDGET_AUDIO_BIT_RATE,
+    SIZE_BUDGET_TWO_PASS_RATIO,
+    SIZE_BUDGET_TWO_PASS_PEAK
+)
+from media_probe import MediaInfo
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SizeBudget:
+    """Bitrate limits that keep an encode under the upload limit."""
+
+    bit_rate: int
+    two_pass: bool = False
+
+    @property
+    def maxrate(self) -> int:
+        """VBV maximum bitrate in bits per second."""
+        if self.two_pass:
+            return int(self.bit_rate * SIZE_BUDGET_TWO_PASS_PEAK)
+        return self.bit_rate
+
+    @property
+    def bufsize(self) -> int:
+        """VBV buffer size in bits."""
+        return int(self.maxrate * SIZE_BUDGET_VBV_SECONDS)
+
+    def encode_args(self) -> Dict[str, object]:
+        """
+        FFmpeg output options for the video stream.
+
+        Returns:
+            maxrate/bufsize caps on top of CRF, plus the average bitrate
+            ('b:v') for two-pass encodes, which x264 then uses instead of CRF
+        """
+        args = {'maxrate': self.maxrate, 'bufsize': self.bufsize}
+        if self.two_pass:
+            args['b:v'] = self.bit_rate
+        return args
+
+
+def plan_budget(info: MediaInfo, width: int, height: int,
+                limit: int = MAX_UPLOAD_SIZE) -> Optional[SizeBudget]:
+    """
+    Work out the bitrate cap for an encode.
+
+    Args:
+        info: Probe result for the source
+        width: Output width
+        height: Output height
+        limit: Largest output size in bytes
+
+    Returns:
+        The SizeBudget, or None if the duration is unknown
+    """
+    if info.duration <= 0:
+        return None
+
+    audio_rate = 0
+    if info.has_audio:
+        audio_rate = info.audio_bit_rate if info.audio_copyable else 0
+        audio_rate = audio_rate or SIZE_BUDGET_AUDIO_BIT_RATE
+    # The last VBV buffer can overshoot the average, so it is paid for up front
+    usable_bits = limit * 8 * SIZE_BUDGET_HEADROOM - audio_rate * info.duration
+    bit_rate = int(usable_bits / (info.duration + SIZE_BUDGET_VBV_SECONDS))
+    if bit_rate <= 0:
+        raise ValueError(f"{info.duration:.0f}s of audio alone exceeds the {limit} byte limit")
+
+    # The source's bitrate, scaled to the output size, stands in for what
+    # CRF would spend; two passes only pay off when the cap clearly binds
+    source_rate = source_video_rate(info) * width * height / max(1, info.width * info.height)
+    two_pass = source_rate > bit_rate * SIZE_BUDGET_TWO_PASS_RATIO
+    budget = SizeBudget(bit_rate=bit_rate, two_pass=two_pass)
+    logger.info(
+        f"Size budget {limit / 1024 / 1024:.1f}MB for {info.duration:.0f}s: "
+        f"video capped at {bit_rate / 1000:.0f}kbps (source ~{source_rate / 1000:.0f}kbps)"
+        f"{', two-pass' if two_pass else ''}"
+    )
+    return budget
+
+
+def source_video_rate(info: MediaInfo) -> int:
+    """The source's video bitrate in bits per second, 0 if unknown."""
+    if info.video_bit_rate:
+        return info.video_bit_rate
+    if info.bit_rate:
+        return max(0, info.bit_rate - info.audio_bit_rate)
+    if info.size and info.duration > 0:
+        return max(0, int(info.size * 8 / info.duration) - info.audio_bit_rate)
+    return 0
+
+
+def two_pass_commands(cmd: List[str], output_path: str,
+                      passlog: str) -> Tuple[List[str], List[str]]:
+    """
+    Split a single-pass FFmpeg command into the two passes of a two-pass encode.
+
+    The first pass only analyses the main output's video, so it drops the
+    audio and discards its output. It still goes through the output's
+    muxer, whose frame rate handling decides which frames are encoded; the
+    second pass fails if it gets frames the first pass never saw. Outputs
+    after output_path, such as the thumbnail and renditions, are encoded in
+    the second pass only; the first pass sends their filter outputs to the
+    null muxer unencoded, as FFmpeg refuses filter outputs left unmapped.
+
+    Args:
+        cmd: FFmpeg argument list whose first output is output_path
+        output_path: The main output path in cmd
+        passlog: Prefix for the pass log files
+
+    Returns:
+        (first pass, second pass) argument lists
+    """
+    index = cmd.index(output_path)
+    head, tail = cmd[:index], cmd[index + 1:]
+    passes = ['-passlogfile', passlog]
+    container = os.path.splitext(output_path)[1].lstrip('.') or 'mp4'
+    # Global options such as -y may follow the outputs and apply to both passes
+    overwrite = [arg for arg in tail if arg == '-y']
+    sinks = []
+    for option, value in zip(tail, tail[1:]):
+        if option == '-map' and value.startswith('['):
+            sinks += ['-map', value, '-f', 'null', os.devnull]
+    first = head + ['-pass', '1', *passes, '-an', '-f', container, os.devnull] + sinks + overwrite
+    second = head + ['-pass', '2', *passes, output_path] + tail
+    return first, second
+
+
+def remove_pass_logs(passlog: str):
+    """Delete the log files of a two-pass encode."""
+    for path in glob.glob(f"{glob.escape(passlog)}*"):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Failed to remove pass log {path}: {e}")
@@ -0,0 +1,360 @@
+"""
+Spool space management for job files in TEMP_DIR.
+
+Every job reserves space before it downloads anything, sized from the file
+size Telegram reports. Small jobs can be placed on a RAM-backed tier (a
+tmpfs such as /dev/shm) when one is configured. Job files carry the pid of
+the process that created them, so files left behind by a crashed or killed
+process can be swept at startup without touching the files of a bot still
+running on the same directory.
+"""
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from config import (
+    TEMP_DIR,
+    MAX_FILE_SIZE,
+    SPOOL_QUOTA_BYTES,
+    SPOOL_RAM_DIR,
+    SPOOL_RAM_QUOTA_BYTES,
+    SPOOL_RAM_MAX_FILE_BYTES,
+    SPOOL_RESERVE_FACTOR,
+    SPOOL_MIN_FREE_BYTES
+)
+from metrics import SPOOL_RESERVED_BYTES
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PREFIXES = ('input_', 'output_', 'watermarked_', 'segments_')
+OWNER_PATTERN = re.compile(r'^(?:%s)(\d+)_' % '|'.join(SPOOL_PREFIXES))
+
+
+class SpoolFullError(Exception):
+    """Raised when there is no room to reserve spool space for a job."""
+
+
+@dataclass
+class SpoolUsage:
+    """Reserved and available spool space per tier."""
+
+    disk_reserved: int
+    disk_quota: int
+    disk_free: int
+    ram_reserved: int
+    ram_quota: int
+    jobs: int
+
+    @property
+    def disk_available(self) -> int:
+        """Bytes a new disk reservation may still use."""
+        return max(0, min(self.disk_quota - self.disk_reserved,
+                          self.disk_free - SPOOL_MIN_FREE_BYTES))
+
+
+class SpoolReservation:
+    """Space held for one job, released once all of its files are removed."""
+
+    def __init__(self, manager: 'SpoolManager', directory: str, tier: str, size: int):
+        self.manager = manager
+        self.directory = directory
+        self.tier = tier
+        self.size = size
+        self.paths: List[str] = []
+        self.released = False
+
+    def mkstemp(self, prefix: str, suffix: str = '.mp4') -> str:
+        """
+        Create an empty job file in this reservation's tier.
+
+        Args:
+            prefix: One of SPOOL_PREFIXES, e.g. 'input_'
+
+        Returns:
+            Path of the new file
+        """
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory,
+                                    prefix=f"{prefix}{os.getpid()}_")
+        os.close(fd)
+        self.manager._adopt(self, path)
+        return path
+
+    def mkdtemp(self, prefix: str) -> str:
+        """Create a job work directory in this reservation's tier."""
+        path = tempfile.mkdtemp(dir=self.directory, prefix=f"{prefix}{os.getpid()}_")
+        self.manager._adopt(self, path)
+        return path
+
+    def adopt(self, path: str) -> str:
+        """
+        Account an existing job file to this reservation, e.g. a file kept
+        from before a restart for a resumed job.
+
+        Returns:
+            The path
+        """
+        self.manager._adopt(self, path)
+        return path
+
+    def release(self):
+        """Delete any remaining files and give the space back."""
+        for path in list(self.paths):
+            self.manager.remove(path)
+        self.manager._release(self)
+
+
+class SpoolManager:
+    """Reserves spool space per job and reclaims files of dead processes."""
+
+    def __init__(self, root: str = TEMP_DIR, quota: int = SPOOL_QUOTA_BYTES,
+                 ram_dir: str = SPOOL_RAM_DIR, ram_quota: int = SPOOL_RAM_QUOTA_BYTES,
+                 ram_max_file: int = SPOOL_RAM_MAX_FILE_BYTES):
+        """
+        Args:
+            root: Disk spool directory
+            quota: Bytes all disk reservations together may hold
+            ram_dir: RAM-backed spool directory, or empty to disable the tier
+            ram_quota: Bytes all RAM reservations together may hold
+            ram_max_file: Largest input placed on the RAM tier
+        """
+        self.root = root
+        self.quota = quota
+        self.ram_dir = ram_dir
+        self.ram_quota = ram_quota
+        self.ram_max_file = ram_max_file
+        self._lock = threading.Lock()
+        self._reserved = {'disk': 0, 'ram': 0}
+        self._owners: Dict[str, SpoolReservation] = {}
+        self._jobs = 0
+
+        os.makedirs(self.root, exist_ok=True)
+        if self.ram_dir:
+            try:
+                os.makedirs(self.ram_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"RAM spool {self.ram_dir} unavailable, using disk only: {e}")
+                self.ram_dir = ''
+
+    def reserve(self, file_size: int = 0) -> SpoolReservation:
+        """
+        Reserve space for a job before downloading its input.
+
+        Args:
+            file_size: Input size reported by Telegram; 0 if unknown, in
+                which case the maximum accepted file size is assumed
+
+        Returns:
+            A reservation to create the job's files with
+
+        Raises:
+            SpoolFullError: If neither tier has room for the job
+        """
+        input_size = file_size or MAX_FILE_SIZE
+        size = int(input_size * SPOOL_RESERVE_FACTOR)
+
+        with self._lock:
+            tier = self._choose_tier(input_size, size)
+            if tier is None:
+                raise SpoolFullError(
+                    f"No spool space for {size} bytes "
+                    f"({self._reserved['disk']} of {self.quota} reserved)"
+                )
+            directory = self.ram_dir if tier == 'ram' else self.root
+            reservation = SpoolReservation(self, directory, tier, size)
+            self._reserved[tier] += size
+            self._jobs += 1
+            self._publish()
+
+        logger.info(f"Reserved {size // 1024 // 1024}MB of {reservation.tier} spool")
+        return reservation
+
+    def has_room(self, file_size: int = 0) -> bool:
+        """True if a job with an input of file_size would currently fit."""
+        input_size = file_size or MAX_FILE_SIZE
+        with self._lock:
+            return self._choose_tier(input_size, int(input_size * SPOOL_RESERVE_FACTOR)) is not None
+
+    def reservation_for(self, path: str) -> Optional[SpoolReservation]:
+        """The reservation a job file belongs to, if any."""
+        with self._lock:
+            return self._owners.get(path)
+
+    def mkstemp(self, prefix: str, suffix: str = '.mp4', near: Optional[str] = None) -> str:
+        """
+        Create a job file next to another file of the same job.
+
+        Args:
+            prefix: One of SPOOL_PREFIXES
+            suffix: File name suffix
+            near: A file of the job, e.g. its input; files not created through
+                a reservation get an unaccounted file in the disk spool
+
+        Returns:
+            Path of the new file
+        """
+        reservation = self.reservation_for(near) if near else None
+        if reservation:
+            return reservation.mkstemp(prefix, suffix)
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.root,
+                                    prefix=f"{prefix}{os.getpid()}_")
+        os.close(fd)
+        return path
+
+    def mkdtemp(self, prefix: str, near: Optional[str] = None) -> str:
+        """Create a job work directory next to another file of the same job."""
+        reservation = self.reservation_for(near) if near else None
+        if reservation:
+            return reservation.mkdtemp(prefix)
+        return tempfile.mkdtemp(dir=self.root, prefix=f"{prefix}{os.getpid()}_")
+
+    def remove(self, path: str):
+        """
+        Delete a job file or directory; the job's reservation is released
+        with its last file.
+
+        Args:
+            path: Path to delete
+        """
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.unlink(path)
+                logger.info(f"Cleaned up temporary file: {path}")
+        except Exception as e:
+            logger.error(f"Error cleaning up file {path}: {e}")
+
+        with self._lock:
+            reservation = self._owners.pop(path, None)
+            if reservation is None:
+                return
+            reservation.paths.remove(path)
+            empty = not reservation.paths
+        if empty:
+            self._release(reservation)
+
+    def sweep(self, keep: Iterable[str] = ()) -> int:
+        """
+        Delete job files left behind by processes that are no longer running.
+
+        Meant to run at startup, before any job is started. Files of this
+        process that no reservation owns are leftovers too, as happens after
+        a restart that reused the pid.
+
+        Args:
+            keep: Files to leave in place, such as those of journaled jobs
+                that will be resumed
+
+        Returns:
+            Bytes reclaimed
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        reclaimed = 0
+        for directory in filter(None, (self.root, self.ram_dir)):
+            try:
+                names = os.listdir(directory)
+            except OSError as e:
+                logger.warning(f"Could not list spool {directory}: {e}")
+                continue
+            for name in names:
+                if not name.startswith(SPOOL_PREFIXES):
+                    continue
+                path = os.path.join(directory, name)
+                if (self.reservation_for(path) or os.path.abspath(path) in keep
+                        or not self._orphaned(name)):
+                    continue
+                size = _disk_size(path)
+                self.remove(path)
+                reclaimed += size
+        if reclaimed:
+            logger.info(f"Swept {reclaimed // 1024 // 1024}MB of orphaned spool files")
+        return reclaimed
+
+    def usage(self) -> SpoolUsage:
+        """Current reservations and free space."""
+        with self._lock:
+            return self._usage()
+
+    def _usage(self) -> SpoolUsage:
+        try:
+            disk_free = shutil.disk_usage(self.root).free
+        except OSError:
+            disk_free = 0
+        return SpoolUsage(
+            disk_reserved=self._reserved['disk'],
+            disk_quota=self.quota,
+            disk_free=disk_free,
+            ram_reserved=self._reserved['ram'],
+            ram_quota=self.ram_quota if self.ram_dir else 0,
+            jobs=self._jobs
+        )
+
+    def _choose_tier(self, input_size: int, size: int) -> Optional[str]:
+        """Tier a job of this size would go to, or None if it fits nowhere."""
+        if (self.ram_dir and input_size <= self.ram_max_file
+                and self._reserved['ram'] + size <= self.ram_quota):
+            return 'ram'
+        if size <= self._usage().disk_available:
+            return 'disk'
+        return None
+
+    def _orphaned(self, name: str) -> bool:
+        """Whether the process that created a job file is gone."""
+        match = OWNER_PATTERN.match(name)
+        if not match:
+            # Created before files were tagged with their owner
+            return True
+        pid = int(match.group(1))
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    def _adopt(self, reservation: SpoolReservation, path: str):
+        with self._lock:
+            reservation.paths.append(path)
+            self._owners[path] = reservation
+
+    def _release(self, reservation: SpoolReservation):
+        with self._lock:
+            if reservation.released:
+                return
+            reservation.released = True
+            for path in reservation.paths:
+                self._owners.pop(path, None)
+            self._reserved[reservation.tier] -= reservation.size
+            self._jobs -= 1
+            self._publish()
+
+    def _publish(self):
+        """Export reservations as metrics; called with the lock held."""
+        for tier, reserved in self._reserved.items():
+            SPOOL_RESERVED_BYTES.set(reserved, tier=tier)
+
+
+def _disk_size(path: str) -> int:
+    """Size of a file, or of everything under a directory."""
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
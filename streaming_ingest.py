@@ -0,0 +1,341 @@
+"""
+Streaming ingest: start encoding while the video is still downloading.
+
+The download is spooled to disk at network speed while a feeder thread pipes
+the spooled bytes into FFmpeg's stdin as they arrive, so download and encode
+overlap. Containers that cannot be decoded from a pipe, such as MP4 files
+with the ``moov`` atom after the media data, are downloaded in full and
+encoded from disk as before.
+"""
+
+import logging
+import socket
+import struct
+import subprocess
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from cancellation import CancelToken, JobCancelledError
+from config import STREAM_CHUNK_SIZE, STREAM_HEAD_LIMIT
+from ffmpeg_progress import EncodeProgress, ProgressParser
+from media_probe import MediaInfo, probe
+from metrics import TRANSFER_BYTES, record_encode, record_stage, track_stage
+
+logger = logging.getLogger(__name__)
+
+MATROSKA_MAGIC = b'\x1a\x45\xdf\xa3'
+MPEGTS_SYNC = 0x47
+MPEGTS_PACKET = 188
+
+
+def sniff_streamable(head: bytes) -> Optional[bool]:
+    """
+    Decide from the first bytes of a file whether FFmpeg can read it from a pipe.
+
+    Args:
+        head: Bytes from the start of the file
+
+    Returns:
+        True if the container can be streamed, False if it must be spooled to
+        disk first, or None if more bytes are needed to decide
+    """
+    if len(head) < 12:
+        return None
+
+    if head.startswith(MATROSKA_MAGIC):
+        return True
+
+    if head[0] == MPEGTS_SYNC and len(head) > MPEGTS_PACKET and head[MPEGTS_PACKET] == MPEGTS_SYNC:
+        return True
+
+    if head[4:8] == b'ftyp':
+        return _mp4_moov_first(head)
+
+    return False
+
+
+def _mp4_moov_first(head: bytes) -> Optional[bool]:
+    """
+    Walk top-level MP4 boxes to see whether moov comes before mdat.
+
+    Only reports True once the whole moov box is in head, so the partial
+    spool can be probed.
+    """
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack('>I4s', head[offset:offset + 8])
+        if box_type == b'mdat':
+            return False
+        if size == 0:
+            # Box runs to the end of the file, nothing can follow it
+            return None if box_type == b'moov' else False
+        if size == 1:
+            if offset + 16 > len(head):
+                return None
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+
+        if box_type == b'moov':
+            return True if offset + size <= len(head) else None
+        if size < 8:
+            return False
+        offset += size
+    return None
+
+
+class IngestDownloadError(Exception):
+    """Raised when the source video could not be downloaded."""
+
+
+@dataclass
+class IngestResult:
+    """Outcome and timings of one ingest."""
+
+    success: bool = False
+    streamed: bool = False
+    bytes_downloaded: int = 0
+    download_seconds: float = 0.0
+    first_frame_seconds: Optional[float] = None
+    total_seconds: float = 0.0
+    encode_seconds: float = 0.0
+    frames: int = 0
+
+
+class _SpoolFeeder(threading.Thread):
+    """Pipes a growing spool file into a process's stdin."""
+
+    def __init__(self, spool_path: str, stdin):
+        super().__init__(daemon=True, name='spool-feeder')
+        self.spool_path = spool_path
+        self.stdin = stdin
+        self._cond = threading.Condition()
+        self._written = 0
+        self._finished = False
+
+    def advance(self, written: int, finished: bool = False):
+        """Tell the feeder how many bytes are on disk."""
+        with self._cond:
+            self._written = written
+            self._finished = finished
+            self._cond.notify()
+
+    def run(self):
+        position = 0
+        try:
+            with open(self.spool_path, 'rb') as spool:
+                while True:
+                    with self._cond:
+                        while position >= self._written and not self._finished:
+                            self._cond.wait()
+                        available = self._written - position
+                        if available <= 0 and self._finished:
+                            break
+                    spool.seek(position)
+                    data = spool.read(min(available, STREAM_CHUNK_SIZE))
+                    self.stdin.write(data)
+                    position += len(data)
+        except (BrokenPipeError, ValueError, OSError) as e:
+            logger.warning(f"Stopped feeding encoder: {e}")
+        finally:
+            try:
+                self.stdin.close()
+            except OSError:
+                pass
+
+
+class StreamingIngest:
+    """Downloads a video and encodes it, overlapping the two when possible."""
+
+    def run(self, url: str, input_path: str, output_path: str,
+            build_command: Callable[[str, MediaInfo], Optional[List[str]]],
+            fallback: Callable[[str, str], bool],
+            timeout: int = 300,
+            on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+            cancel: Optional[CancelToken] = None) -> IngestResult:
+        """
+        Download url into input_path and watermark it into output_path.
+
+        Args:
+            url: Download URL of the source video
+            input_path: Spool path for the downloaded bytes
+            output_path: Path for the watermarked video
+            build_command: Returns the FFmpeg command for (source, probe result
+                of the downloaded head), or None to encode from disk after the
+                download
+            fallback: Encodes a fully downloaded input_path into output_path
+            timeout: Network timeout in seconds
+            on_progress: Called with the streamed encode's progress; the
+                streamed encode is not stall-checked since it may be waiting
+                on the network
+            cancel: Token that aborts the download and kills the encoder
+
+        Returns:
+            IngestResult describing what happened
+
+        Raises:
+            IngestDownloadError: If the download failed
+            JobCancelledError: If the job was cancelled
+        """
+        cancel = cancel or CancelToken()
+        cancel.check()
+        result = IngestResult()
+        start = time.monotonic()
+        process = None
+        encode_start = None
+        feeder = None
+        watcher = None
+        stderr_tail = []
+        response = None
+
+        def stop():
+            # Unblock a pending read and end the streamed encode right away
+            sock = getattr(getattr(getattr(response, 'fp', None), 'raw', None), '_sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            if process is not None:
+                process.kill()
+
+        try:
+            with cancel.on_cancel(stop), \
+                    urllib.request.urlopen(url, timeout=timeout) as response, \
+                    open(input_path, 'wb') as spool:
+                # Read enough of the file to tell whether it can be piped
+                head = b''
+                streamable = None
+                while streamable is None:
+                    chunk = response.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    spool.write(chunk)
+                    head += chunk
+                    streamable = sniff_streamable(head)
+                    if streamable is None and len(head) >= STREAM_HEAD_LIMIT:
+                        streamable = False
+                spool.flush()
+                result.bytes_downloaded = len(head)
+
+                cmd = None
+                if streamable:
+                    info = self._probe_partial(input_path)
+                    if info:
+                        cmd = build_command('pipe:0', info)
+
+                # Start the encoder now and feed it while the rest downloads
+                if cmd:
+                    result.streamed = True
+                    cmd = cmd[:1] + ['-nostats', '-progress', 'pipe:2'] + cmd[1:]
+                    encode_start = time.monotonic()
+                    process = subprocess.Popen(
+                        cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE
+                    )
+                    feeder = _SpoolFeeder(input_path, process.stdin)
+                    feeder.advance(result.bytes_downloaded)
+                    feeder.start()
+                    watcher = threading.Thread(
+                        target=self._watch_progress,
+                        args=(process.stderr, start, result, stderr_tail,
+                              ProgressParser(info.duration), on_progress),
+                        daemon=True
+                    )
+                    watcher.start()
+                else:
+                    logger.info("Input is not streamable, spooling to disk before encoding")
+
+                try:
+                    while True:
+                        cancel.check()
+                        chunk = response.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        spool.write(chunk)
+                        result.bytes_downloaded += len(chunk)
+                        if feeder:
+                            spool.flush()
+                            feeder.advance(result.bytes_downloaded)
+                finally:
+                    if feeder:
+                        feeder.advance(result.bytes_downloaded, finished=True)
+                # A read cut short by cancelling looks like the end of the file
+                cancel.check()
+
+        except (OSError, JobCancelledError) as e:
+            if process is not None:
+                process.kill()
+                process.wait()
+            record_stage('download', time.monotonic() - start, success=False)
+            cancel.check()
+            raise IngestDownloadError(str(e)) from e
+
+        result.download_seconds = time.monotonic() - start
+        record_stage('download', result.download_seconds)
+        TRANSFER_BYTES.observe(result.bytes_downloaded, direction='download')
+
+        if process is not None:
+            with cancel.on_cancel(process.kill):
+                feeder.join()
+                returncode = process.wait()
+            watcher.join(timeout=5)
+            cancel.check()
+            result.encode_seconds = time.monotonic() - encode_start
+            record_stage('stream_encode', result.encode_seconds, returncode == 0)
+            if returncode == 0:
+                result.success = True
+                record_encode(result.encode_seconds, result.frames)
+            else:
+                logger.warning(
+                    f"Streaming encode failed ({returncode}), retrying from disk: "
+                    f"{' '.join(stderr_tail[-3:])}"
+                )
+                result.streamed = False
+
+        if not result.success:
+            result.success = fallback(input_path, output_path)
+
+        result.total_seconds = time.monotonic() - start
+        first_frame = (
+            f"{result.first_frame_seconds:.1f}s"
+            if result.first_frame_seconds is not None else "n/a"
+        )
+        logger.info(
+            f"Ingest finished: streamed={result.streamed}, {result.bytes_downloaded} bytes, "
+            f"download {result.download_seconds:.1f}s, first frame {first_frame}, "
+            f"total {result.total_seconds:.1f}s"
+        )
+        return result
+
+    def _probe_partial(self, path: str) -> Optional[MediaInfo]:
+        """Probe the streams of a partially downloaded file."""
+        try:
+            with track_stage('probe'):
+                return probe(path)
+        except Exception as e:
+            logger.warning(f"Could not probe partial download: {e}")
+            return None
+
+    def _watch_progress(self, stderr, start: float, result: IngestResult, tail: list,
+                        parser: ProgressParser,
+                        on_progress: Optional[Callable[[EncodeProgress], None]]):
+        """Record when the encoder reports its first frame and forward progress."""
+        for raw_line in stderr:
+            line = raw_line.decode(errors='replace').strip()
+            if line and '=' not in line:
+                tail.append(line)
+                del tail[:-20]
+                continue
+            progress = parser.feed(line)
+            if progress is None:
+                continue
+            result.frames = progress.frame
+            if result.first_frame_seconds is None and result.frames > 0:
+                result.first_frame_seconds = time.monotonic() - start
+            if on_progress:
+                try:
+                    on_progress(progress)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {e}")
@@ -4,10 +4,38 @@ Simple Telegram watermark bot implementation.
 """
 import os
 import logging
-import tempfile
-import subprocess
+import threading
+import time
+from contextlib import ExitStack
 from pathlib import Path
-from keep_alive import start_server_thread
+from keep_alive import run_server, start_server_thread
+from result_cache import ResultCache
+from single_flight import ThreadSingleFlight
+from watermark_renderer import WatermarkRenderer
+from streaming_ingest import StreamingIngest, IngestDownloadError
+from multipart_upload import MultipartEncoder
+from bot_api import BotApiClient, BotApiError
+from update_poller import UpdatePoller
+from media_probe import MediaInfo, probe
+from spool_manager import SpoolManager, SpoolFullError
+from ffmpeg_progress import EncodeError, ProgressReporter, run_passes, run_with_progress
+from metrics import JOBS, TRANSFER_BYTES, record_encode, record_stage, track_stage
+from throughput_model import ThroughputModel, format_eta
+from job_executor import estimate_job_cost
+from local_files import link_local_file, local_file_path
+from ranged_download import RangedDownloader, RangedDownloadError
+from job_store import JobStore, DOWNLOADED, ENCODED
+from cpu_governor import CpuGovernor, thread_args
+from encoder_profiles import profile_settings, record_profile, select_profile
+from size_budget import SizeBudget, plan_budget, remove_pass_logs, two_pass_commands
+from output_metadata import (FASTSTART_ARGS, THUMBNAIL_ARGS, OutputMetadata, companion_paths,
+                             thumbnail_filter, thumbnail_path)
+from renditions import existing_renditions, remove_renditions, rendition_path, renditions_for
+from cancellation import (CancelRegistry, CancelToken, JobCancelledError, CANCEL_CHAT_GONE,
+                          CANCEL_DEADLINE, encode_deadline)
+from config import (STREAMING_INGEST, AUDIO_COPY_CODECS, LOCAL_BOT_API, CLOUD_DOWNLOAD_LIMIT,
+                    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, JOB_MAX_RESUMES,
+                    MAX_UPLOAD_SIZE, UPDATE_WORKERS)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -20,25 +48,36 @@ SITE_TEXT = "Supplywalah.blogspot.com"
 MAX_FILE_SIZE = 150 * 1024 * 1024  # 150MB user upload limit
 TEMP_DIR = "/tmp/telegram_bot"
 
+# Settings that change the encoded output, used to key cached results
+ENCODER_SETTINGS = {'renderer': 'overlay', 'vcodec': 'libx264', 'profiles': profile_settings(),
+                    'size_limit': MAX_UPLOAD_SIZE, 'acodec': 'aac',
+                    'audio_copy': list(AUDIO_COPY_CODECS)}
+
 # Create temp directory
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-def get_video_dimensions(video_path):
-    """Get video dimensions using ffprobe."""
+api = BotApiClient(BOT_TOKEN)
+result_cache = ResultCache()
+job_flights = ThreadSingleFlight()
+watermark_renderer = WatermarkRenderer()
+streaming_ingest = StreamingIngest()
+throughput_model = ThroughputModel()
+spool = SpoolManager(TEMP_DIR)
+downloader = RangedDownloader()
+job_store = JobStore()
+cancel_registry = CancelRegistry()
+# Every update worker may be encoding
+cpu_governor = CpuGovernor(slots=UPDATE_WORKERS)
+output_metadata = OutputMetadata()
+
+def get_media_info(video_path):
+    """Probe the video once with ffprobe."""
     try:
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', video_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        import json
-        data = json.loads(result.stdout)
-        
-        for stream in data['streams']:
-            if stream['codec_type'] == 'video':
-                return int(stream['width']), int(stream['height'])
-        return 1920, 1080  # fallback
-    except:
-        return 1920, 1080  # fallback
+        with track_stage('probe'):
+            return probe(video_path)
+    except Exception as e:
+        logger.warning(f"Could not probe video, using defaults: {e}")
+        return MediaInfo(coded_width=1920, coded_height=1080, has_audio=True)  # fallback
 
 def calculate_font_size(width, height):
     """Calculate font size based on video dimensions."""
@@ -52,52 +91,170 @@ def calculate_font_size(width, height):
     else:
         return 20
 
-def apply_watermarks(input_path, output_path):
-    """Apply watermarks to video using ffmpeg."""
-    try:
-        width, height = get_video_dimensions(input_path)
-        font_size = calculate_font_size(width, height)
-        
-        logger.info(f"Processing {width}x{height} video with font size {font_size}")
-        
-        # FFmpeg command to add watermarks
-        cmd = [
-            'ffmpeg', '-i', input_path, '-y',
-            '-vf', 
-            f"drawtext=text='{WATERMARK_TEXT}':fontsize={font_size}:fontcolor=white:borderw=2:bordercolor=black:x=w-tw-{font_size//2}:y=h-th-{font_size//2},"
-            f"drawtext=text='{SITE_TEXT}':fontsize={font_size}:fontcolor=white:borderw=2:bordercolor=black:x=(w-tw)/2:y={font_size//2}",
-            '-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-c:a', 'copy',
-            output_path
+def choose_profile(info, load=None):
+    """
+    Pick the encoder profile for an encode by size and load, where load defaults to the
+    other running encodes, for an encode that has leased its threads.
+    """
+    if load is None:
+        load = max(0, cpu_governor.active - 1)
+    profile = select_profile(info.duration, info.width, info.height, load)
+    record_profile(profile, info.width, info.height, load)
+    return profile
+
+def ffmpeg_flags(args):
+    """Turn a dictionary of FFmpeg options into command line flags."""
+    return [arg for name, value in args.items() for arg in (f'-{name}', str(value))]
+
+def build_watermark_command(source, output_path, info, threads, profile, budget=None):
+    """
+    Build the ffmpeg command that watermarks source into output_path on the given threads,
+    with the bitrate capped by budget if given. The same run writes the output's thumbnail
+    and the configured renditions, from the same decoded and watermarked frames.
+    """
+    width, height = profile.output_size(info.width, info.height)
+    font_size = calculate_font_size(width, height)
+    
+    logger.info(f"Processing {width}x{height} video with font size {font_size}, "
+                f"audio: {info.audio_codec or 'none'}")
+    
+    # Both texts are pre-rendered into one RGBA overlay
+    overlay_path = watermark_renderer.render(width, height, font_size, WATERMARK_TEXT, SITE_TEXT)
+    
+    # Compatible audio is copied, other audio re-encoded, missing audio skipped
+    if not info.has_audio:
+        audio_args = ['-an']
+    elif info.audio_copyable:
+        audio_args = ['-map', '0:a:0', '-c:a', 'copy']
+    else:
+        audio_args = ['-map', '0:a:0?', '-c:a', 'aac']
+    
+    # Decoder and encoder stay within the threads leased for this encode
+    thread_flags = ffmpeg_flags(thread_args(threads))
+    
+    # The profile may scale and resample the video before the overlay
+    filters = []
+    if (width, height) != (info.width, info.height):
+        filters.append(f'scale={width}:{height}')
+    fps = profile.output_fps(info.frame_rate)
+    if fps:
+        filters.append(f'fps={fps}')
+    video = f"[0:v]{','.join(filters)}[s];[s]" if filters else '[0:v]'
+    encode_flags = ffmpeg_flags({
+        **profile.encode_args(), **(budget.encode_args() if budget else {}), **FASTSTART_ARGS
+    })
+    
+    # The watermarked frames are split between the output, the thumbnail and the renditions
+    renditions = renditions_for(width, height)
+    labels = ['[v]', '[t]'] + [f'[r{index}]' for index in range(len(renditions))]
+    graph = (f"{video}[1:v]overlay=0:0,split={len(labels)}{''.join(labels)};"
+             f"[t]{thumbnail_filter(info.duration)}[th]")
+    rendition_outputs = []
+    frame_rate = fps or info.frame_rate
+    for index, rendition in enumerate(renditions):
+        rendition_width, rendition_height = rendition.profile.output_size(width, height)
+        chain = [f'scale={rendition_width}:{rendition_height}']
+        rendition_fps = rendition.profile.output_fps(frame_rate)
+        if rendition_fps:
+            chain.append(f'fps={rendition_fps}')
+        graph += f";[r{index}]{','.join(chain)}[o{index}]"
+        # Threads in proportion to the rendition's share of the pixels
+        rendition_threads = max(1, round(
+            threads * rendition_width * rendition_height / (width * height)
+        ))
+        rendition_budget = plan_budget(info, rendition_width, rendition_height)
+        rendition_outputs += [
+            '-map', f'[o{index}]', *audio_args, '-c:v', 'libx264',
+            *ffmpeg_flags({
+                **rendition.profile.encode_args(),
+                **(SizeBudget(rendition_budget.bit_rate).encode_args() if rendition_budget else {}),
+                **FASTSTART_ARGS
+            }),
+            *ffmpeg_flags(thread_args(rendition_threads)),
+            rendition_path(output_path, rendition.name)
         ]
+    
+    # FFmpeg command to add watermarks
+    return [
+        'ffmpeg', '-threads', str(threads), '-i', source, '-i', overlay_path, '-y',
+        '-filter_complex', graph,
+        '-map', '[v]', *audio_args,
+        '-c:v', 'libx264', *encode_flags, *thread_flags,
+        output_path,
+        '-map', '[th]', *ffmpeg_flags(THUMBNAIL_ARGS), thumbnail_path(output_path),
+        *rendition_outputs
+    ]
+
+def apply_watermarks(input_path, output_path, on_progress=None, cancel=None, threads=None,
+                     profile=None):
+    """
+    Apply watermarks to video using ffmpeg, reporting progress to on_progress.
+    
+    The encode is killed when cancel is cancelled or when it runs far longer
+    than predicted for the probed duration. It runs on threads threads if
+    the caller already leased them, otherwise on a share leased here, and
+    with profile if the caller already chose one. Outputs too large for one
+    upload are avoided by capping the bitrate, in two passes if needed.
+    """
+    if threads is None:
+        with cpu_governor.lease() as threads:
+            return apply_watermarks(input_path, output_path, on_progress, cancel, threads,
+                                    profile)
+    cancel = cancel or CancelToken()
+    try:
+        info = get_media_info(input_path)
+        profile = profile or choose_profile(info)
+        width, height = profile.output_size(info.width, info.height)
+        budget = plan_budget(info, width, height)
+        passes = 2 if budget and budget.two_pass else 1
+        cmd = build_watermark_command(input_path, output_path, info, threads, profile, budget)
+        deadline = encode_deadline(
+            passes * throughput_model.predict_seconds(info.duration, width, height, profile.preset)
+        )
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            logger.info("Watermarks applied successfully")
-            return True
-        else:
-            logger.error(f"FFmpeg error: {result.stderr}")
+        started = time.monotonic()
+        try:
+            with cancel.deadline(deadline):
+                if passes == 2:
+                    passlog = f"{output_path}.passlog"
+                    try:
+                        run_passes(two_pass_commands(cmd, output_path, passlog), info.duration,
+                                   on_progress, cancel=cancel)
+                    finally:
+                        remove_pass_logs(passlog)
+                else:
+                    run_with_progress(cmd, info.duration, on_progress, cancel=cancel)
+        except EncodeError as e:
+            record_stage('encode', time.monotonic() - started, success=False)
+            logger.error(f"FFmpeg error: {e}\n{e.stderr}")
             return False
+        except JobCancelledError:
+            record_stage('encode', time.monotonic() - started, success=False)
+            raise
+        elapsed = time.monotonic() - started
+        record_stage('encode', elapsed)
+        
+        # The profile may have dropped frames to cap the frame rate
+        frame_rate = profile.output_fps(info.frame_rate) or info.frame_rate
+        record_encode(elapsed, info.duration * frame_rate)
+        remember_outputs(output_path, width, height, info.duration)
+        throughput_model.record(width, height, info.duration, elapsed / passes, profile.preset)
+        logger.info("Watermarks applied successfully")
+        return True
             
+    except JobCancelledError:
+        raise
     except Exception as e:
         logger.error(f"Error applying watermarks: {e}")
         return False
 
 def handle_webhook():
     """Simple webhook handler for basic testing."""
-    import urllib.request
-    import json
-    
-    # Get updates
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates"
-    
     try:
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode())
-            
-        if data['ok'] and data['result']:
-            for update in data['result']:
-                process_update(update)
+        # Get updates
+        updates = api.call('getUpdates')
+        for update in updates or []:
+            process_update(update)
                 
     except Exception as e:
         logger.error(f"Error getting updates: {e}")
@@ -112,233 +269,576 @@ def process_update(update):
         chat_id = message['chat']['id']
         
         if 'text' in message and message['text'].startswith('/start'):
-            send_message(chat_id, "Welcome! Send me a video file (up to 150MB) and I'll add watermarks.\n\nWatermarks added:\n• 'TG @supplywalah' - bottom right\n• 'Supplywalah.blogspot.com' - top center")
+            send_message(chat_id, "Welcome! Send me a video file (up to 150MB) and I'll add watermarks.\n\nWatermarks added:\n• 'TG @supplywalah' - bottom right\n• 'Supplywalah.blogspot.com' - top center\n\nSend /cancel to stop the videos being processed.")
+            return
+            
+        if is_cancel_command(update):
+            count = cancel_registry.cancel(chat_id)
+            if count:
+                send_message(chat_id, f"🛑 Cancelling {count} video(s)...")
+            else:
+                send_message(chat_id, "There is nothing to cancel.")
             return
             
         # Handle video files
-        if 'video' in message:
-            handle_video(message['video'], chat_id)
-        elif 'document' in message and message['document'].get('mime_type', '').startswith('video/'):
-            handle_video(message['document'], chat_id)
+        video_info = message_video(message)
+        if video_info:
+            handle_video(video_info, chat_id, message)
         else:
             send_message(chat_id, "Please send a video file.")
             
     except Exception as e:
         logger.error(f"Error processing update: {e}")
 
-def handle_video(video_info, chat_id):
-    """Handle video processing."""
+def is_cancel_command(update):
+    """True for a /cancel message, which runs ahead of the chat's queued updates."""
+    text = update.get('message', {}).get('text', '')
+    return text.split('@')[0].split(' ')[0] == '/cancel'
+
+def message_video(message):
+    """The video of a message, sent as a video or as a video document."""
+    if 'video' in message:
+        return message['video']
+    if 'document' in message and message['document'].get('mime_type', '').startswith('video/'):
+        return message['document']
+    return None
+
+def handle_video(video_info, chat_id, message=None, job=None):
+    """
+    Handle video processing.
+    
+    New jobs are journaled with their message so they can be resumed after
+    a restart; job is the journaled record when resuming one. The job can be
+    cancelled with /cancel until the upload finishes.
+    """
+    job_id = job.job_id if job else None
+    with cancel_registry.track(chat_id, CancelToken()) as cancel:
+        run_video_job(video_info, chat_id, message, job, job_id, cancel)
+
+def run_video_job(video_info, chat_id, message, job, job_id, cancel):
+    """Run a video job for handle_video; cancel stops it at any stage."""
     try:
         # Check file size
         file_size = video_info.get('file_size', 0)
         if file_size > MAX_FILE_SIZE:
             send_message(chat_id, "❌ Error: File size exceeds 150MB limit.")
+            fail_job(job_id, 'rejected')
+            return
+        if not LOCAL_BOT_API and file_size > CLOUD_DOWNLOAD_LIMIT:
+            # Only a local Bot API server hands out files above 20MB
+            send_message(chat_id, "❌ Error: Telegram only lets bots download videos up to 20MB. Please send a smaller video.")
+            fail_job(job_id, 'rejected')
+            return
+            
+        # Do not start a download the spool has no room for
+        if not spool.has_room(file_size):
+            JOBS.inc(outcome='rejected')
+            send_message(chat_id, "❌ The bot is out of working space right now. Please try again in a few minutes.")
+            fail_job(job_id, 'rejected')
             return
             
         # Log file size for processing
         file_size_mb = file_size // 1024 // 1024 if file_size > 0 else 0
         logger.info(f"Video size: {file_size_mb}MB")
             
-        send_message(chat_id, "🔄 Applying watermark to your video...")
+        # Repeat requests are answered straight from the cache
+        file_id = video_info['file_id']
+        cache_key = ResultCache.make_key(
+            video_info.get('file_unique_id', file_id), WATERMARK_TEXT, SITE_TEXT, ENCODER_SETTINGS
+        )
+        if job is None and message is not None:
+            job_id = JobStore.make_job_id(chat_id, message['message_id'])
+            if not job_store.create(job_id, chat_id, message, cache_key):
+                # A redelivered update; the job already ran or is resumed at startup
+                logger.info(f"Job {job_id} is already journaled, skipping")
+                return
+            
+        if send_cached_video(chat_id, cache_key):
+            JOBS.inc(outcome='cached')
+            finish_job(job_id)
+            return
+            
+        if job:
+            message_id = send_message(chat_id, "♻️ The bot restarted, resuming your video...")
+        else:
+            message_id = send_message(chat_id, f"🔄 Applying watermark to your video... about {format_eta(predict_seconds(video_info))} left.")
         
         # Download and process video
-        file_id = video_info['file_id']
         logger.info(f"Processing file_id: {file_id}, size: {file_size} bytes ({file_size//1024//1024}MB)")
         
-        input_path, output_path = download_and_process_video(file_id)
-        
-        if output_path and os.path.exists(output_path):
-            # Send processed video back through Telegram
-            send_video(chat_id, output_path)
-        else:
-            send_message(chat_id, "❌ Error: Failed to process video.")
-            
-        # Cleanup
-        for path in [input_path, output_path]:
-            if path and os.path.exists(path):
+        # Identical jobs already running are joined instead of started again;
+        # the files are cleaned up once the last waiter is done with them
+        with job_flights.join(cache_key, download_and_process_video, file_id,
+                              progress_callback(chat_id, message_id), file_size, job_id, job,
+                              cleanup=cleanup_paths, cancel=cancel) as (input_path, output_path):
+            if output_path and os.path.exists(output_path):
+                # Another waiter on the same job may already have uploaded it
+                if result_cache.get_file_id(cache_key) and send_cached_video(chat_id, cache_key):
+                    JOBS.inc(outcome='cached')
+                    finish_job(job_id)
+                    return
+                    
+                # Renditions upload alongside the main video, each as soon as it can
+                rendition_uploads = [
+                    threading.Thread(target=send_rendition,
+                                     args=(chat_id, rendition, path, cancel), daemon=True)
+                    for rendition, path in existing_renditions(output_path)
+                ]
+                for upload in rendition_uploads:
+                    upload.start()
+                
+                # Send processed video back through Telegram
                 try:
-                    os.unlink(path)
-                    logger.info(f"Cleaned up {path}")
-                except:
-                    pass
+                    sent_file_id = send_video(chat_id, output_path, cancel)
+                finally:
+                    # The files are cleaned up once this block is left
+                    for upload in rendition_uploads:
+                        upload.join()
+                if sent_file_id:
+                    result_cache.put_file_id(cache_key, sent_file_id)
+                    finish_job(job_id)
+                else:
+                    fail_job(job_id, 'upload failed')
+                JOBS.inc(outcome='completed' if sent_file_id else 'failed')
+                result_cache.put_local_file(cache_key, output_path)
+            else:
+                JOBS.inc(outcome='failed')
+                fail_job(job_id, 'processing failed')
+                send_message(chat_id, "❌ Error: Failed to process video.")
                 
+    except JobCancelledError as e:
+        JOBS.inc(outcome='cancelled')
+        fail_job(job_id, str(e))
+        logger.info(f"Video job cancelled ({e.reason})")
+        if e.reason == CANCEL_DEADLINE:
+            send_message(chat_id, "⏱ Your video took far longer than expected and was stopped. Please try again later.")
+        elif e.reason != CANCEL_CHAT_GONE:
+            send_message(chat_id, "🛑 Cancelled.")
+    except SpoolFullError as e:
+        JOBS.inc(outcome='rejected')
+        fail_job(job_id, 'spool full')
+        logger.warning(f"Spool full, rejecting video: {e}")
+        send_message(chat_id, "❌ The bot is out of working space right now. Please try again in a few minutes.")
     except Exception as e:
+        JOBS.inc(outcome='failed')
+        fail_job(job_id, str(e))
         logger.error(f"Error handling video: {e}")
         send_message(chat_id, "❌ An error occurred while processing your video.")
 
-def download_and_process_video(file_id):
-    """Download and process video file."""
+def finish_job(job_id):
+    """Journal a job as delivered."""
+    if job_id:
+        job_store.finish(job_id)
+
+def fail_job(job_id, error):
+    """Journal a job as failed so it is not resumed."""
+    if job_id:
+        job_store.fail(job_id, error)
+
+def resume_jobs():
+    """Resume the jobs a previous run left unfinished, each on its own thread."""
+    for job in job_store.claim_unfinished():
+        if job.attempts > JOB_MAX_RESUMES:
+            # The job keeps going down with the bot; do not try it again
+            logger.error(f"Giving up on job {job.job_id} after {job.attempts - 1} restarts")
+            job_store.fail(job.job_id, 'too many restarts')
+            cleanup_paths([job.input_path, job.output_path])
+            send_message(job.chat_id, "❌ Error: Failed to process video. Please try again.")
+            continue
+        video_info = message_video(job.message)
+        if not video_info:
+            job_store.fail(job.job_id, 'no video in message')
+            continue
+        logger.info(f"Resuming job {job.job_id} from stage {job.resume_stage()}")
+        threading.Thread(target=handle_video, args=(video_info, job.chat_id),
+                         kwargs={'message': job.message, 'job': job}, daemon=True).start()
+
+def predict_seconds(video_info):
+    """Predict the encode time of a video from its Telegram metadata."""
+    duration = video_info.get('duration', 0)
+    width = video_info.get('width', 0)
+    height = video_info.get('height', 0)
+    load = cpu_governor.active
+    if duration and width and height:
+        profile = select_profile(duration, width, height, load)
+        width, height = profile.output_size(width, height)
+        return throughput_model.predict_seconds(duration, width, height, profile.preset)
+    file_size = video_info.get('file_size', 0)
+    profile = select_profile(0, 0, 0, load, file_size)
+    return throughput_model.predict_seconds(estimate_job_cost(file_size=file_size),
+                                            preset=profile.preset)
+
+def progress_callback(chat_id, message_id):
+    """Edit the status message with encode progress, at most every few seconds."""
+    if message_id is None:
+        return None
+    reporter = ProgressReporter(lambda text: edit_message(chat_id, message_id, text))
+    
+    def on_progress(progress):
+        if progress.finished or progress.remaining_seconds is None:
+            return
+        reporter.update(
+            f"🔄 Watermarking: {progress.percent}% done ({progress.speed:.1f}x), "
+            f"about {format_eta(progress.remaining_seconds)} left."
+        )
+    
+    return on_progress
+
+def cleanup_paths(paths):
+    """Delete the temporary files of a finished job, releasing its spool space."""
+    for path in paths:
+        if path:
+            for rendition in remove_renditions(path):
+                output_metadata.forget(rendition)
+            output_metadata.forget(path)
+            # A resumed job's reservation also holds the output's thumbnail and renditions
+            for companion in companion_paths(path):
+                spool.remove(companion)
+            spool.remove(path)
+
+def remember_outputs(output_path, width, height, duration):
+    """Record the attributes of a finished output and of its renditions."""
+    output_metadata.remember(output_path, width, height, duration)
+    for rendition, path in existing_renditions(output_path):
+        output_metadata.remember(path, *rendition.profile.output_size(width, height), duration)
+
+def download_and_process_video(file_id, on_progress=None, file_size=0, job_id=None, job=None,
+                               cancel=None):
+    """
+    Download and process video file into space reserved from the spool.
+    
+    Each completed stage is journaled under job_id. A resumed job starts
+    after the last stage whose files are still on disk. A cancelled job
+    removes its files and raises JobCancelledError.
+    """
+    cancel = cancel or CancelToken()
+    # Raises SpoolFullError before anything is downloaded
+    reservation = spool.reserve(file_size)
+    input_path = None
     try:
-        import urllib.request
-        import urllib.error
-        import json
+        stage = job.resume_stage() if job else None
+        if stage == ENCODED:
+            # Only the upload is left
+            logger.info(f"Reusing encoded output of job {job_id}")
+            if os.path.exists(job.input_path):
+                reservation.adopt(job.input_path)
+            for path in companion_paths(job.output_path):
+                if os.path.exists(path):
+                    reservation.adopt(path)
+            return job.input_path or None, reservation.adopt(job.output_path)
+        if stage == DOWNLOADED:
+            logger.info(f"Reusing downloaded input of job {job_id}")
+            input_path = reservation.adopt(job.input_path)
+            return input_path, encode_job(job_id, input_path, on_progress, cancel)
+        
+        # Unique names so concurrent jobs never share a temp file
+        input_path = reservation.mkstemp('input_')
         
         # Get file info
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getFile?file_id={file_id}"
-        logger.info(f"Getting file info from: {url}")
+        logger.info(f"Getting file info for: {file_id}")
         
         try:
-            req = urllib.request.Request(url)
-            with urllib.request.urlopen(req) as response:
-                data = json.loads(response.read().decode())
-                logger.info(f"File info response received successfully")
-        except urllib.error.HTTPError as e:
-            try:
-                error_content = e.read().decode()
-                logger.error(f"HTTP Error {e.code} getting file info: {error_content}")
-            except:
-                logger.error(f"HTTP Error {e.code} getting file info - no error details")
-            return None, None
-            
-        if not data.get('ok'):
-            logger.error(f"Failed to get file info: {data}")
-            return None, None
+            with track_stage('get_file'):
+                file_info = api.call('getFile', {'file_id': file_id})
+            logger.info(f"File info response received successfully")
+        except BotApiError as e:
+            logger.error(f"Failed to get file info: {e}")
+            return input_path, None
             
-        file_path = data['result']['file_path']
-        download_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
-        logger.info(f"Download URL: {download_url}")
+        file_path = file_info['file_path']
+        
+        # A local Bot API server shares its files; link instead of downloading
+        local_path = local_file_path(file_path)
+        if local_path:
+            try:
+                link_local_file(local_path, input_path)
+            except OSError as e:
+                logger.error(f"Error linking local file: {e}")
+                return input_path, None
+            journal_stage(job_id, DOWNLOADED, input_path=input_path)
+            return input_path, encode_job(job_id, input_path, on_progress, cancel)
+        
+        download_url = api.file_url(file_path)
+        logger.info(f"Downloading file: {file_path}")
         
         # Download file
-        input_path = os.path.join(TEMP_DIR, f"input_{file_id[:10]}.mp4")
+        if STREAMING_INGEST:
+            output_path = stream_and_process_video(download_url, input_path, on_progress, cancel)
+            if output_path:
+                journal_stage(job_id, ENCODED, input_path=input_path, output_path=output_path)
+            return input_path, output_path
         
+        download_start = time.monotonic()
         try:
-            # Try curl first for large file support
-            curl_cmd = ['curl', '-L', '-o', input_path, download_url]
-            result = subprocess.run(curl_cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode == 0 and os.path.exists(input_path) and os.path.getsize(input_path) > 0:
-                logger.info(f"Successfully downloaded with curl: {os.path.getsize(input_path)} bytes")
-            else:
-                # Fallback to urllib if curl fails
-                logger.info("Curl failed, trying urllib fallback...")
-                req = urllib.request.Request(download_url)
-                with urllib.request.urlopen(req, timeout=300) as response:
-                    with open(input_path, 'wb') as f:
-                        # Download in chunks for large files
-                        chunk_size = 8192
-                        while True:
-                            chunk = response.read(chunk_size)
-                            if not chunk:
-                                break
-                            f.write(chunk)
-                logger.info(f"Downloaded with urllib: {os.path.getsize(input_path)} bytes")
-                
-        except Exception as e:
+            # Parallel Range requests, resumed after dropped connections
+            downloader.download(download_url, input_path, file_size, cancel)
+        except JobCancelledError:
+            record_stage('download', time.monotonic() - download_start, success=False)
+            raise
+        except RangedDownloadError as e:
+            record_stage('download', time.monotonic() - download_start, success=False)
             logger.error(f"Error downloading file: {e}")
-            return None, None
+            return input_path, None
         
+        record_stage('download', time.monotonic() - download_start)
+        TRANSFER_BYTES.observe(os.path.getsize(input_path), direction='download')
         logger.info(f"Downloaded video to {input_path}")
+        journal_stage(job_id, DOWNLOADED, input_path=input_path)
         
         # Process video
-        output_path = os.path.join(TEMP_DIR, f"output_{file_id[:10]}.mp4")
-        success = apply_watermarks(input_path, output_path)
-        
-        if success:
-            return input_path, output_path
-        else:
-            return input_path, None
+        return input_path, encode_job(job_id, input_path, on_progress, cancel)
             
+    except JobCancelledError:
+        if input_path is None:
+            reservation.release()
+        else:
+            cleanup_paths([input_path])
+        raise
     except Exception as e:
         logger.error(f"Error downloading/processing video: {e}")
-        return None, None
+        if input_path is None:
+            reservation.release()
+        return input_path, None
+
+def journal_stage(job_id, stage, **paths):
+    """Journal a completed stage of a job, if it is journaled."""
+    if job_id:
+        job_store.advance(job_id, stage, **paths)
+
+def encode_job(job_id, input_path, on_progress=None, cancel=None):
+    """Watermark a job's input and journal the output; returns its path or None."""
+    output_path = watermark_input(input_path, on_progress, cancel)
+    if output_path:
+        journal_stage(job_id, ENCODED, output_path=output_path)
+    return output_path
+
+def watermark_input(input_path, on_progress=None, cancel=None):
+    """Watermark a job's input into a new spool file; returns its path or None."""
+    output_path = spool.mkstemp('output_', near=input_path)
+    try:
+        if apply_watermarks(input_path, output_path, on_progress, cancel):
+            return output_path
+    except JobCancelledError:
+        cleanup_paths([output_path])
+        raise
+    cleanup_paths([output_path])
+    return None
+
+def stream_and_process_video(download_url, input_path, on_progress=None, cancel=None):
+    """Encode while downloading; moov-at-end files are encoded from disk after the download."""
+    output_path = spool.mkstemp('output_', near=input_path)
+    cancel = cancel or CancelToken()
+    
+    streamed_info = []
+    leases = ExitStack()
+    deadlines = ExitStack()
+    leased = []
+    
+    def build_command(source, info):
+        profile = choose_profile(info, cpu_governor.active)
+        streamed_info.append((info, profile))
+        # A two-pass encode needs the whole file, so it waits for the download
+        budget = plan_budget(info, *profile.output_size(info.width, info.height))
+        if budget and budget.two_pass:
+            return None
+        # CPU is only leased once the encode starts, not for the download
+        leased.append(leases.enter_context(cpu_governor.lease()))
+        # The streamed encode is cancelled if it overruns like one from disk
+        deadlines.enter_context(cancel.deadline(encode_deadline(throughput_model.predict_seconds(
+            info.duration, *profile.output_size(info.width, info.height), profile.preset
+        ))))
+        return build_watermark_command(source, output_path, info, leased[0], profile, budget)
+    
+    def fallback(source, output):
+        # Encoding from disk arms a deadline of its own
+        deadlines.close()
+        return apply_watermarks(source, output, on_progress, cancel, leased[0] if leased else None,
+                                streamed_info[0][1] if streamed_info else None)
+    
+    try:
+        with leases, deadlines:
+            result = streaming_ingest.run(
+                download_url, input_path, output_path, build_command, fallback,
+                on_progress=on_progress,
+                cancel=cancel
+            )
+        if result.success:
+            if result.streamed and streamed_info:
+                info, profile = streamed_info[0]
+                width, height = profile.output_size(info.width, info.height)
+                remember_outputs(output_path, width, height, info.duration)
+                throughput_model.record(width, height, info.duration,
+                                        result.encode_seconds, profile.preset)
+            return output_path
+    except IngestDownloadError as e:
+        logger.error(f"Error downloading file: {e}")
+    except JobCancelledError:
+        cleanup_paths([output_path])
+        raise
+    
+    cleanup_paths([output_path])
+    return None
 
 def send_message(chat_id, text):
-    """Send text message to chat."""
+    """Send text message to chat and return its message_id."""
     try:
-        import urllib.request
-        import urllib.parse
-        
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        data = urllib.parse.urlencode({
-            'chat_id': chat_id,
-            'text': text
-        }).encode()
-        
-        req = urllib.request.Request(url, data=data, method='POST')
-        urllib.request.urlopen(req)
+        message = api.call('sendMessage', {'chat_id': chat_id, 'text': text})
+        return message.get('message_id') if isinstance(message, dict) else None
         
     except Exception as e:
         logger.error(f"Error sending message: {e}")
+        cancel_if_chat_gone(chat_id, e)
+        return None
 
-def send_video(chat_id, video_path):
-    """Send video file back to chat."""
+def edit_message(chat_id, message_id, text):
+    """Replace the text of a message sent earlier."""
     try:
-        import urllib.request
+        api.call('editMessageText', {'chat_id': chat_id, 'message_id': message_id, 'text': text})
         
-        send_message(chat_id, "⬆️ Uploading watermarked video...")
-        
-        # Prepare video upload
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendVideo"
-        
-        # Read video file
-        with open(video_path, 'rb') as video_file:
-            video_data = video_file.read()
-        
-        # Create multipart form data
-        import uuid
-        boundary = str(uuid.uuid4())
-        
-        body = b''
-        body += f'--{boundary}\r\n'.encode()
-        body += b'Content-Disposition: form-data; name="chat_id"\r\n\r\n'
-        body += f'{chat_id}\r\n'.encode()
-        
-        body += f'--{boundary}\r\n'.encode()
-        body += b'Content-Disposition: form-data; name="video"; filename="watermarked_video.mp4"\r\n'
-        body += b'Content-Type: video/mp4\r\n\r\n'
-        body += video_data
-        body += b'\r\n'
-        
-        body += f'--{boundary}--\r\n'.encode()
+    except Exception as e:
+        logger.warning(f"Error editing message: {e}")
+        cancel_if_chat_gone(chat_id, e)
+
+def cancel_if_chat_gone(chat_id, error):
+    """Cancel a chat's jobs once Telegram refuses to deliver to it (bot blocked or removed)."""
+    if isinstance(error, BotApiError) and error.error_code == 403:
+        if cancel_registry.cancel(chat_id, CANCEL_CHAT_GONE):
+            logger.info(f"Chat {chat_id} is gone, cancelled its jobs")
+
+def send_cached_video(chat_id, cache_key):
+    """Send a previously watermarked video from the result cache."""
+    try:
+        file_id = result_cache.get_file_id(cache_key)
+        if file_id:
+            if send_video_by_file_id(chat_id, file_id):
+                logger.info("Sent cached file_id")
+                return True
+            result_cache.forget_file_id(cache_key)
+            
+        local_path = result_cache.get_local_path(cache_key)
+        if local_path:
+            sent_file_id = send_video(chat_id, local_path)
+            if sent_file_id:
+                result_cache.put_file_id(cache_key, sent_file_id)
+                logger.info("Sent locally cached video")
+                return True
+                
+    except Exception as e:
+        logger.error(f"Error sending cached video: {e}")
+    return False
+
+def send_video_by_file_id(chat_id, file_id):
+    """Send an already uploaded video by its Telegram file_id."""
+    try:
+        api.call('sendVideo', {
+            'chat_id': chat_id,
+            'video': file_id,
+            'supports_streaming': 'true'
+        })
+        send_message(chat_id, "✅ Video processed and sent successfully!")
+        return True
         
-        # Send request
-        req = urllib.request.Request(url, data=body, method='POST')
-        req.add_header('Content-Type', f'multipart/form-data; boundary={boundary}')
+    except Exception as e:
+        logger.warning(f"Error sending video by file_id: {e}")
+        return False
+
+def upload_video(chat_id, video_path, cancel=None, caption=None):
+    """Upload a video with sendVideo, with its dimensions, duration and thumbnail."""
+    fields = {'chat_id': chat_id, 'supports_streaming': 'true',
+              **output_metadata.attributes(video_path)}
+    if caption:
+        fields['caption'] = caption
+    files = [('video', video_path, 'watermarked_video.mp4', 'video/mp4')]
+    thumbnail = output_metadata.thumbnail(video_path)
+    if thumbnail:
+        files.append(('thumbnail', thumbnail, 'thumbnail.jpg', 'image/jpeg'))
+    
+    # Stream the multipart body from disk instead of building it in memory
+    body = MultipartEncoder(fields, files, cancel=cancel)
+    result = api.upload('sendVideo', body)
+    TRANSFER_BYTES.observe(os.path.getsize(video_path), direction='upload')
+    return result
+
+def send_rendition(chat_id, rendition, video_path, cancel=None):
+    """Send one extra rendition of a watermarked video; failures only lose that rendition."""
+    try:
+        upload_video(chat_id, video_path, cancel, f"📱 {rendition.name} copy of your watermarked video")
+        logger.info(f"Rendition {rendition.name} sent successfully")
+    except JobCancelledError:
+        pass
+    except Exception as e:
+        logger.error(f"Error sending rendition {rendition.name}: {e}")
+
+def send_video(chat_id, video_path, cancel=None):
+    """
+    Send video file back to chat and return the uploaded file_id; cancel aborts the upload.
+    The video is sent with its dimensions, duration and thumbnail, so Telegram need not
+    work them out.
+    """
+    try:
+        send_message(chat_id, "⬆️ Uploading watermarked video...")
         
-        with urllib.request.urlopen(req, timeout=300) as response:
-            logger.info("Video sent successfully")
-            send_message(chat_id, "✅ Video processed and sent successfully!")
+        with track_stage('upload'):
+            result = upload_video(chat_id, video_path, cancel)
+        logger.info("Video sent successfully")
+        send_message(chat_id, "✅ Video processed and sent successfully!")
             
+        return result.get('video', {}).get('file_id')
+            
+    except JobCancelledError:
+        raise
     except Exception as e:
         logger.error(f"Error sending video: {e}")
+        cancel_if_chat_gone(chat_id, e)
         send_message(chat_id, "❌ Error: Failed to send video. Please try again.")
 
 def run_polling():
-    """Simple polling implementation."""
-    import time
-    import urllib.request
-    import json
-    
-    last_update_id = 0
-    logger.info("Starting bot polling...")
-    
-    while True:
-        try:
-            # Get updates
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates"
-            if last_update_id > 0:
-                url += f"?offset={last_update_id + 1}"
-                
-            with urllib.request.urlopen(url) as response:
-                data = json.loads(response.read().decode())
-                
-            if data['ok'] and data['result']:
-                for update in data['result']:
-                    process_update(update)
-                    last_update_id = max(last_update_id, update['update_id'])
-                    
-            time.sleep(1)  # Poll every second
-            
-        except KeyboardInterrupt:
-            logger.info("Bot stopped by user")
-            break
-        except Exception as e:
-            logger.error(f"Polling error: {e}")
-            time.sleep(5)  # Wait 5 seconds before retrying
+    """Long-polling loop dispatching updates to concurrent workers."""
+    # Continue from the last committed offset instead of only what is new
+    poller = UpdatePoller(api, process_update, offset=job_store.get_offset(),
+                          on_commit=job_store.set_offset, is_urgent=is_cancel_command)
+    try:
+        # getUpdates is refused while a webhook is set
+        api.call('deleteWebhook')
+    except BotApiError as e:
+        logger.error(f"Error deleting webhook: {e}")
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user")
+    finally:
+        poller.stop(wait=False)
+
+def run_webhook():
+    """Receive updates on the keep-alive server and dispatch them to concurrent workers."""
+    dispatcher = UpdatePoller(api, process_update, is_urgent=is_cancel_command)
+    api.call('setWebhook', {
+        'url': WEBHOOK_URL,
+        'secret_token': WEBHOOK_SECRET,
+        'allowed_updates': ['message'],
+        'max_connections': WEBHOOK_MAX_CONNECTIONS
+    })
+    logger.info(f"Webhook set to {WEBHOOK_URL}")
+    try:
+        run_server(webhook_handler=dispatcher.feed)
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user")
+    finally:
+        dispatcher.stop(wait=False)
 
 if __name__ == '__main__':
-    # Start keep-alive web server for UptimeRobot
-    start_server_thread()
+    # Reclaim files left behind by a crashed or killed run, except those
+    # of journaled jobs that are resumed below
+    job_store.prune()
+    spool.sweep(keep=job_store.live_paths())
+    resume_jobs()
     
-    # Start bot polling
-    run_polling()
\ No newline at end of file
+    if WEBHOOK_URL:
+        # Updates arrive on the keep-alive port; no polling
+        run_webhook()
+    else:
+        # Start keep-alive web server for UptimeRobot
+        start_server_thread()
+        
+        # Start bot polling
+        run_polling()
\ No newline at end of file
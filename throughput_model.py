@@ -0,0 +1,152 @@
+"""
+Encode throughput learned from finished jobs.
+
+Speed is kept as seconds of video encoded per wall-clock second, as an
+exponentially weighted average per (preset, resolution bucket), and saved
+to disk so restarts keep what was learned. Predictions drive the ETA shown
+to users and the admission check that turns away work the bot cannot
+finish in reasonable time.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict
+
+from config import (
+    VIDEO_PRESET,
+    THROUGHPUT_MODEL_PATH,
+    THROUGHPUT_EWMA_ALPHA,
+    THROUGHPUT_DEFAULT_SPEED
+)
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_WIDTH, REFERENCE_HEIGHT = 1920, 1080
+RESOLUTION_BUCKETS = (2160, 1440, 1080, 720, 480, 360)
+
+
+def resolution_bucket(width: int, height: int) -> int:
+    """Bucket a frame size by its shorter side, e.g. 1080 for 1920x1080 or 1080x1920."""
+    shorter = min(width, height)
+    for bucket in RESOLUTION_BUCKETS:
+        if shorter >= bucket:
+            return bucket
+    return 0
+
+
+def format_eta(seconds: float) -> str:
+    """Human readable duration for status messages."""
+    seconds = max(0, int(round(seconds)))
+    if seconds < 60:
+        return f"{max(seconds, 5)} sec"
+    minutes = (seconds + 30) // 60
+    if minutes < 60:
+        return f"{minutes} min"
+    return f"{minutes // 60} h {minutes % 60} min"
+
+
+class ThroughputModel:
+    """Per-preset, per-resolution encode speed with persistence."""
+
+    def __init__(self, path: str = THROUGHPUT_MODEL_PATH, alpha: float = THROUGHPUT_EWMA_ALPHA):
+        """
+        Args:
+            path: JSON file the model is loaded from and saved to
+            alpha: Weight of each new observation in the moving average
+        """
+        self.path = path
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = self._load()
+
+    def record(self, width: int, height: int, duration: float, seconds: float,
+               preset: str = VIDEO_PRESET):
+        """
+        Learn from a finished encode.
+
+        Args:
+            width: Encoded frame width
+            height: Encoded frame height
+            duration: Seconds of video encoded
+            seconds: Wall-clock seconds the encode took
+            preset: Encoder preset used
+        """
+        if duration <= 0 or seconds <= 0 or width <= 0 or height <= 0:
+            return
+        speed = duration / seconds
+        key = self._key(preset, width, height)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'speed': speed, 'pixels': width * height, 'count': 0}
+            else:
+                entry['speed'] += self.alpha * (speed - entry['speed'])
+                entry['pixels'] += self.alpha * (width * height - entry['pixels'])
+            entry['count'] += 1
+            self._entries[key] = entry
+            self._save()
+
+        logger.info(f"Throughput {key}: {speed:.2f}x realtime (average {entry['speed']:.2f}x)")
+
+    def speed(self, width: int, height: int, preset: str = VIDEO_PRESET) -> float:
+        """
+        Expected seconds of video encoded per second for a frame size.
+
+        Unseen buckets are extrapolated by pixel count from the best known
+        bucket of the same preset, or from THROUGHPUT_DEFAULT_SPEED at 1080p.
+        """
+        pixels = max(1, width * height)
+        with self._lock:
+            entry = self._entries.get(self._key(preset, width, height))
+            if entry:
+                return entry['speed']
+            known = [e for k, e in self._entries.items() if k.startswith(f"{preset}/")]
+
+        if known:
+            best = max(known, key=lambda e: e['count'])
+            return best['speed'] * best['pixels'] / pixels
+        return THROUGHPUT_DEFAULT_SPEED * REFERENCE_WIDTH * REFERENCE_HEIGHT / pixels
+
+    def predict_seconds(self, duration: float, width: int = REFERENCE_WIDTH,
+                        height: int = REFERENCE_HEIGHT, preset: str = VIDEO_PRESET) -> float:
+        """
+        Predict how long encoding a video will take.
+
+        Args:
+            duration: Video duration in seconds (or 1080p-equivalent seconds
+                when the frame size is left at its default)
+            width: Video width
+            height: Video height
+            preset: Encoder preset
+
+        Returns:
+            Predicted wall-clock seconds
+        """
+        return duration / max(self.speed(width, height, preset), 1e-6)
+
+    def _key(self, preset: str, width: int, height: int) -> str:
+        return f"{preset}/{resolution_bucket(width, height)}p"
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable throughput model {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        """Write the model atomically; called with the lock held."""
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving throughput model: {e}")
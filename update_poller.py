@@ -0,0 +1,237 @@
+"""
+Long-polling update loop with a concurrent, per-chat ordered dispatcher.
+
+getUpdates is called with a server-side timeout so idle periods cost one
+request per LONG_POLL_TIMEOUT seconds instead of one per second. Updates are
+handed to a worker pool; updates from the same chat run one after another,
+different chats run in parallel. The committed offset only moves past an
+update once it and every earlier update have finished. Urgent updates such
+as /cancel skip the queue: they run at once on their own thread, without
+waiting behind the chat's running job or for a free slot.
+
+In webhook mode nothing is polled: updates pushed by Telegram are handed to
+feed(), which uses the same per-chat dispatcher.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from bot_api import BotApiClient
+from config import LONG_POLL_TIMEOUT, UPDATE_WORKERS, MAX_PENDING_UPDATES
+
+logger = logging.getLogger(__name__)
+
+RECENT_UPDATE_IDS = 1000  # Webhook redeliveries are recognised among this many updates
+
+
+def update_chat_key(update: dict):
+    """Key used to keep updates from one chat in order."""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if field in update:
+            return update[field].get('chat', {}).get('id')
+    return None
+
+
+class UpdatePoller:
+    """Fetches updates with long polling and runs them on worker threads."""
+
+    def __init__(self, api: BotApiClient, handler: Callable[[dict], None],
+                 workers: int = UPDATE_WORKERS, poll_timeout: int = LONG_POLL_TIMEOUT,
+                 max_pending: int = MAX_PENDING_UPDATES, offset: int = 0,
+                 on_commit: Optional[Callable[[int], None]] = None,
+                 is_urgent: Optional[Callable[[dict], bool]] = None):
+        """
+        Args:
+            api: Bot API client
+            handler: Called with each update dict on a worker thread
+            workers: Number of updates processed concurrently
+            poll_timeout: Server-side getUpdates timeout in seconds
+            max_pending: Unfinished updates allowed before fetching pauses
+            offset: First update_id to request
+            on_commit: Called with the new committed offset as it advances
+            is_urgent: Returns True for updates that must run immediately
+        """
+        self.api = api
+        self.handler = handler
+        self.poll_timeout = poll_timeout
+        self.on_commit = on_commit
+        self.is_urgent = is_urgent
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='update-worker')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._fetch_offset = offset
+        self._committed_offset = offset
+        self._unfinished = []
+        self._finished = set()
+        self._chat_queues = {}
+        self._recent = OrderedDict()
+
+    @property
+    def committed_offset(self) -> int:
+        """Lowest update_id that has not finished processing."""
+        with self._lock:
+            return self._committed_offset
+
+    def run(self):
+        """Poll until stop() is called."""
+        logger.info("Starting bot polling...")
+        while not self._stop.is_set():
+            try:
+                updates = self.api.call(
+                    'getUpdates',
+                    {
+                        'offset': self._fetch_offset or None,
+                        'timeout': self.poll_timeout,
+                        'allowed_updates': ['message']
+                    },
+                    timeout=self.poll_timeout + 10
+                )
+            except Exception as e:
+                logger.error(f"Polling error: {e}")
+                self._stop.wait(5)  # Wait 5 seconds before retrying
+                continue
+
+            for update in updates or []:
+                update_id = update['update_id']
+                if update_id < self._fetch_offset:
+                    continue
+                self._fetch_offset = update_id + 1
+                self._dispatch(update)
+
+    def feed(self, update: dict) -> bool:
+        """
+        Dispatch an update pushed by a webhook without blocking.
+
+        Args:
+            update: Update dict as delivered by Telegram
+
+        Returns:
+            False if too many updates are unfinished to take it now
+        """
+        update_id = update['update_id']
+        with self._lock:
+            if update_id in self._recent:
+                # Telegram redelivered an update whose acknowledgement was lost
+                return True
+        if self._urgent(update):
+            with self._lock:
+                self._remember(update_id)
+            self._run_urgent(update)
+            return True
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._remember(update_id)
+        self._enqueue(update)
+        return True
+
+    def stop(self, wait: bool = True):
+        """
+        Stop polling and shut down the workers.
+
+        Args:
+            wait: Block until running updates finish
+        """
+        self._stop.set()
+        self._pool.shutdown(wait=wait)
+
+    def _remember(self, update_id: int):
+        """Record a webhook update_id to recognise redeliveries; call with the lock held."""
+        self._recent[update_id] = None
+        while len(self._recent) > RECENT_UPDATE_IDS:
+            self._recent.popitem(last=False)
+
+    def _urgent(self, update: dict) -> bool:
+        if not self.is_urgent:
+            return False
+        try:
+            return self.is_urgent(update)
+        except Exception as e:
+            logger.error(f"Error classifying update {update['update_id']}: {e}")
+            return False
+
+    def _dispatch(self, update: dict):
+        """Queue an update behind any unfinished updates from the same chat."""
+        if self._urgent(update):
+            self._run_urgent(update)
+            return
+        # Backpressure: do not fetch further than max_pending updates ahead
+        while not self._slots.acquire(timeout=1):
+            if self._stop.is_set():
+                return
+        self._enqueue(update)
+
+    def _enqueue(self, update: dict):
+        """Run an update, holding a slot, after earlier updates from its chat."""
+        update_id = update['update_id']
+        key = update_chat_key(update)
+        if key is None:
+            key = ('update', update_id)
+
+        with self._lock:
+            heapq.heappush(self._unfinished, update_id)
+            chat_queue = self._chat_queues.get(key)
+            if chat_queue is not None:
+                chat_queue.append(update)
+                return
+            self._chat_queues[key] = deque()
+        self._pool.submit(self._run_chat, key, update)
+
+    def _run_urgent(self, update: dict):
+        """Run an update now on its own thread, outside the chat queues and slots."""
+        with self._lock:
+            heapq.heappush(self._unfinished, update['update_id'])
+        threading.Thread(target=self._run_one, args=(update,),
+                         name='update-urgent', daemon=True).start()
+
+    def _run_one(self, update: dict):
+        try:
+            self.handler(update)
+        except Exception as e:
+            logger.error(f"Error processing update {update['update_id']}: {e}")
+        self._complete(update['update_id'], holds_slot=False)
+
+    def _run_chat(self, key, update: dict):
+        """Process one chat's queued updates in order."""
+        while update is not None:
+            started = time.monotonic()
+            try:
+                self.handler(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update['update_id']}: {e}")
+            logger.debug(f"Update {update['update_id']} took {time.monotonic() - started:.2f}s")
+            self._complete(update['update_id'])
+
+            with self._lock:
+                chat_queue = self._chat_queues[key]
+                if chat_queue:
+                    update = chat_queue.popleft()
+                else:
+                    del self._chat_queues[key]
+                    update = None
+
+    def _complete(self, update_id: int, holds_slot: bool = True):
+        """Mark an update finished and advance the committed offset."""
+        committed = None
+        with self._lock:
+            self._finished.add(update_id)
+            while self._unfinished and self._unfinished[0] in self._finished:
+                done_id = heapq.heappop(self._unfinished)
+                self._finished.discard(done_id)
+                self._committed_offset = done_id + 1
+                committed = self._committed_offset
+        if holds_slot:
+            self._slots.release()
+
+        if committed is not None and self.on_commit:
+            try:
+                self.on_commit(committed)
+            except Exception as e:
+                logger.error(f"Error committing offset {committed}: {e}")
@@ -3,10 +3,45 @@ Video processing module for applying watermarks using FFmpeg.
 """
 
 import os
-import tempfile
+import glob
+import threading
+import time
 import ffmpeg
 import logging
-from typing import Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from typing import Callable, List, Tuple, Optional
+
+from config import (
+    TEMP_DIR,
+    FONT_FILE,
+    FONT_COLOR,
+    FONT_OUTLINE_COLOR,
+    FONT_OUTLINE_WIDTH,
+    VIDEO_CODEC,
+    MAX_UPLOAD_SIZE,
+    THUMBNAIL_MAX_SIDE,
+    AUDIO_CODEC,
+    AUDIO_COPY_CODECS,
+    SEGMENTED_MIN_DURATION,
+    SEGMENTED_MIN_DIMENSION,
+    SEGMENT_WORKERS,
+    SEGMENT_MIN_SECONDS
+)
+from cancellation import CancelToken, JobCancelledError, encode_deadline
+from cpu_governor import CpuGovernor, thread_args
+from encoder_profiles import EncoderProfile, profile_settings, record_profile, select_profile
+from ffmpeg_progress import EncodeProgress, run_passes, run_with_progress
+from media_probe import MediaInfo, probe
+from metrics import record_encode, record_stage, track_stage
+from output_metadata import (FASTSTART_ARGS, THUMBNAIL_ARGS, OutputMetadata, companion_paths,
+                             thumbnail_path, thumbnail_position)
+from renditions import existing_renditions, remove_renditions, rendition_path, renditions_for
+from size_budget import SizeBudget, plan_budget, remove_pass_logs, two_pass_commands
+from spool_manager import SpoolManager
+from streaming_ingest import StreamingIngest
+from throughput_model import ThroughputModel
+from watermark_renderer import WatermarkRenderer
 
 logger = logging.getLogger(__name__)
 
@@ -14,33 +49,82 @@ class VideoProcessor:
     """Handles video watermarking operations."""
     
     def __init__(self):
-        self.temp_dir = "/tmp/telegram_bot"
-        os.makedirs(self.temp_dir, exist_ok=True)
+        self.temp_dir = TEMP_DIR
+        self.spool = SpoolManager(self.temp_dir)
+        self.watermark_renderer = WatermarkRenderer()
+        self.streaming_ingest = StreamingIngest()
+        self.throughput_model = ThroughputModel()
+        self.cpu_governor = CpuGovernor()
+        self.output_metadata = OutputMetadata()
+        # Jobs waiting for an encoder, for choosing encoder profiles; set by the bot
+        self.queue_depth: Callable[[], int] = lambda: 0
     
-    def get_video_info(self, input_path: str) -> Tuple[int, int, float]:
+    def get_media_info(self, input_path: str) -> MediaInfo:
         """
-        Get video dimensions and duration.
+        Probe a video once for everything the encode plan needs.
         
         Args:
             input_path: Path to input video file
             
         Returns:
-            Tuple of (width, height, duration)
+            MediaInfo for the video
         """
         try:
-            probe = ffmpeg.probe(input_path)
-            video_stream = next(
-                stream for stream in probe['streams'] 
-                if stream['codec_type'] == 'video'
-            )
-            width = int(video_stream['width'])
-            height = int(video_stream['height'])
-            duration = float(video_stream.get('duration', 0))
-            return width, height, duration
+            with track_stage('probe'):
+                return probe(input_path)
         except Exception as e:
             logger.error(f"Error getting video info: {e}")
             raise
     
+    def get_video_info(self, input_path: str) -> Tuple[int, int, float]:
+        """
+        Get video dimensions and duration.
+        
+        Args:
+            input_path: Path to input video file
+            
+        Returns:
+            Tuple of (width, height, duration), dimensions as displayed
+        """
+        info = self.get_media_info(input_path)
+        return info.width, info.height, info.duration
+    
+    def encoder_settings(self) -> dict:
+        """
+        Settings that change the encoded output, used to key cached results.
+        
+        Returns:
+            Dictionary of font and encoder settings
+        """
+        return {
+            'renderer': 'overlay',
+            'font_file': FONT_FILE,
+            'font_color': FONT_COLOR,
+            'outline_color': FONT_OUTLINE_COLOR,
+            'outline_width': FONT_OUTLINE_WIDTH,
+            'vcodec': VIDEO_CODEC,
+            'profiles': profile_settings(),
+            'size_limit': MAX_UPLOAD_SIZE,
+            'pix_fmt': 'yuv420p',
+            'acodec': AUDIO_CODEC,
+            'audio_copy': list(AUDIO_COPY_CODECS)
+        }
+    
+    def choose_profile(self, info: MediaInfo) -> EncoderProfile:
+        """
+        Pick the encoder profile for a video from its size and the queue.
+        
+        Args:
+            info: Probe result for the video
+            
+        Returns:
+            The EncoderProfile to encode with
+        """
+        load = self.queue_depth()
+        profile = select_profile(info.duration, info.width, info.height, load)
+        record_profile(profile, info.width, info.height, load)
+        return profile
+    
     def calculate_font_size(self, width: int, height: int) -> int:
         """
         Calculate appropriate font size based on video resolution.
@@ -66,7 +150,12 @@ class VideoProcessor:
             return 20
     
     def apply_watermarks(self, input_path: str, output_path: str, 
-                        watermark_text: str, site_text: str) -> bool:
+                        watermark_text: str, site_text: str,
+                        info: Optional[MediaInfo] = None,
+                        on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+                        cancel: Optional[CancelToken] = None,
+                        threads: Optional[int] = None,
+                        profile: Optional[EncoderProfile] = None) -> bool:
         """
         Apply watermarks to video using FFmpeg.
         
@@ -75,96 +164,519 @@ class VideoProcessor:
             output_path: Path for output video
             watermark_text: Bottom right watermark text
             site_text: Top center watermark text
+            info: Probe result for input_path, probed here if not given
+            on_progress: Called with encode progress from a worker thread
+            cancel: Token that stops the encode; it is also cancelled when
+                the encode overruns its deadline
+            threads: Encoder threads already leased by the caller; leased
+                from the CPU governor if not given
+            profile: Encoder profile, chosen from the video and the queue
+                if not given
             
         Returns:
             True if successful, False otherwise
+            
+        Raises:
+            JobCancelledError: If the job was cancelled or overran its deadline
         """
+        cancel = cancel or CancelToken()
         try:
             # Get video information
-            width, height, duration = self.get_video_info(input_path)
+            if info is None:
+                info = self.get_media_info(input_path)
+            profile = profile or self.choose_profile(info)
+            width, height = profile.output_size(info.width, info.height)
             font_size = self.calculate_font_size(width, height)
             
-            logger.info(f"Processing video: {width}x{height}, font_size: {font_size}")
-            
-            # Calculate positions
-            # Bottom right watermark position (with padding)
-            bottom_right_x = f"w-tw-{font_size//2}"  # Right edge minus text width minus padding
-            bottom_right_y = f"h-th-{font_size//2}"  # Bottom edge minus text height minus padding
-            
-            # Top center watermark position
-            top_center_x = "(w-tw)/2"  # Centered horizontally
-            top_center_y = str(font_size//2)  # Top edge plus padding
-            
-            # Create filter complex for dual watermarks
-            filter_complex = [
-                # First watermark (bottom right)
-                f"drawtext=text='{watermark_text}'"
-                f":fontsize={font_size}"
-                f":fontcolor=white"
-                f":borderw=2"
-                f":bordercolor=black"
-                f":x={bottom_right_x}"
-                f":y={bottom_right_y}"
-                f":font=/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                
-                # Second watermark (top center) 
-                f"drawtext=text='{site_text}'"
-                f":fontsize={font_size}"
-                f":fontcolor=white"
-                f":borderw=2"
-                f":bordercolor=black"
-                f":x={top_center_x}"
-                f":y={top_center_y}"
-                f":font=/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-            ]
-            
-            # Build FFmpeg command
-            input_stream = ffmpeg.input(input_path)
-            
-            # Apply video filters
-            video = input_stream.video.filter('drawtext', 
-                text=watermark_text,
-                fontsize=font_size,
-                fontcolor='white',
-                borderw=2,
-                bordercolor='black',
-                x=bottom_right_x,
-                y=bottom_right_y,
-                fontfile='/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
-            ).filter('drawtext',
-                text=site_text,
-                fontsize=font_size,
-                fontcolor='white', 
-                borderw=2,
-                bordercolor='black',
-                x=top_center_x,
-                y=top_center_y,
-                fontfile='/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
+            logger.info(
+                f"Processing video: {info.width}x{info.height} {info.video_codec}, "
+                f"audio: {info.audio_codec or 'none'}, font_size: {font_size}"
             )
             
-            # Copy audio stream
-            audio = input_stream.audio
+            # Both texts are rasterized once into an RGBA overlay and
+            # composited with a single filter instead of per-frame drawtext
+            overlay_path = self.watermark_renderer.render(
+                width, height, font_size, watermark_text, site_text
+            )
+            
+            # The bitrate is capped so the output fits one upload; segments
+            # are encoded independently and so always use a single pass
+            segmented = self.should_segment(info)
+            budget = plan_budget(info, width, height)
+            if budget and segmented:
+                budget = SizeBudget(budget.bit_rate)
+            passes = 2 if budget and budget.two_pass else 1
+            
+            # An encode far slower than predicted is cancelled, not waited on
+            deadline = encode_deadline(passes * self.throughput_model.predict_seconds(
+                info.duration, width, height, profile.preset
+            ))
+            started = time.monotonic()
+            try:
+                with cancel.deadline(deadline), \
+                        (nullcontext(threads) if threads else self.cpu_governor.lease()) as threads:
+                    # Long, large videos are encoded in parallel segments
+                    if segmented:
+                        success = self.apply_watermarks_segmented(
+                            input_path, output_path, overlay_path, info, on_progress, cancel,
+                            threads, profile, budget
+                        )
+                    else:
+                        # Run FFmpeg command, following its progress; the same
+                        # run writes the thumbnail
+                        out = self._watermark_output(input_path, output_path, overlay_path,
+                                                     info, threads, profile, budget,
+                                                     thumbnail_path(output_path))
+                        cmd = out.overwrite_output().compile()
+                        if passes == 2:
+                            passlog = f"{output_path}.passlog"
+                            try:
+                                run_passes(two_pass_commands(cmd, output_path, passlog),
+                                           info.duration, on_progress, cancel=cancel)
+                            finally:
+                                remove_pass_logs(passlog)
+                        else:
+                            run_with_progress(cmd, info.duration, on_progress, cancel=cancel)
+                        logger.info(f"Successfully applied watermarks to video")
+                        success = True
+            except Exception:
+                record_stage('encode', time.monotonic() - started, success=False)
+                raise
+            
+            elapsed = time.monotonic() - started
+            record_stage('encode', elapsed, success)
+            if success:
+                # The profile may have dropped frames to cap the frame rate
+                frame_rate = profile.output_fps(info.frame_rate) or info.frame_rate
+                record_encode(elapsed, info.duration * frame_rate)
+                self._remember_outputs(output_path, width, height, info.duration)
+                # The model learns single-pass speed; the first pass is
+                # cheaper than the second, so this errs on the slow side
+                self.throughput_model.record(width, height, info.duration, elapsed / passes,
+                                             profile.preset)
+            return success
             
-            # Output with same codec to maintain quality
-            out = ffmpeg.output(
-                video, audio, output_path,
-                vcodec='libx264',
-                acodec='aac',
-                preset='medium',
-                crf=23
+        except JobCancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error applying watermarks: {e}")
+            return False
+    
+    def build_watermark_command(self, source: str, output_path: str, info: MediaInfo,
+                                watermark_text: str, site_text: str,
+                                threads: int, profile: EncoderProfile,
+                                budget: Optional[SizeBudget] = None) -> List[str]:
+        """
+        Build the single-pass FFmpeg command line for a video.
+        
+        Used when FFmpeg is driven directly, e.g. when the input is piped
+        in while it is still downloading. The command also writes the
+        output's thumbnail.
+        
+        Args:
+            source: Input path or URL, or 'pipe:0' for stdin
+            output_path: Path for output video
+            info: Probe result for the source
+            watermark_text: Bottom right watermark text
+            site_text: Top center watermark text
+            threads: Encoder threads leased from the CPU governor
+            profile: Encoder profile to encode with
+            budget: Single-pass bitrate cap for the output size, if any
+            
+        Returns:
+            FFmpeg argument list
+        """
+        width, height = profile.output_size(info.width, info.height)
+        font_size = self.calculate_font_size(width, height)
+        overlay_path = self.watermark_renderer.render(
+            width, height, font_size, watermark_text, site_text
+        )
+        out = self._watermark_output(source, output_path, overlay_path, info, threads, profile,
+                                     budget, thumbnail_path(output_path))
+        return out.overwrite_output().compile()
+    
+    def _watermark_output(self, source: str, output_path: str, overlay_path: str,
+                          info: MediaInfo, threads: int, profile: EncoderProfile,
+                          budget: Optional[SizeBudget] = None,
+                          thumbnail: Optional[str] = None):
+        """
+        Build the single-pass FFmpeg graph for a video.
+        
+        Args:
+            source: Input path, URL or pipe
+            output_path: Path for output video
+            overlay_path: Path to the rendered watermark overlay
+            info: Probe result for the source
+            threads: Decoder and encoder threads
+            profile: Encoder profile to encode with
+            budget: Bitrate cap for the output size, if any
+            thumbnail: Path for a JPEG thumbnail written by the same run
+            
+        Returns:
+            ffmpeg-python output node
+        """
+        input_stream = ffmpeg.input(source, threads=threads)
+        watermark = ffmpeg.input(overlay_path)
+        
+        # Apply watermark overlay
+        video = self._conform(input_stream.video, info, profile)
+        video = ffmpeg.overlay(video, watermark, x=0, y=0)
+        
+        # Inputs without audio produce a video-only output
+        audio = input_stream['a:0'] if info.has_audio else None
+        video, extra_outputs = self._extra_outputs(
+            video, audio, output_path, info, profile, threads, thumbnail, FASTSTART_ARGS
+        )
+        streams = [video] + ([audio] if audio else [])
+        
+        # Output with same codec to maintain quality
+        out = ffmpeg.output(
+            *streams, output_path,
+            **self._audio_encode_args(info),
+            **self._video_encode_args(threads, profile, budget),
+            **FASTSTART_ARGS
+        )
+        return ffmpeg.merge_outputs(out, *extra_outputs) if extra_outputs else out
+    
+    def _extra_outputs(self, video, audio, output_path: str, info: MediaInfo,
+                       profile: EncoderProfile, threads: int, thumbnail: Optional[str],
+                       container_args: dict):
+        """
+        Split the watermarked video between the main output, the thumbnail
+        and the configured renditions, so all of them share one decode.
+        
+        Args:
+            video: ffmpeg-python stream of the watermarked video
+            audio: ffmpeg-python audio stream, or None for video-only outputs
+            output_path: Path of the main output; renditions are written next to it
+            info: Probe result for the source
+            profile: Encoder profile of the main output
+            threads: Encoder threads of the main output
+            thumbnail: Path for a JPEG thumbnail, if one is wanted
+            container_args: Muxer options for the renditions
+            
+        Returns:
+            (video stream for the main output, list of extra output nodes)
+        """
+        width, height = profile.output_size(info.width, info.height)
+        renditions = renditions_for(width, height)
+        if not thumbnail and not renditions:
+            return video, []
+        
+        split = video.split()
+        outputs = []
+        if thumbnail:
+            outputs.append(self._thumbnail_output(split[1], thumbnail, info))
+        frame_rate = profile.output_fps(info.frame_rate) or info.frame_rate
+        for index, rendition in enumerate(renditions, start=2 if thumbnail else 1):
+            rendition_width, rendition_height = rendition.profile.output_size(width, height)
+            stream = split[index].filter('scale', rendition_width, rendition_height)
+            fps = rendition.profile.output_fps(frame_rate)
+            if fps:
+                stream = stream.filter('fps', fps=fps)
+            # Renditions get threads in proportion to their share of the pixels
+            rendition_threads = max(1, round(
+                threads * rendition_width * rendition_height / (width * height)
+            ))
+            budget = plan_budget(info, rendition_width, rendition_height)
+            outputs.append(ffmpeg.output(
+                *([stream] + ([audio] if audio else [])),
+                rendition_path(output_path, rendition.name),
+                **(self._audio_encode_args(info) if audio else {}),
+                **self._video_encode_args(rendition_threads, rendition.profile,
+                                          budget and SizeBudget(budget.bit_rate)),
+                **container_args
+            ))
+        return split[0], outputs
+    
+    def _thumbnail_output(self, video, thumbnail: str, info: MediaInfo):
+        """
+        Output node writing one frame of the watermarked video as a JPEG.
+        
+        Args:
+            video: ffmpeg-python stream of the watermarked video
+            thumbnail: Path for the thumbnail
+            info: Probe result for the source
+            
+        Returns:
+            ffmpeg-python output node
+        """
+        still = video.filter('select', f"gte(t,{thumbnail_position(info.duration):.3f})").filter(
+            'scale', THUMBNAIL_MAX_SIDE, THUMBNAIL_MAX_SIDE, force_original_aspect_ratio='decrease'
+        )
+        return ffmpeg.output(still, thumbnail, **THUMBNAIL_ARGS)
+    
+    def _conform(self, video, info: MediaInfo, profile: EncoderProfile):
+        """
+        Scale and resample a video stream to the profile's limits.
+        
+        Args:
+            video: ffmpeg-python video stream of the source
+            info: Probe result for the source
+            profile: Encoder profile to encode with
+            
+        Returns:
+            The stream, filtered only where the profile requires it
+        """
+        width, height = profile.output_size(info.width, info.height)
+        if (width, height) != (info.width, info.height):
+            video = video.filter('scale', width, height)
+        fps = profile.output_fps(info.frame_rate)
+        if fps:
+            video = video.filter('fps', fps=fps)
+        return video
+    
+    def should_segment(self, info: MediaInfo) -> bool:
+        """
+        Decide whether a video is worth encoding in parallel segments.
+        
+        Rotated videos are encoded in one pass, since the stream-copied
+        segments would not reliably keep the rotation metadata.
+        
+        Args:
+            info: Probe result for the video
+            
+        Returns:
+            True if segmented encoding should be used
+        """
+        return (
+            SEGMENT_WORKERS > 1
+            and info.rotation == 0
+            and info.duration >= SEGMENTED_MIN_DURATION
+            and min(info.width, info.height) >= SEGMENTED_MIN_DIMENSION
+        )
+    
+    def apply_watermarks_segmented(self, input_path: str, output_path: str,
+                                   overlay_path: str, info: MediaInfo,
+                                   on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+                                   cancel: Optional[CancelToken] = None,
+                                   threads: int = 1,
+                                   profile: Optional[EncoderProfile] = None,
+                                   budget: Optional[SizeBudget] = None) -> bool:
+        """
+        Watermark a video by encoding keyframe-aligned segments in parallel.
+        
+        The video stream is split at keyframes with a stream copy, each
+        segment is watermarked and encoded by its own FFmpeg process, and the
+        results are concatenated without re-encoding. Audio is taken from the
+        original input once, in the final mux, so segment boundaries cannot
+        introduce audio gaps.
+        
+        Args:
+            input_path: Path to input video
+            output_path: Path for output video
+            overlay_path: Path to the rendered watermark overlay
+            info: Probe result for the input
+            on_progress: Called with the combined progress of all segments
+            cancel: Token that stops the remaining stages and segment encodes
+            threads: Threads leased for the whole video, split between the
+                segments encoded at the same time
+            profile: Encoder profile, chosen here if not given
+            budget: Single-pass bitrate cap applied to every segment, if any
+            
+        Returns:
+            True if successful, False otherwise
+            
+        Raises:
+            JobCancelledError: If the job was cancelled
+        """
+        cancel = cancel or CancelToken()
+        profile = profile or self.choose_profile(info)
+        work_dir = self.spool.mkdtemp('segments_', near=output_path)
+        
+        try:
+            # Split the video stream at keyframes without re-encoding; cuts can
+            # only land on keyframes, so sparse keyframes mean longer segments
+            segment_time = max(
+                info.duration / SEGMENT_WORKERS,
+                SEGMENT_MIN_SECONDS,
+                info.keyframe_interval or 0
+            )
+            split = ffmpeg.input(input_path)['v:0'].output(
+                os.path.join(work_dir, 'source_%04d.mkv'),
+                c='copy',
+                f='segment',
+                segment_time=f"{segment_time:.3f}",
+                reset_timestamps=1
             )
+            ffmpeg.run(split, overwrite_output=True, quiet=True)
+            
+            cancel.check()
+            sources = sorted(glob.glob(os.path.join(work_dir, 'source_*.mkv')))
+            if not sources:
+                raise RuntimeError("Segmenting produced no output")
+            logger.info(f"Encoding {len(sources)} segments in parallel")
+            
+            # Watermark and encode the segments in parallel processes, within
+            # the job's share of the CPU budget
+            workers = max(1, min(len(sources), SEGMENT_WORKERS, threads))
+            segment_threads = max(1, threads // workers)
+            encoded = [source.replace('source_', 'encoded_') for source in sources]
+            segment_progress = {}
+            progress_lock = threading.Lock()
             
-            # Run FFmpeg command
-            ffmpeg.run(out, overwrite_output=True, quiet=True)
+            def report(index, progress):
+                # Combine the segments into one progress for the whole video
+                with progress_lock:
+                    segment_progress[index] = progress
+                    combined = EncodeProgress(
+                        frame=sum(p.frame for p in segment_progress.values()),
+                        fps=sum(p.fps for p in segment_progress.values() if not p.finished),
+                        speed=sum(p.speed for p in segment_progress.values() if not p.finished),
+                        out_time=sum(p.out_time for p in segment_progress.values()),
+                        duration=info.duration
+                    )
+                if on_progress:
+                    on_progress(combined)
             
-            logger.info(f"Successfully applied watermarks to video")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(
+                    lambda job: self._encode_segment(
+                        job[1], encoded[job[0]], overlay_path, info, profile, segment_threads,
+                        lambda progress: report(job[0], progress), cancel, budget,
+                        thumbnail_path(output_path) if job[0] == 0 else None
+                    ),
+                    enumerate(sources)
+                ))
+            
+            # Concatenate losslessly and mux the original audio once, for the
+            # main output and each rendition the segments were encoded with
+            cancel.check()
+            self._concat_segments(encoded, input_path, output_path, info,
+                                  os.path.join(work_dir, 'segments.txt'))
+            for rendition in renditions_for(*profile.output_size(info.width, info.height)):
+                self._concat_segments(
+                    [rendition_path(path, rendition.name) for path in encoded], input_path,
+                    rendition_path(output_path, rendition.name), info,
+                    os.path.join(work_dir, f'segments_{rendition.name}.txt')
+                )
+            
+            logger.info(f"Successfully applied watermarks to video in {len(sources)} segments")
             return True
             
+        except JobCancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error applying watermarks: {e}")
+            logger.error(f"Error applying watermarks in segments: {e}")
             return False
+        
+        finally:
+            self.spool.remove(work_dir)
+    
+    def _concat_segments(self, segments: List[str], input_path: str, output_path: str,
+                         info: MediaInfo, list_path: str):
+        """
+        Join encoded video segments without re-encoding and mux the audio.
+        
+        Args:
+            segments: Encoded segment paths, in order
+            input_path: Path to the original input, for its audio
+            output_path: Path for the joined video
+            info: Probe result for the input
+            list_path: Path for the concat demuxer's file list
+        """
+        with open(list_path, 'w') as f:
+            for path in segments:
+                f.write(f"file '{path}'\n")
+        
+        video = ffmpeg.input(list_path, f='concat', safe=0)
+        streams = [video['v:0']]
+        if info.has_audio:
+            streams.append(ffmpeg.input(input_path)['a:0'])
+        out = ffmpeg.output(
+            *streams, output_path,
+            vcodec='copy',
+            **self._audio_encode_args(info),
+            **FASTSTART_ARGS
+        )
+        ffmpeg.run(out, overwrite_output=True, quiet=True)
+    
+    def _encode_segment(self, source_path: str, output_path: str,
+                        overlay_path: str, info: MediaInfo, profile: EncoderProfile,
+                        threads: int,
+                        on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+                        cancel: Optional[CancelToken] = None,
+                        budget: Optional[SizeBudget] = None,
+                        thumbnail: Optional[str] = None):
+        """
+        Watermark and encode one video-only segment.
+        
+        Args:
+            source_path: Path to the stream-copied source segment
+            output_path: Path for the encoded segment
+            overlay_path: Path to the rendered watermark overlay
+            info: Probe result for the whole video
+            profile: Encoder profile to encode with
+            threads: Encoder threads for this segment
+            on_progress: Called with this segment's progress
+            cancel: Token that kills the segment's encode
+            budget: Single-pass bitrate cap, if any
+            thumbnail: Path for the video's thumbnail, written by the first segment
+        """
+        segment = ffmpeg.input(source_path, threads=threads)
+        watermark = ffmpeg.input(overlay_path)
+        video = self._conform(segment.video, info, profile)
+        video = ffmpeg.overlay(video, watermark, x=0, y=0)
+        # The segment's renditions are written next to it and joined like the segments
+        video, extra_outputs = self._extra_outputs(
+            video, None, output_path, info, profile, threads, thumbnail, {}
+        )
+        out = ffmpeg.output(
+            video, output_path,
+            **self._video_encode_args(threads, profile, budget)
+        )
+        if extra_outputs:
+            out = ffmpeg.merge_outputs(out, *extra_outputs)
+        run_with_progress(out.overwrite_output().compile(), on_progress=on_progress,
+                          cancel=cancel)
+    
+    def _audio_encode_args(self, info: MediaInfo) -> dict:
+        """
+        FFmpeg output options for the audio stream.
+        
+        Compatible audio is stream-copied, anything else is re-encoded, and
+        inputs without audio get no audio options at all.
+        
+        Args:
+            info: Probe result for the source
+            
+        Returns:
+            Dictionary of output keyword arguments
+        """
+        if not info.has_audio:
+            return {}
+        if info.audio_copyable:
+            return {'acodec': 'copy'}
+        return {'acodec': AUDIO_CODEC}
+    
+    def _video_encode_args(self, threads: int, profile: EncoderProfile,
+                           budget: Optional[SizeBudget] = None) -> dict:
+        """
+        FFmpeg output options for the watermarked video stream.
+        
+        The pixel format is pinned so independently encoded segments share
+        identical stream parameters and can be concatenated without seams.
+        
+        Args:
+            threads: Encoder threads
+            profile: Encoder profile with the preset, tune and CRF
+            budget: Bitrate cap for the output size, if any
+            
+        Returns:
+            Dictionary of output keyword arguments
+        """
+        return {
+            'vcodec': VIDEO_CODEC,
+            **profile.encode_args(),
+            **(budget.encode_args() if budget else {}),
+            'pix_fmt': 'yuv420p',
+            **thread_args(threads)
+        }
     
-    def process_video(self, input_path: str, watermark_text: str, site_text: str) -> Optional[str]:
+    def process_video(self, input_path: str, watermark_text: str, site_text: str,
+                      info: Optional[MediaInfo] = None,
+                      on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+                      cancel: Optional[CancelToken] = None) -> Optional[str]:
         """
         Process video with watermarks and return output path.
         
@@ -172,44 +684,151 @@ class VideoProcessor:
             input_path: Path to input video
             watermark_text: Bottom right watermark text
             site_text: Top center watermark text
+            info: Probe result for input_path, probed here if not given
+            on_progress: Called with encode progress from a worker thread
+            cancel: Token that stops the encode
             
         Returns:
             Path to processed video or None if failed
+            
+        Raises:
+            JobCancelledError: If the job was cancelled
         """
+        output_path = None
         try:
-            # Create temporary output file
-            output_fd, output_path = tempfile.mkstemp(
-                suffix='.mp4', 
-                dir=self.temp_dir,
-                prefix='watermarked_'
-            )
-            os.close(output_fd)  # Close file descriptor, we just need the path
+            # Probe once; the result drives sizing, scheduling and the command
+            if info is None:
+                info = self.get_media_info(input_path)
+            
+            # Create temporary output file, in the same spool tier as the input
+            output_path = self.spool.mkstemp('watermarked_', near=input_path)
             
             # Apply watermarks
-            success = self.apply_watermarks(input_path, output_path, watermark_text, site_text)
+            success = self.apply_watermarks(
+                input_path, output_path, watermark_text, site_text, info, on_progress, cancel
+            )
             
             if success:
                 return output_path
             else:
                 # Clean up failed output file
-                if os.path.exists(output_path):
-                    os.unlink(output_path)
+                self.cleanup_file(output_path)
                 return None
                 
+        except JobCancelledError:
+            if output_path:
+                self.cleanup_file(output_path)
+            raise
         except Exception as e:
             logger.error(f"Error processing video: {e}")
             return None
     
+    def process_url(self, url: str, input_path: str, watermark_text: str,
+                    site_text: str,
+                    on_progress: Optional[Callable[[EncodeProgress], None]] = None,
+                    cancel: Optional[CancelToken] = None) -> Optional[str]:
+        """
+        Download a video and watermark it, encoding while it downloads if possible.
+        
+        Videos that need the whole file first (moov atom at the end, or long
+        enough for segmented encoding) are encoded from disk once downloaded.
+        
+        Args:
+            url: Download URL of the source video
+            input_path: Spool path for the downloaded video
+            watermark_text: Bottom right watermark text
+            site_text: Top center watermark text
+            on_progress: Called with encode progress from a worker thread
+            cancel: Token that stops the download and the encode
+            
+        Returns:
+            Path to processed video or None if encoding failed
+            
+        Raises:
+            IngestDownloadError: If the download failed
+            JobCancelledError: If the job was cancelled
+        """
+        output_path = self.spool.mkstemp('watermarked_', near=input_path)
+        cancel = cancel or CancelToken()
+        
+        streamed_info = []
+        leases = ExitStack()
+        deadlines = ExitStack()
+        leased = []
+        
+        def build_command(source, info):
+            if self.should_segment(info):
+                return None
+            profile = self.choose_profile(info)
+            streamed_info.append((info, profile))
+            # A two-pass encode needs the whole file, so it waits for the download
+            budget = plan_budget(info, *profile.output_size(info.width, info.height))
+            if budget and budget.two_pass:
+                return None
+            # CPU is only leased once the encode starts, not for the download
+            leased.append(leases.enter_context(self.cpu_governor.lease()))
+            # The streamed encode is cancelled if it overruns like one from disk
+            deadlines.enter_context(cancel.deadline(encode_deadline(
+                self.throughput_model.predict_seconds(
+                    info.duration, *profile.output_size(info.width, info.height), profile.preset
+                )
+            )))
+            return self.build_watermark_command(
+                source, output_path, info, watermark_text, site_text, leased[0], profile, budget
+            )
+        
+        def fallback(src, dst):
+            # Encoding from disk arms a deadline of its own
+            deadlines.close()
+            return self.apply_watermarks(
+                src, dst, watermark_text, site_text, on_progress=on_progress,
+                cancel=cancel, threads=leased[0] if leased else None,
+                profile=streamed_info[0][1] if streamed_info else None
+            )
+        
+        try:
+            with leases, deadlines:
+                result = self.streaming_ingest.run(
+                    url, input_path, output_path, build_command, fallback,
+                    on_progress=on_progress,
+                    cancel=cancel
+                )
+        except Exception:
+            self.cleanup_file(output_path)
+            raise
+        
+        if result.success:
+            if result.streamed and streamed_info:
+                info, profile = streamed_info[0]
+                width, height = profile.output_size(info.width, info.height)
+                self._remember_outputs(output_path, width, height, info.duration)
+                self.throughput_model.record(
+                    width, height, info.duration, result.encode_seconds, profile.preset
+                )
+            return output_path
+        self.cleanup_file(output_path)
+        return None
+    
+    def _remember_outputs(self, output_path: str, width: int, height: int, duration: float):
+        """Record the attributes of a finished output and of its renditions."""
+        self.output_metadata.remember(output_path, width, height, duration)
+        for rendition, path in existing_renditions(output_path):
+            self.output_metadata.remember(
+                path, *rendition.profile.output_size(width, height), duration
+            )
+    
     def cleanup_file(self, file_path: str):
         """
-        Clean up temporary file.
+        Clean up temporary file, releasing its job's spool space with the
+        job's last file.
         
         Args:
             file_path: Path to file to delete
         """
-        try:
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-                logger.info(f"Cleaned up temporary file: {file_path}")
-        except Exception as e:
-            logger.error(f"Error cleaning up file {file_path}: {e}")
+        for path in remove_renditions(file_path):
+            self.output_metadata.forget(path)
+        self.output_metadata.forget(file_path)
+        # A resumed job's reservation also holds the output's thumbnail and renditions
+        for path in companion_paths(file_path):
+            self.spool.remove(path)
+        self.spool.remove(file_path)
@@ -0,0 +1,142 @@
+"""
+Pre-rendered watermark overlays.
+
+Both watermark texts are rasterized once per (resolution, font size, text)
+into a transparent RGBA PNG with Pillow, so FFmpeg only has to composite a
+single image with one ``overlay`` filter instead of laying out and drawing
+the glyphs with two ``drawtext`` filters on every frame.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config import (
+    TEMP_DIR,
+    FONT_FILE,
+    FONT_COLOR,
+    FONT_OUTLINE_COLOR,
+    FONT_OUTLINE_WIDTH
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WatermarkRenderer:
+    """Renders and caches full-frame RGBA watermark overlays."""
+
+    def __init__(self, cache_dir: str = os.path.join(TEMP_DIR, "overlays"),
+                 font_file: str = FONT_FILE):
+        self.cache_dir = cache_dir
+        self.font_file = font_file
+        self._lock = threading.Lock()
+        self._rendered = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def render(self, width: int, height: int, font_size: int,
+               watermark_text: str, site_text: str) -> str:
+        """
+        Get the overlay PNG for a frame size, rendering it on first use.
+
+        Args:
+            width: Video width
+            height: Video height
+            font_size: Font size in pixels
+            watermark_text: Bottom right watermark text
+            site_text: Top center watermark text
+
+        Returns:
+            Path to the RGBA PNG overlay
+        """
+        params = (width, height, font_size, watermark_text, site_text,
+                  self.font_file, FONT_COLOR, FONT_OUTLINE_COLOR, FONT_OUTLINE_WIDTH)
+
+        with self._lock:
+            cached = self._rendered.get(params)
+            if cached and os.path.exists(cached):
+                return cached
+
+            digest = hashlib.sha256(json.dumps(params).encode()).hexdigest()[:16]
+            overlay_path = os.path.join(self.cache_dir, f"overlay_{digest}.png")
+
+            if not os.path.exists(overlay_path):
+                image = self.render_image(width, height, font_size, watermark_text, site_text)
+                tmp_path = f"{overlay_path}.{os.getpid()}.tmp"
+                image.save(tmp_path, format='PNG')
+                os.replace(tmp_path, overlay_path)
+                logger.info(f"Rendered watermark overlay {width}x{height}, font_size: {font_size}")
+
+            self._rendered[params] = overlay_path
+            return overlay_path
+
+    def render_image(self, width: int, height: int, font_size: int,
+                     watermark_text: str, site_text: str) -> Image.Image:
+        """
+        Rasterize both watermark texts onto a transparent frame.
+
+        Positions match the drawtext layout used previously: the watermark
+        sits in the bottom right corner and the site text is centered at the
+        top, each padded by half the font size.
+
+        Args:
+            width: Video width
+            height: Video height
+            font_size: Font size in pixels
+            watermark_text: Bottom right watermark text
+            site_text: Top center watermark text
+
+        Returns:
+            RGBA image of the watermark layer
+        """
+        image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        font = self._load_font(font_size)
+        padding = font_size // 2
+
+        # Bottom right watermark
+        text_width, text_height, offset = self._measure(draw, watermark_text, font)
+        self._draw_text(
+            draw, watermark_text, font,
+            (width - text_width - padding, height - text_height - padding), offset
+        )
+
+        # Top center watermark
+        text_width, text_height, offset = self._measure(draw, site_text, font)
+        self._draw_text(
+            draw, site_text, font,
+            ((width - text_width) // 2, padding), offset
+        )
+
+        return image
+
+    def _load_font(self, font_size: int):
+        """Load the watermark font, falling back to Pillow's built-in font."""
+        try:
+            return ImageFont.truetype(self.font_file, font_size)
+        except OSError:
+            logger.warning(f"Font {self.font_file} not found, using default font")
+            return ImageFont.load_default(font_size)
+
+    def _measure(self, draw: ImageDraw.ImageDraw, text: str, font) -> Tuple[int, int, Tuple[int, int]]:
+        """Return the outlined text's width, height and bounding box offset."""
+        left, top, right, bottom = draw.textbbox(
+            (0, 0), text, font=font, stroke_width=FONT_OUTLINE_WIDTH
+        )
+        return right - left, bottom - top, (left, top)
+
+    def _draw_text(self, draw: ImageDraw.ImageDraw, text: str, font,
+                   position: Tuple[int, int], offset: Tuple[int, int]):
+        """Draw outlined text so its visible box starts at position."""
+        draw.text(
+            (position[0] - offset[0], position[1] - offset[1]),
+            text,
+            font=font,
+            fill=FONT_COLOR,
+            stroke_width=FONT_OUTLINE_WIDTH,
+            stroke_fill=FONT_OUTLINE_COLOR
+        )